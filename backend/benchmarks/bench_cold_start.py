@@ -0,0 +1,88 @@
+"""Cold-start benchmark: time to first successful /api/health and /api/invoices.
+
+Starts the API in a fresh process (uvicorn by default, or gunicorn with
+--gunicorn), then polls until /api/health answers 200 and an authenticated
+/api/invoices answers 200. A throwaway user and session are inserted
+directly into MongoDB for the authenticated request.
+
+    MONGO_URL=mongodb://localhost:27017 python backend/benchmarks/bench_cold_start.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+import httpx
+from pymongo import MongoClient
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+# Never the configured DB_NAME: the run ends by dropping this database, and
+# the server subprocesses inherit it (.env does not override the environment)
+DB_NAME = os.environ["DB_NAME"] = "invoice_sync_bench"
+
+
+def create_session(mongo):
+    db = mongo[DB_NAME]
+    user_id = f"user_{uuid.uuid4().hex[:12]}"
+    token = uuid.uuid4().hex
+    db.users.insert_one({"user_id": user_id, "email": f"{user_id}@bench.example", "name": "Bench"})
+    db.user_sessions.insert_one({
+        "user_id": user_id,
+        "session_token": token,
+        "expires_at": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat(),
+    })
+    return token
+
+
+def wait_for(url, headers, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(url, headers=headers, timeout=1).status_code == 200:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(url)
+
+
+def cold_start(command, port, token):
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + 60
+        base = f"http://127.0.0.1:{port}/api"
+        health = wait_for(f"{base}/health", {}, deadline) - start
+        invoices = wait_for(f"{base}/invoices", {"Authorization": f"Bearer {token}"}, deadline) - start
+        return health, invoices
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(runs, port, use_gunicorn):
+    mongo = MongoClient(os.environ["MONGO_URL"])
+    token = create_session(mongo)
+    if use_gunicorn:
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{port}", "server:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port)]
+
+    results = [cold_start(command, port, token) for _ in range(runs)]
+    for label, values in (("/api/health", [r[0] for r in results]), ("/api/invoices", [r[1] for r in results])):
+        print(f"{label:14s} median {statistics.median(values) * 1000:7.0f} ms  "
+              f"max {max(values) * 1000:7.0f} ms  over {runs} cold starts")
+    mongo.drop_database(DB_NAME)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--gunicorn", action="store_true")
+    args = parser.parse_args()
+    main(args.runs, args.port, args.gunicorn)
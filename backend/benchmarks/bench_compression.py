@@ -0,0 +1,107 @@
+"""List response benchmark: bytes on the wire and server CPU per request.
+
+Serves 1000 invoices and 1000 email scans (the list endpoints' limit) through
+cached_json_response and compares, per encoding, the uncached first request,
+warm requests, and conditional requests answered with 304. The baseline is
+the list endpoints' previous behaviour: return the documents and let
+FastAPI encode them uncompressed on every request. The loader stands
+in for the Mongo query, so no database is needed.
+
+    python backend/benchmarks/bench_compression.py --requests 200
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "invoice_sync_bench")
+os.environ["RESPONSE_CACHE_GENERATIONS"] = "memory"
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from server import cached_json_response, email_scan_record, invoice_record, response_cache  # noqa: E402
+
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+def sample_lists(size):
+    now = datetime.now(timezone.utc).isoformat()
+    invoices = [invoice_record("user_bench", f"INV-2024-{i:05d}", "not_updated", now) for i in range(size)]
+    scans = [email_scan_record("user_bench", {
+        "email_id": f"email_{i:05d}",
+        "subject": f"Tax Invoice INV-2024-{i:05d} attached",
+        "sender": "vendor@example.com",
+        "date": "2024-01-01 10:00",
+        "has_attachment": True,
+        "extracted_invoice_numbers": [f"INV-2024-{i:05d}"],
+        "matched_invoice": f"INV-2024-{i:05d}",
+        "status": "matched",
+    }, now) for i in range(size)]
+    return {"invoices": invoices, "email-scans": scans}
+
+
+def build_app(lists, loads, server_cpu):
+    app = FastAPI()
+
+    @app.get("/baseline/{endpoint}")
+    async def baseline(endpoint: str):
+        loads.append(endpoint)
+        return lists[endpoint]
+
+    @app.get("/cached/{endpoint}")
+    async def cached(request: Request, endpoint: str):
+        async def load():
+            loads.append(endpoint)
+            return lists[endpoint]
+        return await cached_json_response(request, "user_bench", endpoint, load)
+
+    async def timed(scope, receive, send):
+        # The app runs on the test client's portal thread; time only that
+        # thread so client-side decompression is not counted
+        start = time.thread_time()
+        await app(scope, receive, send)
+        server_cpu.append(time.thread_time() - start)
+
+    return timed
+
+
+def main(requests, size):
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    lists = sample_lists(size)
+    loads, server_cpu = [], []
+    client = TestClient(build_app(lists, loads, server_cpu))
+
+    def measure(mode, path, count, headers):
+        loads.clear()
+        server_cpu.clear()
+        for _ in range(count):
+            resp = client.get(path, headers=headers)
+        cpu_ms = sum(server_cpu) * 1000 / count
+        print(f"{endpoint:12} {mode:22} {resp.status_code:>6} {resp.num_bytes_downloaded:>9} "
+              f"{cpu_ms:>11.3f} {len(loads):>6}")
+
+    print(f"{'endpoint':12} {'mode':22} {'status':>6} {'bytes':>9} {'cpu ms/req':>11} {'loads':>6}")
+    for endpoint in lists:
+        measure("baseline", f"/baseline/{endpoint}", requests, {"Accept-Encoding": "identity"})
+        for encoding in ENCODINGS:
+            asyncio.run(response_cache.invalidate("user_bench"))
+            headers = {"Accept-Encoding": encoding}
+            measure(f"{encoding} uncached", f"/cached/{endpoint}", 1, headers)
+            measure(f"{encoding} warm", f"/cached/{endpoint}", requests, headers)
+        etag = client.get(f"/cached/{endpoint}").headers["ETag"]
+        measure("conditional (304)", f"/cached/{endpoint}", requests, {"If-None-Match": etag})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--size", type=int, default=1000)
+    args = parser.parse_args()
+    main(args.requests, args.size)
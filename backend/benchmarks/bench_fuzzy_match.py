@@ -0,0 +1,115 @@
+"""Fuzzy matching benchmark: precision/recall vs. latency for InvoiceMatcher.
+
+Generates N synthetic "not updated" invoice numbers, then queries with
+vendor-style typos (confusable characters, dropped/extra characters,
+dropped prefixes, missing separators). Reports per-tier recall, top-1
+precision and per-query latency, with a linear scan over the same folded
+keys for comparison. No database needed.
+
+    python backend/benchmarks/bench_fuzzy_match.py --sizes 1000,10000,50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "invoice_sync_bench")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from server import (  # noqa: E402
+    CONFUSABLES, InvoiceMatcher, fuzzy_distance_limit, levenshtein, normalize_invoice_number,
+)
+
+PREFIXES = ["INV", "TAX", "BIL", "PO", "GST"]
+TYPO_CHARS = "ABCDEFGHJKMNPRTUVWXY0123456789"
+CONFUSE = {"0": "O", "1": "I", "5": "S", "8": "B", "2": "Z"}
+
+
+def invoice_numbers(count, rng):
+    numbers = set()
+    while len(numbers) < count:
+        numbers.add(f"{rng.choice(PREFIXES)}-{rng.randint(2019, 2025)}-{rng.randint(1, 99999):05d}")
+    return sorted(numbers)
+
+
+def typo(number, rng):
+    kind = rng.choice(["confusable", "substitute", "delete", "insert", "drop_prefix", "no_separators"])
+    chars = list(number)
+    if kind == "confusable":
+        positions = [i for i, c in enumerate(chars) if c in CONFUSE]
+        i = rng.choice(positions)
+        chars[i] = CONFUSE[chars[i]]
+    elif kind == "substitute":
+        i = rng.randrange(len(chars))
+        chars[i] = rng.choice(TYPO_CHARS)
+    elif kind == "delete":
+        del chars[rng.randrange(len(chars))]
+    elif kind == "insert":
+        chars.insert(rng.randrange(len(chars)), rng.choice(TYPO_CHARS))
+    elif kind == "drop_prefix":
+        return kind, number.split("-", 1)[1]
+    else:
+        return kind, number.replace("-", "")
+    return kind, "".join(chars)
+
+
+def linear_scan(keys, query):
+    folded = normalize_invoice_number(query).translate(CONFUSABLES)
+    limit = fuzzy_distance_limit(folded)
+    return [key for key in keys if levenshtein(folded, key, limit) <= limit]
+
+
+def run(size, queries, rng):
+    numbers = invoice_numbers(size, rng)
+    start = time.perf_counter()
+    matcher = InvoiceMatcher(numbers)
+    matcher.index  # build the lazily-created deletion index up front
+    build_s = time.perf_counter() - start
+
+    # A later run reuses the user's matcher: index new invoices, narrow the active set
+    start = time.perf_counter()
+    for number in invoice_numbers(size // 100, random.Random(size)):
+        matcher.add(number)
+    matcher.set_active(numbers)
+    update_ms = (time.perf_counter() - start) * 1000
+
+    cases = [(truth, *typo(truth, rng)) for truth in rng.sample(numbers, queries)]
+    exact_hits = exact_correct = fuzzy_hits = fuzzy_top1 = 0
+    start = time.perf_counter()
+    for truth, _, query in cases:
+        matched, candidates = matcher.match([query])
+        if matched:
+            exact_hits += 1
+            exact_correct += matched == truth
+        elif candidates:
+            fuzzy_hits += any(c["invoice_number"] == truth for c in candidates)
+            fuzzy_top1 += candidates[0]["invoice_number"] == truth
+    matcher_us = (time.perf_counter() - start) / queries * 1e6
+
+    folded_keys = list(matcher.by_folded)
+    sample = cases[:min(queries, 50)]
+    start = time.perf_counter()
+    for _, _, query in sample:
+        linear_scan(folded_keys, query)
+    linear_us = (time.perf_counter() - start) / len(sample) * 1e6
+
+    print(f"n={size:>7}  build {build_s:6.2f}s  update {update_ms:7.1f}ms  "
+          f"query {matcher_us:7.0f} us  (linear {linear_us:9.0f} us)")
+    print(f"           tier1 answered {exact_hits / queries:6.1%}  precision {exact_correct / max(exact_hits, 1):6.1%}")
+    unanswered = queries - exact_hits
+    print(f"           fuzzy recall {fuzzy_hits / max(unanswered, 1):6.1%}  "
+          f"top-1 precision {fuzzy_top1 / max(unanswered, 1):6.1%}  of {unanswered} tier1 misses")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    for size in (int(s) for s in args.sizes.split(",")):
+        run(size, args.queries, rng)
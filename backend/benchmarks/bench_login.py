@@ -0,0 +1,99 @@
+"""Login storm benchmark: legacy sequential writes vs. the persist_login fast path.
+
+Runs N concurrent logins against a real MongoDB (MONGO_URL), first for new
+users and then for returning users, and reports throughput and latency.
+
+    MONGO_URL=mongodb://localhost:27017 python backend/benchmarks/bench_login.py --logins 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+# Never the configured DB_NAME: the run drops its collections and the database
+os.environ["DB_NAME"] = "invoice_sync_bench"
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import server  # noqa: E402
+from server import db, persist_login, ensure_indexes  # noqa: E402
+
+
+async def legacy_login(data):
+    """The pre-fast-path create_session write sequence"""
+    existing_user = await db.users.find_one({"email": data["email"]}, {"_id": 0})
+    if existing_user:
+        user_id = existing_user["user_id"]
+        await db.users.update_one({"user_id": user_id}, {"$set": {"name": data["name"], "picture": data["picture"]}})
+    else:
+        user_id = f"user_{uuid.uuid4().hex[:12]}"
+        await db.users.insert_one({
+            "user_id": user_id,
+            "email": data["email"],
+            "name": data["name"],
+            "picture": data["picture"],
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        await db.user_settings.insert_one({
+            "user_id": user_id,
+            "google_sheet_url": None,
+            "google_drive_folder_id": None,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        })
+    await db.user_sessions.delete_many({"user_id": user_id})
+    await db.user_sessions.insert_one({
+        "user_id": user_id,
+        "session_token": data["session_token"],
+        "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    return await db.users.find_one({"user_id": user_id}, {"_id": 0})
+
+
+async def fast_login(data):
+    expires_at = datetime.now(timezone.utc) + server.SESSION_TTL
+    return await persist_login(data, data["session_token"], expires_at)
+
+
+async def storm(login, emails):
+    latencies = []
+
+    async def one(email):
+        data = {"email": email, "name": "Bench", "picture": "", "session_token": uuid.uuid4().hex}
+        start = time.perf_counter()
+        await login(data)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(email) for email in emails))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "logins_per_sec": len(emails) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main(logins):
+    for name in ("users", "user_settings", "user_sessions"):
+        await db[name].drop()
+    await ensure_indexes()
+
+    for label, login in (("legacy", legacy_login), ("fast", fast_login)):
+        emails = [f"{label}_{i}@bench.example" for i in range(logins)]
+        for phase in ("first login", "returning"):
+            result = await storm(login, emails)
+            print(f"{label:7s} {phase:12s} {result['logins_per_sec']:8.0f} logins/s  "
+                  f"p50 {result['p50_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms")
+
+    await db.client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=500)
+    asyncio.run(main(parser.parse_args().logins))
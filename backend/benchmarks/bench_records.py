@@ -0,0 +1,99 @@
+"""Workflow record construction benchmark: Pydantic models vs. dict builders.
+
+Builds the invoice, email scan and attachment documents the workflow inserts,
+once through model -> model_dump() -> isoformat and once through the
+*_record builders, and reports records/second for each. No database needed.
+
+    python backend/benchmarks/bench_records.py --records 100000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "invoice_sync_bench")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from server import (  # noqa: E402
+    Attachment, EmailScanResult, Invoice,
+    attachment_record, email_scan_record, invoice_record, normalize_invoice_number,
+)
+
+EMAIL = {
+    "email_id": "email_bench",
+    "subject": "Tax Invoice INV-2024-001 attached",
+    "sender": "vendor@example.com",
+    "date": "2024-01-01 10:00",
+    "has_attachment": True,
+    "extracted_invoice_numbers": ["INV-2024-001"],
+    "matched_invoice": "INV-2024-001",
+    "status": "matched",
+}
+
+
+def build_with_models(user_id):
+    inv_doc = Invoice(
+        user_id=user_id,
+        invoice_number="INV-2024-001",
+        invoice_number_norm=normalize_invoice_number("INV-2024-001"),
+        status="not_updated"
+    ).model_dump()
+    inv_doc["created_at"] = inv_doc["created_at"].isoformat()
+    inv_doc["updated_at"] = inv_doc["updated_at"].isoformat()
+
+    scan_doc = EmailScanResult(
+        user_id=user_id,
+        extracted_invoice_numbers_norm=[normalize_invoice_number(n) for n in EMAIL["extracted_invoice_numbers"]],
+        **EMAIL
+    ).model_dump()
+    scan_doc["created_at"] = scan_doc["created_at"].isoformat()
+
+    att_doc = Attachment(
+        user_id=user_id,
+        invoice_number="INV-2024-001",
+        filename="INV-2024-001.pdf",
+        drive_file_id="sample_INV-2024-001",
+        drive_link="https://drive.google.com/file/d/sample_INV-2024-001/view",
+        email_subject=EMAIL["subject"]
+    ).model_dump()
+    att_doc["downloaded_at"] = att_doc["downloaded_at"].isoformat()
+    return inv_doc, scan_doc, att_doc
+
+
+def build_with_records(user_id):
+    now = datetime.now(timezone.utc).isoformat()
+    return (
+        invoice_record(user_id, "INV-2024-001", "not_updated", now),
+        email_scan_record(user_id, EMAIL, now),
+        attachment_record(
+            user_id, "INV-2024-001", "INV-2024-001.pdf", EMAIL["subject"],
+            "sample_INV-2024-001", "https://drive.google.com/file/d/sample_INV-2024-001/view", now
+        ),
+    )
+
+
+def bench(build, records):
+    start = time.perf_counter()
+    for _ in range(records // 3):
+        build("user_bench")
+    return records / (time.perf_counter() - start)
+
+
+def main(records):
+    # Both paths must produce identically shaped documents
+    for model_doc, record_doc in zip(build_with_models("u"), build_with_records("u")):
+        assert model_doc.keys() == record_doc.keys(), (model_doc.keys() ^ record_doc.keys())
+
+    before = bench(build_with_models, records)
+    after = bench(build_with_records, records)
+    print(f"pydantic models  {before:10.0f} records/s")
+    print(f"dict builders    {after:10.0f} records/s  ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100_000)
+    main(parser.parse_args().records)
@@ -0,0 +1,87 @@
+"""Import-time budget check for the API process.
+
+Imports server in fresh interpreters under `python -X importtime`, takes the
+best of several runs, and exits non-zero if the cumulative import time goes
+over budget or a lazily-loaded subsystem is imported eagerly. The same
+check runs under pytest as tests/test_import_time.py.
+
+    python backend/benchmarks/check_import_time.py --budget-ms 900
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+IMPORT_BUDGET_MS = int(os.environ.get("IMPORT_BUDGET_MS", "900"))
+
+# Modules that must only load on first use, never at import of server
+LAZY_MODULES = [
+    "httpx",
+    "pypdf",
+    "pyinstrument",
+    "gzip",
+    "concurrent.futures.process",
+    "subsystems.metrics",
+    "subsystems.n8n_export",
+    "subsystems.pdf_inspection",
+    "subsystems.profiling",
+    "subsystems.push_ingest",
+    "subsystems.retention",
+    "subsystems.sheet_sync",
+    "subsystems.synthetic_data",
+]
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure():
+    env = {**os.environ, "MONGO_URL": os.environ.get("MONGO_URL", "mongodb://localhost:27017"),
+           "DB_NAME": os.environ.get("DB_NAME", "invoice_sync_importtime")}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2))
+    return cumulative
+
+
+def check(runs):
+    """Best cumulative import time in ms, the lazy modules imported eagerly,
+    and the first sample"""
+    samples = [measure() for _ in range(runs)]
+    best_ms = min(sample["server"] for sample in samples) / 1000
+    eager = sorted({name for sample in samples for name in LAZY_MODULES if name in sample})
+    return best_ms, eager, samples[0]
+
+
+def main(budget_ms, runs):
+    best_ms, eager, sample = check(runs)
+
+    print(f"import server: best {best_ms:.0f} ms over {runs} runs (budget {budget_ms} ms)")
+    slowest = sorted(sample.items(), key=lambda item: -item[1])[1:6]
+    for name, micros in slowest:
+        print(f"  {name:40s} {micros / 1000:7.0f} ms")
+
+    failed = False
+    if best_ms > budget_ms:
+        print(f"FAIL: import time {best_ms:.0f} ms exceeds budget {budget_ms} ms")
+        failed = True
+    if eager:
+        print(f"FAIL: lazily-loaded modules imported at startup: {', '.join(eager)}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=int, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    main(args.budget_ms, args.runs)
@@ -0,0 +1,106 @@
+"""Offline replay of the workflow pipeline against synthetic data.
+
+Runs execute_workflow_run end to end with a SyntheticDataSource, an
+in-memory stand-in for the Mongo collections it touches and no Google rate
+limits. Reports per-stage wall time and throughput, then replays the same
+seed under tracemalloc for per-stage memory high-water marks.
+
+    python backend/benchmarks/replay_workflow.py --invoices 20000 --emails 50000 --typo-rate 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "invoice_sync_bench")
+os.environ.setdefault("PDF_INSPECTION_ENABLED", "")
+os.environ["RESPONSE_CACHE_GENERATIONS"] = "memory"
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+import server  # noqa: E402
+from subsystems.synthetic_data import SyntheticDataSource  # noqa: E402
+from tests.fake_mongo import FakeDatabase  # noqa: E402
+
+# Stage -> which input its throughput is counted in
+STAGE_ITEMS = {
+    "read_sheet": "invoices",
+    "sync_invoices": "invoices",
+    "fetch_emails": "emails",
+    "extract": "emails",
+    "match": "emails",
+    "persist": "emails",
+}
+
+class MemoryStageTimer(server.StageTimer):
+    """Also records the tracemalloc peak reached during each stage"""
+
+    def __init__(self):
+        super().__init__()
+        self.peak_bytes = {}
+
+    @contextmanager
+    def stage(self, name):
+        tracemalloc.reset_peak()
+        with super().stage(name):
+            yield
+        self.peak_bytes[name] = tracemalloc.get_traced_memory()[1]
+
+
+async def replay(source, stages):
+    server.db = FakeDatabase()
+    server.google_api_limiter = server.GoogleApiLimiter({}, {})
+    user = server.User(user_id="user_replay", email="replay@example.com", name="Replay")
+    run = server.WorkflowRun(user_id=user.user_id)
+    await server.db.workflow_runs.insert_one(run.model_dump())
+    return await server.execute_workflow_run(user, run, source=source, stages=stages)
+
+
+def main(args):
+    options = dict(
+        seed=args.seed, invoices=args.invoices, emails=args.emails, match_rate=args.match_rate,
+        typo_rate=args.typo_rate, body_bytes=args.body_bytes, attachment_bytes=args.attachment_bytes,
+    )
+    source = SyntheticDataSource(**options)
+    stages = server.StageTimer()
+    result = asyncio.run(replay(source, stages))
+
+    peaks = {}
+    if not args.no_memory:
+        tracemalloc.start()
+        memory_stages = MemoryStageTimer()
+        asyncio.run(replay(SyntheticDataSource(**options), memory_stages))
+        tracemalloc.stop()
+        peaks = memory_stages.peak_bytes
+
+    counts = {"invoices": args.invoices, "emails": args.emails}
+    print(f"{'stage':15} {'ms':>10} {'items/s':>12} {'peak MB':>9}")
+    for name, ms in stages.stage_ms.items():
+        rate = counts[STAGE_ITEMS[name]] / (ms / 1000) if ms else float("inf")
+        peak = f"{peaks[name] / 1e6:9.1f}" if name in peaks else f"{'-':>9}"
+        print(f"{name:15} {ms:10.1f} {rate:12.0f} {peak}")
+    print(f"{'total':15} {sum(stages.stage_ms.values()):10.1f}")
+
+    matched = sum(1 for scan in server.db.email_scans.docs if scan["matched_invoice"])
+    print(
+        f"\nemails={result['emails_scanned']} references={source.expected_references} "
+        f"(typos={source.expected_typos}) matched={matched} "
+        f"attachments={result['attachments_downloaded']} new_invoices={result['invoices_processed']}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--invoices", type=int, default=5000)
+    parser.add_argument("--emails", type=int, default=10000)
+    parser.add_argument("--match-rate", type=float, default=0.5)
+    parser.add_argument("--typo-rate", type=float, default=0.1)
+    parser.add_argument("--body-bytes", type=int, default=2048)
+    parser.add_argument("--attachment-bytes", type=int, default=16384)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc replay")
+    main(parser.parse_args())
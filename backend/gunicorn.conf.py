@@ -0,0 +1,40 @@
+"""Gunicorn profile for running the API under Uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py server:app
+
+Runs a single worker unless WEB_CONCURRENCY says otherwise. Each worker owns
+its own Motor pool, response cache, run-event broker and Google API rate
+buckets, so before running several set:
+
+    RUN_EVENTS_CHANGE_STREAM=1        SSE subscribers see runs on other workers
+    GOOGLE_API_RATE_BACKEND=mongo     rate limits are shared, not per worker
+    RESPONSE_CACHE_GENERATIONS=mongo  (the default) cache invalidation is shared
+
+Workflow single-flight, sheet sync and retention coordinate through Mongo
+leases. WORKFLOW_MAX_CONCURRENT_RUNS and WORKFLOW_MAX_QUEUE_DEPTH apply per
+worker, so divide them by the worker count.
+"""
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8001")
+worker_class = "uvicorn.workers.UvicornWorker"
+# The workload is I/O bound on Mongo and Google APIs, so one event loop
+# usually suffices; at most one per core, and only with the shared backends
+# above configured.
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+# Load the app in each worker, not the master: the Motor client must be
+# created after fork.
+preload_app = False
+
+# Workflow runs execute in the background, but keep headroom for slow pages
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 75
+
+# Recycle workers periodically to bound memory growth, staggered by jitter
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = 1000
+
+accesslog = "-"
+errorlog = "-"
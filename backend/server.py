@@ -1,31 +1,45 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import os
+import sys
+import asyncio
+import contextvars
 import logging
 from pathlib import Path
+from contextlib import asynccontextmanager, contextmanager
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
+import time
+import hashlib
+import hmac
+from collections import OrderedDict, deque
 from datetime import datetime, timezone, timedelta
-import httpx
 import json
 import re
+import math
 import base64
+import importlib.util
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+client = AsyncIOMotorClient(
+    mongo_url,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+)
 db = client[os.environ['DB_NAME']]
 
-# Create the main app
-app = FastAPI()
-
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
@@ -62,6 +76,8 @@ class Invoice(BaseModel):
     invoice_id: str = Field(default_factory=lambda: f"inv_{uuid.uuid4().hex[:12]}")
     user_id: str
     invoice_number: str
+    invoice_number_norm: Optional[str] = None
+    organization: Optional[str] = None
     status: str = "not_updated"  # not_updated, matched, not_matched, downloaded
     email_subject: Optional[str] = None
     email_from: Optional[str] = None
@@ -81,7 +97,9 @@ class EmailScanResult(BaseModel):
     date: str
     has_attachment: bool
     extracted_invoice_numbers: List[str]
+    extracted_invoice_numbers_norm: List[str] = []
     matched_invoice: Optional[str] = None
+    match_candidates: List[Dict[str, Any]] = []  # fuzzy-tier suggestions
     status: str = "scanned"  # scanned, matched, downloaded, error
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -94,6 +112,9 @@ class Attachment(BaseModel):
     drive_file_id: Optional[str] = None
     drive_link: Optional[str] = None
     email_subject: str
+    content_hash: Optional[str] = None
+    content_invoice_numbers: List[str] = []
+    content_confirmed: Optional[bool] = None  # None when the PDF was not inspected
     downloaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class WorkflowRun(BaseModel):
@@ -107,37 +128,701 @@ class WorkflowRun(BaseModel):
     emails_scanned: int = 0
     attachments_downloaded: int = 0
     errors: List[str] = []
+    trigger: str = "manual"  # manual, push
+    api_usage: Dict[str, int] = {}  # Google API quota units consumed, per API
+    stage_ms: Dict[str, float] = {}  # wall time per workflow stage
+    profile_id: Optional[str] = None
+    profile_url: Optional[str] = None
 
 class UserSettings(BaseModel):
     model_config = ConfigDict(extra="ignore")
     user_id: str
     google_sheet_url: Optional[str] = None
     google_drive_folder_id: Optional[str] = None
+    scan_retention_days: Optional[int] = None
+    unmatched_scan_retention_days: Optional[int] = None
+    run_retention_days: Optional[int] = None
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Request/Response Models
 class SessionRequest(BaseModel):
     session_id: str
 
+# Retention windows in days; a missing one keeps that data forever
+RETENTION_SETTINGS = ("scan_retention_days", "unmatched_scan_retention_days", "run_retention_days")
+
 class SettingsUpdate(BaseModel):
     google_sheet_url: Optional[str] = None
     google_drive_folder_id: Optional[str] = None
+    scan_retention_days: Optional[int] = Field(default=None, ge=1)
+    unmatched_scan_retention_days: Optional[int] = Field(default=None, ge=1)
+    run_retention_days: Optional[int] = Field(default=None, ge=1)
+
+# =============================================================================
+# WORKFLOW RECORDS
+# =============================================================================
+
+# Plain dict builders for the workflow write path. They produce the same
+# documents as the models above after model_dump() and datetime-to-string
+# conversion, without per-record validation. Pydantic stays at the API edge.
+
+def invoice_record(user_id: str, invoice_number: str, status: str, now: str,
+                   organization: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "invoice_id": f"inv_{uuid.uuid4().hex[:12]}",
+        "user_id": user_id,
+        "invoice_number": invoice_number,
+        "invoice_number_norm": normalize_invoice_number(invoice_number),
+        "organization": organization,
+        "status": status,
+        "email_subject": None,
+        "email_from": None,
+        "email_date": None,
+        "attachment_name": None,
+        "drive_link": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def email_scan_record(user_id: str, email: Dict[str, Any], now: str) -> Dict[str, Any]:
+    numbers = email["extracted_invoice_numbers"]
+    return {
+        "scan_id": f"scan_{uuid.uuid4().hex[:12]}",
+        "user_id": user_id,
+        "email_id": email["email_id"],
+        "subject": email["subject"],
+        "sender": email["sender"],
+        "date": email["date"],
+        "has_attachment": email["has_attachment"],
+        "extracted_invoice_numbers": numbers,
+        "extracted_invoice_numbers_norm": [normalize_invoice_number(n) for n in numbers],
+        "matched_invoice": email.get("matched_invoice"),
+        "match_candidates": email.get("match_candidates", []),
+        "status": email.get("status", "scanned"),
+        "created_at": now,
+    }
+
+
+def attachment_record(user_id: str, invoice_number: str, filename: str, email_subject: str,
+                      drive_file_id: Optional[str], drive_link: Optional[str], now: str) -> Dict[str, Any]:
+    return {
+        "attachment_id": f"att_{uuid.uuid4().hex[:12]}",
+        "user_id": user_id,
+        "invoice_number": invoice_number,
+        "filename": filename,
+        "drive_file_id": drive_file_id,
+        "drive_link": drive_link,
+        "email_subject": email_subject,
+        "content_hash": None,
+        "content_invoice_numbers": [],
+        "content_confirmed": None,
+        "downloaded_at": now,
+    }
+
+# =============================================================================
+# INVOICE NUMBER NORMALIZATION
+# =============================================================================
+
+# Same normalization as the n8n "Match Invoices" node: drop -, / and whitespace
+INVOICE_NUMBER_SEPARATORS = re.compile(r"[-\s/]")
+
+
+def normalize_invoice_number(value: str) -> str:
+    """Normalize an invoice number for matching and prefix search"""
+    return INVOICE_NUMBER_SEPARATORS.sub("", value or "").upper()
+
+
+def normalize_expr(field: str) -> Dict[str, Any]:
+    """Aggregation expression equivalent of normalize_invoice_number"""
+    expr: Any = {"$toUpper": {"$ifNull": [field, ""]}}
+    for separator in ("-", "/", " ", "\t"):
+        expr = {"$replaceAll": {"input": expr, "find": separator, "replacement": ""}}
+    return expr
+
+# =============================================================================
+# INVOICE MATCHING
+# =============================================================================
+
+# Same patterns as the n8n "Match Invoices" node
+INVOICE_PATTERNS = [
+    re.compile(r"[A-Z]{2,4}[-/]?\d{2,4}[-/]?\d{2,6}", re.IGNORECASE),
+    re.compile(r"INVOICE\s*#?\s*[A-Z0-9-]+", re.IGNORECASE),
+    re.compile(r"TAX\s*INVOICE\s*#?\s*[A-Z0-9-]+", re.IGNORECASE),
+]
+
+# Characters vendors commonly confuse, folded together for the fuzzy tier
+CONFUSABLES = str.maketrans({"O": "0", "Q": "0", "I": "1", "L": "1", "S": "5", "B": "8", "Z": "2"})
+
+CONTAINMENT_MIN_LENGTH = 4
+FUZZY_MAX_CANDIDATES = 3
+# Users whose matcher indexes are kept between runs, per worker
+MATCHER_CACHE_USERS = int(os.environ.get('MATCHER_CACHE_USERS', '8'))
+
+
+def extract_invoice_numbers(text: str) -> List[str]:
+    """Extract candidate invoice numbers from email text"""
+    text = (text or "").upper()
+    found: List[str] = []
+    for pattern in INVOICE_PATTERNS:
+        for match in pattern.findall(text):
+            if match.strip() not in found:
+                found.append(match.strip())
+    return found
+
+
+def levenshtein(a: str, b: str, limit: int) -> int:
+    """Edit distance, or limit + 1 once it is exceeded
+    
+    Only the diagonal band of width 2 * limit + 1 can stay within limit,
+    so cells outside it are never computed.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+    over = limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        low, high = max(1, i - limit), min(len(b), i + limit)
+        current = [over] * (len(b) + 1)
+        if low == 1:
+            current[0] = i
+        best = current[low - 1]
+        for j in range(low, high + 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != b[j - 1]))
+            current[j] = distance
+            best = min(best, distance)
+        if best > limit:
+            return over
+        previous = current
+    return min(previous[-1], over)
+
+
+def fuzzy_distance_limit(value: str) -> int:
+    return 1 if len(value) <= 6 else 2
+
+
+def candidate(number: str, distance: int, score: float) -> Dict[str, Any]:
+    return {"invoice_number": number, "distance": distance, "score": round(score, 3)}
+
+
+class DeletionIndex:
+    """Deletion-neighbourhood index over folded keys for edit-distance-bounded lookups
+
+    Each key is stored under itself and its one-character deletions. A
+    lookup generates the query's deletions up to the distance limit, so
+    its cost depends on the query's length and the keys near it, not on
+    how many keys are indexed.
+
+    Every key within distance 1 is found, as is a key within distance 2
+    that one deletion from the key reaches (transposed characters, or
+    characters the query has in addition). A key that differs by two
+    substituted or two dropped characters is missed: indexing two
+    deletions per key would find those, at about six times the memory.
+    """
+
+    def __init__(self):
+        self.keys: List[str] = []
+        # hash of a variant -> key id, or a list of ids once it is shared;
+        # hash collisions only add candidates, which levenshtein rejects
+        self.postings: Dict[int, Any] = {}
+
+    @staticmethod
+    def deletions(key: str, depth: int) -> set:
+        variants = frontier = {key}
+        for _ in range(depth):
+            frontier = {v[:i] + v[i + 1:] for v in frontier for i in range(len(v))}
+            variants = variants | frontier
+        return variants
+
+    def add(self, key: str):
+        key_id = len(self.keys)
+        self.keys.append(key)
+        for variant in self.deletions(key, 1):
+            variant_hash = hash(variant)
+            ids = self.postings.get(variant_hash)
+            if ids is None:
+                self.postings[variant_hash] = key_id
+            elif isinstance(ids, list):
+                ids.append(key_id)
+            else:
+                self.postings[variant_hash] = [ids, key_id]
+
+    def search(self, key: str, limit: int) -> List[tuple]:
+        """Return (distance, key) pairs within limit of key"""
+        key_ids = set()
+        for variant in self.deletions(key, limit):
+            ids = self.postings.get(hash(variant))
+            if isinstance(ids, list):
+                key_ids.update(ids)
+            elif ids is not None:
+                key_ids.add(ids)
+        results = []
+        for key_id in key_ids:
+            other = self.keys[key_id]
+            distance = levenshtein(key, other, limit)
+            if distance <= limit:
+                results.append((distance, other))
+        return results
+
+
+class InvoiceMatcher:
+    """Match extracted numbers against a user's "not updated" invoices
+
+    Tier 1 is exact/containment on normalized numbers, mirroring the n8n node.
+    A tier-1 hit that fits more than one invoice (a suffix shared by
+    INV-2024-001 and TAX-2024-001) is not a match; those invoices become
+    candidates instead. Tier 2 is a deletion index over confusable-folded
+    numbers that returns scored candidates within a small edit distance.
+
+    The indexes may hold more invoices than are matchable: set_active()
+    restricts matches to a subset, so a user's matcher can be kept across
+    runs (see load_matcher) while invoices move out of "not updated".
+    """
+
+    def __init__(self, invoice_numbers: List[str]):
+        self.numbers: set = set()
+        self.active: Optional[set] = None  # None: every indexed number
+        self.by_norm: Dict[str, List[str]] = {}
+        self.by_suffix: Dict[str, str] = {}
+        # Suffixes shared by several invoices, kept apart so by_suffix stays flat
+        self.ambiguous_suffixes: Dict[str, List[str]] = {}
+        self.by_folded: Dict[str, List[str]] = {}
+        self._index: Optional[DeletionIndex] = None
+        for number in invoice_numbers:
+            self.add(number)
+
+    def add(self, number: str):
+        norm = normalize_invoice_number(number)
+        if not norm or number in self.numbers:
+            return
+        self.numbers.add(number)
+        self.by_norm.setdefault(norm, []).append(number)
+        # Suffix index covers extracted numbers missing a vendor prefix
+        for start in range(1, len(norm) - CONTAINMENT_MIN_LENGTH + 1):
+            suffix = norm[start:]
+            if suffix in self.ambiguous_suffixes:
+                self.ambiguous_suffixes[suffix].append(number)
+            elif suffix in self.by_suffix:
+                self.ambiguous_suffixes[suffix] = [self.by_suffix.pop(suffix), number]
+            else:
+                self.by_suffix[suffix] = number
+        folded = norm.translate(CONFUSABLES)
+        if folded not in self.by_folded and self._index is not None:
+            self._index.add(folded)
+        self.by_folded.setdefault(folded, []).append(number)
+
+    def set_active(self, numbers):
+        self.active = set(numbers)
+
+    def matchable(self, numbers: List[str]) -> List[str]:
+        if self.active is None:
+            return numbers
+        return [number for number in numbers if number in self.active]
+
+    @property
+    def index(self) -> DeletionIndex:
+        # Built on first fuzzy lookup; most runs never need it
+        if self._index is None:
+            self._index = DeletionIndex()
+            for folded in self.by_folded:
+                self._index.add(folded)
+        return self._index
+
+    def exact_hits(self, norm: str) -> List[Dict[str, Any]]:
+        """Tier-1 hits for one normalized value, scored as candidates"""
+        numbers = self.matchable(self.by_norm.get(norm, []))
+        if numbers:
+            return [candidate(number, 0, 1.0) for number in numbers]
+        # Extracted text containing an invoice number ("INVOICE INV-001")
+        contained: Dict[str, List[str]] = {}
+        for start in range(len(norm)):
+            for end in range(start + CONTAINMENT_MIN_LENGTH, len(norm) + 1):
+                numbers = self.matchable(self.by_norm.get(norm[start:end], []))
+                if numbers:
+                    contained[norm[start:end]] = numbers
+        if contained:
+            # A hit inside a longer hit ("2024001" in "INV2024001") is the same reference
+            return [
+                candidate(number, len(norm) - len(inner), len(inner) / len(norm))
+                for inner, numbers in sorted(contained.items())
+                if not any(inner != outer and inner in outer for outer in contained)
+                for number in numbers
+            ]
+        if len(norm) < CONTAINMENT_MIN_LENGTH:
+            return []
+        numbers = self.ambiguous_suffixes.get(norm) or ([self.by_suffix[norm]] if norm in self.by_suffix else [])
+        return [
+            candidate(number, len(normalize_invoice_number(number)) - len(norm),
+                      len(norm) / len(normalize_invoice_number(number)))
+            for number in self.matchable(numbers)
+        ]
+
+    def match_exact(self, extracted: List[str]) -> Optional[str]:
+        """The first extracted value that identifies exactly one invoice"""
+        for value in extracted:
+            hits = self.exact_hits(normalize_invoice_number(value))
+            if len(hits) == 1:
+                return hits[0]["invoice_number"]
+        return None
+
+    def fuzzy_candidates(self, extracted: List[str]) -> List[Dict[str, Any]]:
+        best: Dict[str, Dict[str, Any]] = {}
+        for value in extracted:
+            folded = normalize_invoice_number(value).translate(CONFUSABLES)
+            if len(folded) < CONTAINMENT_MIN_LENGTH:
+                continue
+            for distance, key in self.index.search(folded, fuzzy_distance_limit(folded)):
+                # Distance 0 here means the numbers differ only by confusables
+                score = 1 - (distance or 0.5) / max(len(folded), len(key))
+                for number in self.matchable(self.by_folded[key]):
+                    if number not in best or best[number]["score"] < score:
+                        best[number] = candidate(number, distance, score)
+        return sorted(best.values(), key=lambda c: -c["score"])[:FUZZY_MAX_CANDIDATES]
+
+    def match(self, extracted: List[str]) -> tuple:
+        """Return (matched invoice number or None, candidates)"""
+        ambiguous: List[Dict[str, Any]] = []
+        for value in extracted:
+            hits = self.exact_hits(normalize_invoice_number(value))
+            if len(hits) == 1:
+                return hits[0]["invoice_number"], []
+            ambiguous.extend(hits)
+        best = {c["invoice_number"]: c for c in self.fuzzy_candidates(extracted)}
+        for hit in ambiguous:
+            if hit["invoice_number"] not in best or best[hit["invoice_number"]]["score"] < hit["score"]:
+                best[hit["invoice_number"]] = hit
+        return None, sorted(best.values(), key=lambda c: -c["score"])[:FUZZY_MAX_CANDIDATES]
+
+_matchers: OrderedDict = OrderedDict()  # user_id -> InvoiceMatcher, least recent first
+
+
+async def load_matcher(user_id: str) -> InvoiceMatcher:
+    """The user's matcher, restricted to their "not updated" invoices
+    
+    Kept across runs, so only invoices added since the last run are
+    indexed. Match with it before the next await: another run for the same
+    user shares the instance and resets its active set.
+    """
+    invoices = await db.invoices.find(
+        {"user_id": user_id},
+        {"_id": 0, "invoice_number": 1, "status": 1}
+    ).to_list(None)
+    matcher = _matchers.pop(user_id, None)
+    # Rebuild once deleted invoices make up most of the index
+    if matcher is None or len(matcher.numbers) > 2 * len(invoices):
+        matcher = InvoiceMatcher([])
+    for inv in invoices:
+        matcher.add(inv["invoice_number"])
+    matcher.set_active(inv["invoice_number"] for inv in invoices if inv["status"] == "not_updated")
+    _matchers[user_id] = matcher
+    while len(_matchers) > MATCHER_CACHE_USERS:
+        _matchers.popitem(last=False)
+    return matcher
+
+# =============================================================================
+# LIST PROJECTIONS & INDEXES
+# =============================================================================
+
+# Compact default projections: exactly the columns the list pages render.
+# Pass fields=a,b,c to pick others, or fields=* for full documents.
+LIST_PROJECTIONS = {
+    "invoices": ["invoice_id", "invoice_number", "status", "email_subject",
+                 "email_from", "attachment_name", "drive_link"],
+    "attachments": ["attachment_id", "invoice_number", "filename", "email_subject",
+                    "drive_link", "downloaded_at"],
+    "email_scans": ["scan_id", "date", "sender", "subject", "has_attachment",
+                    "extracted_invoice_numbers", "matched_invoice", "status"],
+    "workflow_runs": ["run_id", "status", "stage", "started_at", "completed_at",
+                      "invoices_processed", "emails_scanned", "attachments_downloaded"],
+}
+
+LIST_FIELDS = {
+    "invoices": set(Invoice.model_fields),
+    "attachments": set(Attachment.model_fields),
+    "email_scans": set(EmailScanResult.model_fields),
+    "workflow_runs": set(WorkflowRun.model_fields) | {"stage"},
+}
+
+
+def list_projection(collection: str, fields: Optional[str] = None) -> Dict[str, int]:
+    """Build a Mongo projection from a fields= parameter"""
+    if fields == "*":
+        return {"_id": 0}
+    if fields:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+    else:
+        names = LIST_PROJECTIONS[collection]
+    unknown = set(names) - LIST_FIELDS[collection]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+    return {"_id": 0, **{name: 1 for name in names}}
+
+
+# Server error codes for an index name reused with different keys or options
+INDEX_CONFLICT_CODES = (85, 86)
+
+
+def covering_index(collection: str, sort_field: str) -> List[tuple]:
+    """Leading user_id + sort key, followed by the default projection, so the
+    default list queries are covered by the index"""
+    # A field listed twice would be merged into one key with the later
+    # direction, so the sort key is not repeated among the projected fields
+    return [("user_id", 1), (sort_field, -1)] + [
+        (field, 1) for field in LIST_PROJECTIONS[collection] if field != sort_field
+    ]
+
+
+async def create_index(collection, keys, **options):
+    try:
+        await collection.create_index(keys, **options)
+    except OperationFailure as e:
+        if e.code not in INDEX_CONFLICT_CODES or "name" not in options:
+            raise
+        # The definition behind this name changed; replace the old index
+        logger.warning(f"Rebuilding index {collection.name}.{options['name']} with its new definition")
+        await collection.drop_index(options["name"])
+        await collection.create_index(keys, **options)
+
+
+async def ensure_indexes():
+    """Create the indexes backing the per-user list and lookup queries
+    
+    Each index is created on its own, so one failure (e.g. duplicate emails
+    blocking the unique users.email index) does not skip the rest.
+    """
+    indexes = [
+        (db.invoices, covering_index("invoices", "created_at"), {"name": "user_list_covering"}),
+        (db.invoices, [("user_id", 1), ("invoice_number", 1)], {}),
+        (db.invoices, [("user_id", 1), ("invoice_number_norm", 1)], {}),
+        (db.invoices, [("user_id", 1), ("email_subject", "text"), ("email_from", "text"), ("organization", "text")],
+         {"name": "user_search_text"}),
+        (db.attachments, covering_index("attachments", "downloaded_at"), {"name": "user_list_covering"}),
+        (db.workflow_runs, covering_index("workflow_runs", "started_at"), {"name": "user_list_covering"}),
+        (db.workflow_runs, "run_id", {"unique": True}),
+        # extracted_invoice_numbers is an array, so scans can only use the sort index
+        (db.email_scans, [("user_id", 1), ("created_at", -1)], {}),
+        (db.email_scans, [("user_id", 1), ("extracted_invoice_numbers_norm", 1)], {}),
+        (db.email_scans, "scan_id", {}),
+        (db.email_scans, [("user_id", 1), ("subject", "text"), ("sender", "text")], {"name": "user_search_text"}),
+        (db.user_sessions, "session_token", {}),
+        (db.user_sessions, "user_id", {}),
+        (db.users, "user_id", {"unique": True}),
+        # Unique so concurrent first logins upsert a single user
+        (db.users, "email", {"unique": True}),
+        (db.user_settings, "user_id", {"unique": True}),
+        (db.revoked_sessions, "jti", {"unique": True}),
+        (db.revoked_sessions, "expires_at", {"expireAfterSeconds": 0}),
+        (db.archive_stats, "user_id", {"unique": True}),
+        (db.email_scans_archive, [("user_id", 1), ("archived_at", -1)], {}),
+        (db.workflow_runs_archive, [("user_id", 1), ("archived_at", -1)], {}),
+        (db.pdf_text_cache, "content_hash", {"unique": True}),
+        (db.metrics_rollups, [("user_id", 1), ("granularity", 1), ("bucket_start", 1)], {"unique": True}),
+        (db.gmail_sync_state, "user_id", {"unique": True}),
+        (db.push_pending, "user_id", {"unique": True}),
+        (db.sheet_sync_parked, [("spreadsheet_id", 1), ("user_id", 1)], {"unique": True}),
+        (db.sheet_sync_parked, "retry_at", {}),
+        (db.profiles, "profile_id", {"unique": True}),
+        (db.profiles, "created_at", {"expireAfterSeconds": PROFILE_RETENTION_DAYS * 86400}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            await create_index(collection, keys, **options)
+        except Exception as e:
+            logger.error(f"Creating index {keys} on {collection.name} failed: {e}")
+
+
+async def backfill_search_fields():
+    """Populate normalized invoice numbers on documents written before search"""
+    await db.invoices.update_many(
+        {"invoice_number_norm": {"$exists": False}},
+        [{"$set": {"invoice_number_norm": normalize_expr("$invoice_number")}}]
+    )
+    await db.email_scans.update_many(
+        {"extracted_invoice_numbers_norm": {"$exists": False}},
+        [{"$set": {"extracted_invoice_numbers_norm": {"$map": {
+            "input": {"$ifNull": ["$extracted_invoice_numbers", []]},
+            "as": "number",
+            "in": normalize_expr("$$number")
+        }}}}]
+    )
+
+# =============================================================================
+# SIGNED SESSION TOKENS
+# =============================================================================
+
+# "db" keeps sessions in user_sessions; "signed" issues HMAC tokens verified
+# in-process. Both token kinds are accepted in either mode during migration.
+SESSION_TOKEN_MODE = os.environ.get('SESSION_TOKEN_MODE', 'db')
+SESSION_TTL = timedelta(days=7)
+SIGNED_TOKEN_PREFIX = "v1."
+REVOCATION_REFRESH_SECONDS = int(os.environ.get('REVOCATION_REFRESH_SECONDS', '30'))
+
+
+def parse_signing_keys(value: str) -> Dict[str, bytes]:
+    """Parse "kid:secret,kid:secret"; the first key signs, all keys verify"""
+    keys = {}
+    for entry in value.split(","):
+        if ":" in entry:
+            kid, secret = entry.strip().split(":", 1)
+            keys[kid] = secret.encode()
+    return keys
+
+
+SESSION_SIGNING_KEYS = parse_signing_keys(os.environ.get('SESSION_SIGNING_KEYS', ''))
+if SESSION_TOKEN_MODE == "signed" and not SESSION_SIGNING_KEYS:
+    raise RuntimeError("SESSION_SIGNING_KEYS is required when SESSION_TOKEN_MODE=signed")
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(key: bytes, message: str) -> str:
+    return _b64encode(hmac.new(key, message.encode(), hashlib.sha256).digest())
+
+
+def issue_signed_token(user_doc: Dict[str, Any], expires_at: datetime) -> str:
+    """Issue a signed session token carrying the user's identity and expiry"""
+    kid, key = next(iter(SESSION_SIGNING_KEYS.items()))
+    claims = {
+        "jti": uuid.uuid4().hex,
+        "exp": int(expires_at.timestamp()),
+        "user_id": user_doc["user_id"],
+        "email": user_doc["email"],
+        "name": user_doc.get("name", ""),
+        "picture": user_doc.get("picture"),
+    }
+    message = f"{SIGNED_TOKEN_PREFIX}{kid}.{_b64encode(json.dumps(claims, separators=(',', ':')).encode())}"
+    return f"{message}.{_sign(key, message)}"
+
+
+def verify_signed_token(token: str) -> Dict[str, Any]:
+    """Verify a signed session token and return its claims"""
+    try:
+        message, signature = token.rsplit(".", 1)
+        kid, payload = message[len(SIGNED_TOKEN_PREFIX):].split(".", 1)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    key = SESSION_SIGNING_KEYS.get(kid)
+    if key is None or not hmac.compare_digest(_sign(key, message), signature):
+        raise HTTPException(status_code=401, detail="Invalid session")
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    if claims["exp"] < datetime.now(timezone.utc).timestamp():
+        raise HTTPException(status_code=401, detail="Session expired")
+    return claims
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys"""
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RevocationList:
+    """Revoked signed-token ids, mirrored from Mongo into a Bloom filter"""
+
+    def __init__(self):
+        self.bloom = BloomFilter()
+
+    async def refresh(self):
+        bloom = BloomFilter()
+        now = datetime.now(timezone.utc)
+        async for doc in db.revoked_sessions.find({"expires_at": {"$gt": now}}, {"_id": 0, "jti": 1}):
+            bloom.add(doc["jti"])
+        self.bloom = bloom
+
+    async def revoke(self, claims: Dict[str, Any]):
+        self.bloom.add(claims["jti"])
+        await db.revoked_sessions.update_one(
+            {"jti": claims["jti"]},
+            {"$setOnInsert": {
+                "jti": claims["jti"],
+                "user_id": claims["user_id"],
+                "expires_at": datetime.fromtimestamp(claims["exp"], timezone.utc)
+            }},
+            upsert=True
+        )
+
+    async def is_revoked(self, jti: str) -> bool:
+        # A Bloom hit may be a false positive, so confirm it against Mongo
+        if jti not in self.bloom:
+            return False
+        return await db.revoked_sessions.find_one({"jti": jti}, {"_id": 1}) is not None
+
+
+revocation_list = RevocationList()
+
+
+async def refresh_revocations_periodically():
+    while True:
+        try:
+            await revocation_list.refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Revocation list refresh failed: {e}")
+        await asyncio.sleep(REVOCATION_REFRESH_SECONDS)
 
 # =============================================================================
 # AUTH HELPERS
 # =============================================================================
 
-async def get_current_user(request: Request) -> User:
-    """Get current user from session token (cookie or header)"""
+def get_session_token(request: Request) -> Optional[str]:
+    """Read the session token from the cookie or Authorization header"""
     session_token = request.cookies.get("session_token")
     if not session_token:
         auth_header = request.headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
             session_token = auth_header[7:]
+    return session_token
+
+async def get_current_user(request: Request) -> User:
+    """Get current user from session token (cookie or header)"""
+    session_token = get_session_token(request)
     
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    if session_token.startswith(SIGNED_TOKEN_PREFIX) and SESSION_SIGNING_KEYS:
+        claims = verify_signed_token(session_token)
+        if await revocation_list.is_revoked(claims["jti"]):
+            raise HTTPException(status_code=401, detail="Session revoked")
+        request.state.session_claims = claims
+        return User(
+            user_id=claims["user_id"],
+            email=claims["email"],
+            name=claims["name"],
+            picture=claims["picture"]
+        )
+    
     session_doc = await db.user_sessions.find_one(
         {"session_token": session_token},
         {"_id": 0}
@@ -164,6 +849,164 @@ async def get_current_user(request: Request) -> User:
     
     return User(**user_doc)
 
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()}
+
+async def require_admin(user: User = Depends(get_current_user)) -> User:
+    """Allow only users listed in ADMIN_EMAILS"""
+    if user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+# =============================================================================
+# RESPONSE CACHE
+# =============================================================================
+
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '1024'))
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+# brotli is optional; gzip is always available. Both are imported on first use.
+BROTLI_AVAILABLE = importlib.util.find_spec("brotli") is not None
+# Generations live in Mongo so every worker sees an invalidation; "memory"
+# keeps them per process, which is only correct with a single worker
+RESPONSE_CACHE_GENERATIONS = os.environ.get('RESPONSE_CACHE_GENERATIONS', 'mongo')  # mongo, memory
+# In-memory generations restart at 0 with the process, so their ETags carry a per-process epoch
+RESPONSE_ETAG_EPOCH = "g" if RESPONSE_CACHE_GENERATIONS == "mongo" else uuid.uuid4().hex[:8]
+
+
+class LRUCacheBackend:
+    """In-process LRU store; swap for a shared backend with the same interface"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.counters: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get_counter(self, key: str) -> int:
+        return self.counters.get(key, 0)
+
+    async def incr(self, key: str) -> int:
+        self.counters[key] = self.counters.get(key, 0) + 1
+        return self.counters[key]
+
+
+class MongoCounterStore:
+    """Counters shared by all workers, one document per key"""
+
+    async def get_counter(self, key: str) -> int:
+        doc = await db.cache_generations.find_one({"_id": key})
+        return doc["value"] if doc else 0
+
+    async def incr(self, key: str) -> int:
+        doc = await db.cache_generations.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"value": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return doc["value"]
+
+
+class ResponseCache:
+    """Per-user response cache invalidated by bumping a data generation
+    
+    Bodies are cached per worker; generations come from a shared counter
+    store so an invalidation on one worker retires every worker's entries.
+    """
+
+    def __init__(self, backend=None, counters=None):
+        self.backend = backend or LRUCacheBackend()
+        self.counters = counters or (MongoCounterStore() if RESPONSE_CACHE_GENERATIONS == "mongo" else self.backend)
+
+    async def generation(self, user_id: str) -> int:
+        return await self.counters.get_counter(f"gen:{user_id}")
+
+    async def invalidate(self, user_id: str) -> int:
+        return await self.counters.incr(f"gen:{user_id}")
+
+    async def key(self, user_id: str, endpoint: str, params: Dict[str, str]) -> str:
+        query = "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+        generation = await self.generation(user_id)
+        return f"resp:{user_id}:{generation}:{endpoint}?{query}"
+
+
+response_cache = ResponseCache()
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, preferring br on ties"""
+    offered = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip().lower()] = q
+    choices = [enc for enc in ("br", "gzip") if (enc != "br" or BROTLI_AVAILABLE) and offered.get(enc, offered.get("*", 0)) > 0]
+    return max(choices, key=lambda enc: offered.get(enc, offered.get("*", 0)), default=None)
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        import brotli
+        return brotli.compress(body, quality=5)
+    import gzip
+    return gzip.compress(body, compresslevel=6)
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """Weak comparison, as If-None-Match requires"""
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in tags or "*" in tags
+
+
+async def cached_json_response(request: Request, user_id: str, endpoint: str, loader) -> Response:
+    """Serve a per-user JSON response from cache with ETag/304 and compression
+    
+    The ETag is derived from the user's data generation and the request, not
+    the body, so a matching If-None-Match returns 304 without running the
+    loader even when the body has been evicted from the cache. Reading the
+    generation is itself one find_one on cache_generations when
+    RESPONSE_CACHE_GENERATIONS=mongo; it is not cached in process, since a
+    stale generation would answer 304 after another worker's invalidation.
+    """
+    key = await response_cache.key(user_id, endpoint, dict(request.query_params))
+    etag = f'W/"{RESPONSE_ETAG_EPOCH}-{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(etag, request.headers.get("If-None-Match", "")):
+        return Response(status_code=304, headers=headers)
+    
+    entry = await response_cache.backend.get(key)
+    if entry is None:
+        # Documents are mostly JSON-native; only encode the values that are not
+        body = json.dumps(await loader(), separators=(",", ":"), default=jsonable_encoder).encode()
+        entry = {"body": body, "encoded": {}}
+        await response_cache.backend.set(key, entry)
+    
+    body = entry["body"]
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding and len(body) >= RESPONSE_COMPRESSION_MIN_BYTES:
+        # Compress once per generation and encoding, then serve from cache
+        if encoding not in entry["encoded"]:
+            entry["encoded"][encoding] = compress_body(body, encoding)
+            await response_cache.backend.set(key, entry)
+        body = entry["encoded"][encoding]
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # =============================================================================
 # AUTH ENDPOINTS
 # =============================================================================
@@ -171,6 +1014,8 @@ async def get_current_user(request: Request) -> User:
 @api_router.post("/auth/session")
 async def create_session(request: SessionRequest, response: Response):
     """Exchange session_id for session_token"""
+    import httpx
+    
     try:
         async with httpx.AsyncClient() as client_http:
             resp = await client_http.get(
@@ -186,51 +1031,13 @@ async def create_session(request: SessionRequest, response: Response):
         logger.error(f"Auth request failed: {e}")
         raise HTTPException(status_code=500, detail="Authentication service unavailable")
     
-    email = data.get("email")
-    name = data.get("name", "")
-    picture = data.get("picture", "")
-    session_token = data.get("session_token")
-    
-    # Check if user exists
-    existing_user = await db.users.find_one({"email": email}, {"_id": 0})
-    
-    if existing_user:
-        user_id = existing_user["user_id"]
-        # Update user data
-        await db.users.update_one(
-            {"user_id": user_id},
-            {"$set": {"name": name, "picture": picture}}
-        )
+    expires_at = datetime.now(timezone.utc) + SESSION_TTL
+    if SESSION_TOKEN_MODE == "signed":
+        user_doc = await persist_login(data)
+        session_token = issue_signed_token(user_doc, expires_at)
     else:
-        user_id = f"user_{uuid.uuid4().hex[:12]}"
-        new_user = {
-            "user_id": user_id,
-            "email": email,
-            "name": name,
-            "picture": picture,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.users.insert_one(new_user)
-        
-        # Create default settings
-        await db.user_settings.insert_one({
-            "user_id": user_id,
-            "google_sheet_url": None,
-            "google_drive_folder_id": None,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        })
-    
-    # Store session
-    expires_at = datetime.now(timezone.utc) + timedelta(days=7)
-    session_doc = {
-        "user_id": user_id,
-        "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    
-    await db.user_sessions.delete_many({"user_id": user_id})
-    await db.user_sessions.insert_one(session_doc)
+        session_token = data.get("session_token")
+        user_doc = await persist_login(data, session_token, expires_at)
     
     # Set cookie
     response.set_cookie(
@@ -240,10 +1047,69 @@ async def create_session(request: SessionRequest, response: Response):
         secure=True,
         samesite="none",
         path="/",
-        max_age=7 * 24 * 60 * 60
+        max_age=int(SESSION_TTL.total_seconds())
     )
     
-    user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+    return user_doc
+
+async def upsert_login_user(email: str, name: str, picture: str) -> Dict[str, Any]:
+    """Create or refresh the user for a login, returning the stored document"""
+    now = datetime.now(timezone.utc).isoformat()
+    update = {
+        "$set": {"name": name, "picture": picture},
+        "$setOnInsert": {
+            "user_id": f"user_{uuid.uuid4().hex[:12]}",
+            "email": email,
+            "created_at": now
+        }
+    }
+    try:
+        return await db.users.find_one_and_update(
+            {"email": email}, update,
+            projection={"_id": 0}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A concurrent first login for the same email won the insert
+        return await db.users.find_one_and_update(
+            {"email": email}, {"$set": update["$set"]},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+
+async def persist_login(
+    data: Dict[str, Any],
+    session_token: Optional[str] = None,
+    expires_at: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Upsert user, default settings and (for db sessions) the session"""
+    user_doc = await upsert_login_user(data.get("email"), data.get("name", ""), data.get("picture", ""))
+    user_id = user_doc["user_id"]
+    now = datetime.now(timezone.utc).isoformat()
+    
+    writes = [
+        db.user_settings.update_one(
+            {"user_id": user_id},
+            {"$setOnInsert": {
+                "user_id": user_id,
+                "google_sheet_url": None,
+                "google_drive_folder_id": None,
+                "updated_at": now
+            }},
+            upsert=True
+        )
+    ]
+    if session_token:
+        # One session per user, replacing any previous login
+        writes.append(db.user_sessions.replace_one(
+            {"user_id": user_id},
+            {
+                "user_id": user_id,
+                "session_token": session_token,
+                "expires_at": expires_at.isoformat(),
+                "created_at": now
+            },
+            upsert=True
+        ))
+    await asyncio.gather(*writes)
     return user_doc
 
 @api_router.get("/auth/me")
@@ -257,8 +1123,11 @@ async def get_me(user: User = Depends(get_current_user)):
     }
 
 @api_router.post("/auth/logout")
-async def logout(response: Response, user: User = Depends(get_current_user)):
+async def logout(request: Request, response: Response, user: User = Depends(get_current_user)):
     """Logout user"""
+    claims = getattr(request.state, "session_claims", None)
+    if claims:
+        await revocation_list.revoke(claims)
     await db.user_sessions.delete_many({"user_id": user.user_id})
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out successfully"}
@@ -288,15 +1157,25 @@ async def update_settings(
     settings_update: SettingsUpdate,
     user: User = Depends(get_current_user)
 ):
-    """Update user settings"""
-    update_data = {k: v for k, v in settings_update.model_dump().items() if v is not None}
+    """Update user settings
+    
+    A retention window sent as null is turned off; other fields sent as
+    null are left unchanged.
+    """
+    sent = settings_update.model_dump(exclude_unset=True)
+    update_data = {k: v for k, v in sent.items() if v is not None}
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update: Dict[str, Any] = {"$set": update_data}
+    cleared = [k for k in RETENTION_SETTINGS if k in sent and sent[k] is None]
+    if cleared:
+        update["$unset"] = {k: "" for k in cleared}
     
     await db.user_settings.update_one(
         {"user_id": user.user_id},
-        {"$set": update_data},
+        update,
         upsert=True
     )
+    await response_cache.invalidate(user.user_id)
     
     settings = await db.user_settings.find_one(
         {"user_id": user.user_id},
@@ -309,220 +1188,1080 @@ async def update_settings(
 # =============================================================================
 
 @api_router.get("/invoices")
-async def get_invoices(user: User = Depends(get_current_user)):
+async def get_invoices(request: Request, fields: Optional[str] = None, user: User = Depends(get_current_user)):
     """Get all invoices for user"""
-    invoices = await db.invoices.find(
-        {"user_id": user.user_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(1000)
-    return invoices
+    projection = list_projection("invoices", fields)
+    async def load():
+        return await db.invoices.find(
+            {"user_id": user.user_id},
+            projection
+        ).sort("created_at", -1).to_list(1000)
+    return await cached_json_response(request, user.user_id, "invoices", load)
 
 @api_router.get("/invoices/stats")
 async def get_invoice_stats(user: User = Depends(get_current_user)):
     """Get invoice statistics"""
-    total = await db.invoices.count_documents({"user_id": user.user_id})
-    not_updated = await db.invoices.count_documents({"user_id": user.user_id, "status": "not_updated"})
-    matched = await db.invoices.count_documents({"user_id": user.user_id, "status": "matched"})
-    downloaded = await db.invoices.count_documents({"user_id": user.user_id, "status": "downloaded"})
-    not_matched = await db.invoices.count_documents({"user_id": user.user_id, "status": "not_matched"})
-    
-    return {
-        "total": total,
-        "not_updated": not_updated,
-        "matched": matched,
-        "downloaded": downloaded,
-        "not_matched": not_matched
+    stats = await aggregate_invoice_stats([user.user_id])
+    return stats[user.user_id]
+
+INVOICE_STATUSES = ("not_updated", "matched", "downloaded", "not_matched")
+
+async def aggregate_invoice_stats(user_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """Invoice counts by status for many users in one $group"""
+    stats = {
+        user_id: {"total": 0, **{status: 0 for status in INVOICE_STATUSES}}
+        for user_id in user_ids
     }
+    async for row in db.invoices.aggregate([
+        {"$match": {"user_id": {"$in": user_ids}}},
+        {"$group": {"_id": {"user_id": "$user_id", "status": "$status"}, "count": {"$sum": 1}}}
+    ]):
+        user_stats = stats[row["_id"]["user_id"]]
+        user_stats["total"] += row["count"]
+        if row["_id"]["status"] in INVOICE_STATUSES:
+            user_stats[row["_id"]["status"]] = row["count"]
+    return stats
 
 # =============================================================================
 # EMAIL SCAN ENDPOINTS
 # =============================================================================
 
 @api_router.get("/email-scans")
-async def get_email_scans(user: User = Depends(get_current_user)):
+async def get_email_scans(request: Request, fields: Optional[str] = None, user: User = Depends(get_current_user)):
     """Get all email scan results"""
-    scans = await db.email_scans.find(
-        {"user_id": user.user_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(1000)
-    return scans
+    projection = list_projection("email_scans", fields)
+    async def load():
+        return await db.email_scans.find(
+            {"user_id": user.user_id},
+            projection
+        ).sort("created_at", -1).to_list(1000)
+    return await cached_json_response(request, user.user_id, "email-scans", load)
 
 # =============================================================================
 # ATTACHMENT ENDPOINTS
 # =============================================================================
 
 @api_router.get("/attachments")
-async def get_attachments(user: User = Depends(get_current_user)):
+async def get_attachments(request: Request, fields: Optional[str] = None, user: User = Depends(get_current_user)):
     """Get all downloaded attachments"""
-    attachments = await db.attachments.find(
-        {"user_id": user.user_id},
-        {"_id": 0}
-    ).sort("downloaded_at", -1).to_list(1000)
-    return attachments
+    projection = list_projection("attachments", fields)
+    async def load():
+        return await db.attachments.find(
+            {"user_id": user.user_id},
+            projection
+        ).sort("downloaded_at", -1).to_list(1000)
+    return await cached_json_response(request, user.user_id, "attachments", load)
 
 # =============================================================================
-# WORKFLOW ENDPOINTS
+# SEARCH
 # =============================================================================
 
-@api_router.get("/workflow/runs")
-async def get_workflow_runs(user: User = Depends(get_current_user)):
-    """Get workflow run history"""
-    runs = await db.workflow_runs.find(
-        {"user_id": user.user_id},
-        {"_id": 0}
-    ).sort("started_at", -1).to_list(100)
-    return runs
+SEARCH_MAX_LIMIT = 100
 
-@api_router.post("/workflow/trigger")
-async def trigger_workflow(user: User = Depends(get_current_user)):
-    """Trigger the invoice matching workflow"""
-    # Check if user has settings configured
-    settings = await db.user_settings.find_one(
-        {"user_id": user.user_id},
-        {"_id": 0}
-    )
-    
-    if not settings or not settings.get("google_sheet_url"):
-        raise HTTPException(
-            status_code=400,
-            detail="Please configure Google Sheet URL in settings first"
-        )
-    
-    # Create workflow run
-    run = WorkflowRun(user_id=user.user_id, status="running")
-    run_doc = run.model_dump()
-    run_doc["started_at"] = run_doc["started_at"].isoformat()
-    await db.workflow_runs.insert_one(run_doc)
-    
-    # Simulate workflow execution (in real implementation, this would be async)
-    # For demo purposes, we'll create sample data
-    
-    # Sample invoices from "Google Sheet"
-    sample_invoices = [
-        {"invoice_number": "INV-2024-001", "status": "not_updated"},
-        {"invoice_number": "INV-2024-002", "status": "not_updated"},
-        {"invoice_number": "INV-2024-003", "status": "not_updated"},
-        {"invoice_number": "TAX-2024-001", "status": "not_updated"},
-        {"invoice_number": "TAX-2024-002", "status": "not_updated"},
-    ]
-    
-    # Sample email scan results
-    sample_emails = [
-        {
-            "email_id": f"email_{uuid.uuid4().hex[:8]}",
-            "subject": "Tax Invoice INV-2024-001 attached",
-            "sender": "vendor@example.com",
-            "date": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M"),
-            "has_attachment": True,
-            "extracted_invoice_numbers": ["INV-2024-001"],
-            "matched_invoice": "INV-2024-001",
-            "status": "matched"
-        },
-        {
-            "email_id": f"email_{uuid.uuid4().hex[:8]}",
-            "subject": "Invoice TAX-2024-001 for your records",
-            "sender": "billing@supplier.com",
-            "date": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M"),
-            "has_attachment": True,
-            "extracted_invoice_numbers": ["TAX-2024-001"],
-            "matched_invoice": "TAX-2024-001",
-            "status": "matched"
-        },
-        {
-            "email_id": f"email_{uuid.uuid4().hex[:8]}",
-            "subject": "Monthly statement",
-            "sender": "accounts@company.com",
-            "date": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M"),
-            "has_attachment": False,
-            "extracted_invoice_numbers": [],
-            "matched_invoice": None,
-            "status": "scanned"
-        },
-    ]
-    
-    invoices_processed = 0
-    emails_scanned = len(sample_emails)
-    attachments_downloaded = 0
-    
-    # Store invoices
-    for inv in sample_invoices:
-        existing = await db.invoices.find_one({
-            "user_id": user.user_id,
-            "invoice_number": inv["invoice_number"]
-        })
-        if not existing:
-            invoice = Invoice(
-                user_id=user.user_id,
-                invoice_number=inv["invoice_number"],
-                status=inv["status"]
-            )
-            inv_doc = invoice.model_dump()
-            inv_doc["created_at"] = inv_doc["created_at"].isoformat()
-            inv_doc["updated_at"] = inv_doc["updated_at"].isoformat()
-            await db.invoices.insert_one(inv_doc)
-            invoices_processed += 1
-    
-    # Store email scans and process matches
-    for email in sample_emails:
-        scan = EmailScanResult(
-            user_id=user.user_id,
-            email_id=email["email_id"],
-            subject=email["subject"],
-            sender=email["sender"],
-            date=email["date"],
-            has_attachment=email["has_attachment"],
-            extracted_invoice_numbers=email["extracted_invoice_numbers"],
-            matched_invoice=email["matched_invoice"],
-            status=email["status"]
+SEARCH_TARGETS = {
+    "invoices": {
+        "collection": "invoices",
+        "prefix_field": "invoice_number_norm",
+        "id_field": "invoice_id",
+    },
+    "email_scans": {
+        "collection": "email_scans",
+        "prefix_field": "extracted_invoice_numbers_norm",
+        "id_field": "scan_id",
+    },
+}
+
+
+@api_router.get("/search")
+async def search(
+    q: str,
+    type: str = "invoices",
+    status: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 25,
+    fields: Optional[str] = None,
+    user: User = Depends(get_current_user)
+):
+    """Search invoices or email scans by invoice-number prefix and text"""
+    target = SEARCH_TARGETS.get(type)
+    if not target:
+        raise HTTPException(status_code=400, detail=f"Unknown search type: {type}")
+    if offset < 0 or not 0 < limit <= SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail="Invalid offset/limit")
+
+    collection = db[target["collection"]]
+    projection = list_projection(target["collection"], fields)
+    # Results are deduplicated by id; fields=* is an exclusion projection
+    # that already returns it, and adding an inclusion would change its meaning
+    if any(value == 1 for name, value in projection.items() if name != "_id"):
+        projection[target["id_field"]] = 1
+    base_query: Dict[str, Any] = {"user_id": user.user_id}
+    if status:
+        base_query["status"] = status
+    # Fetch one extra so we can tell whether another page exists
+    wanted = offset + limit + 1
+
+    results: List[Dict[str, Any]] = []
+    seen = set()
+
+    def collect(docs):
+        for doc in docs:
+            if doc[target["id_field"]] not in seen:
+                seen.add(doc[target["id_field"]])
+                results.append(doc)
+
+    # Invoice-number prefix hits rank first, served from the normalized index
+    normalized = normalize_invoice_number(q)
+    if normalized:
+        collect(await collection.find(
+            {**base_query, target["prefix_field"]: {"$regex": f"^{re.escape(normalized)}"}},
+            projection
+        ).sort(target["prefix_field"], 1).limit(wanted).to_list(wanted))
+
+    if len(results) < wanted and q.strip():
+        collect(await collection.find(
+            {**base_query, "$text": {"$search": q}},
+            {**projection, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).limit(wanted).to_list(wanted))
+
+    page = results[offset:offset + limit]
+    for doc in page:
+        doc.pop("score", None)
+    return {
+        "items": page,
+        "offset": offset,
+        "limit": limit,
+        "has_more": len(results) > offset + limit
+    }
+
+# =============================================================================
+# RUN EVENTS (SSE)
+# =============================================================================
+
+# When enabled, progress is written to workflow_runs and fanned out from a
+# Mongo change stream, so subscribers on any worker see every run.
+RUN_EVENTS_CHANGE_STREAM = os.environ.get('RUN_EVENTS_CHANGE_STREAM', '').lower() in ('1', 'true', 'yes')
+RUN_EVENTS_KEEPALIVE_SECONDS = 15
+RUN_TERMINAL_STATUSES = ("completed", "failed")
+
+
+class RunEventBroker:
+    """In-process pub/sub fan-out of workflow run progress events"""
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.subscribers: Dict[str, set] = {}
+
+    def subscribe(self, run_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(run_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, run_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(run_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[run_id]
+
+    def publish(self, run_id: str, event: Dict[str, Any]):
+        for queue in self.subscribers.get(run_id, ()):
+            # Drop the oldest event for slow consumers rather than blocking the run
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+
+run_events = RunEventBroker()
+
+
+def run_event_from_doc(run_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a progress event from a workflow_runs document"""
+    return {
+        "run_id": run_doc["run_id"],
+        "status": run_doc.get("status"),
+        "stage": run_doc.get("stage", run_doc.get("status")),
+        "invoices_processed": run_doc.get("invoices_processed", 0),
+        "emails_scanned": run_doc.get("emails_scanned", 0),
+        "attachments_downloaded": run_doc.get("attachments_downloaded", 0),
+    }
+
+
+async def publish_run_progress(run_id: str, status: str, stage: str, **counters):
+    """Publish a run stage/counter update to SSE subscribers"""
+    if RUN_EVENTS_CHANGE_STREAM:
+        await db.workflow_runs.update_one(
+            {"run_id": run_id},
+            {"$set": {"status": status, "stage": stage, **counters}}
         )
-        scan_doc = scan.model_dump()
-        scan_doc["created_at"] = scan_doc["created_at"].isoformat()
-        await db.email_scans.insert_one(scan_doc)
+        return
+    run_events.publish(run_id, run_event_from_doc({
+        "run_id": run_id, "status": status, "stage": stage, **counters
+    }))
+
+
+async def watch_workflow_runs():
+    """Feed the local broker from a change stream on workflow_runs"""
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+    while True:
+        try:
+            async with db.workflow_runs.watch(pipeline, full_document="updateLookup") as stream:
+                async for change in stream:
+                    run_doc = change.get("fullDocument")
+                    if run_doc:
+                        run_events.publish(run_doc["run_id"], run_event_from_doc(run_doc))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"workflow_runs change stream failed: {e}")
+            await asyncio.sleep(5)
+
+
+def format_sse(event: Dict[str, Any], event_type: str = "progress") -> str:
+    return f"event: {event_type}\ndata: {json.dumps(event)}\n\n"
+
+# =============================================================================
+# OPTIONAL SUBSYSTEMS
+# =============================================================================
+
+# PDF inspection, metrics rollups, retention and the n8n export live in the
+# subsystems package and are imported on first use to keep startup light.
+PDF_INSPECTION_ENABLED = os.environ.get('PDF_INSPECTION_ENABLED', '').lower() in ('1', 'true', 'yes')
+RETENTION_INTERVAL_SECONDS = int(os.environ.get('RETENTION_INTERVAL_SECONDS', '0'))
+SHEET_SYNC_ENABLED = os.environ.get('SHEET_SYNC_ENABLED', '').lower() in ('1', 'true', 'yes')
+# Push is on when set: the audience of the subscription's OIDC token, and
+# the service account Pub/Sub signs it as
+GMAIL_PUSH_AUDIENCE = os.environ.get('GMAIL_PUSH_AUDIENCE')
+GMAIL_PUSH_SERVICE_ACCOUNT = os.environ.get('GMAIL_PUSH_SERVICE_ACCOUNT')
+GOOGLE_JWKS_URL = "https://www.googleapis.com/oauth2/v3/certs"
+GOOGLE_ISSUERS = ["https://accounts.google.com", "accounts.google.com"]
+# Profiling is off, with no middleware installed, unless a token is configured
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')
+PROFILE_RETENTION_DAYS = int(os.environ.get('PROFILE_RETENTION_DAYS', '7'))
+
+
+@api_router.get("/metrics/history")
+async def get_metrics_history(
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user: User = Depends(get_current_user)
+):
+    """Serve a dense time series of run metrics from the rollups"""
+    from subsystems.metrics import metrics_history
+    
+    return await metrics_history(user.user_id, granularity, start, end)
+
+
+@api_router.post("/retention/run")
+async def run_retention(user: User = Depends(get_current_user)):
+    """Apply the current user's retention windows now"""
+    from subsystems.retention import apply_retention
+    
+    settings = await db.user_settings.find_one({"user_id": user.user_id}, {"_id": 0}) or {}
+    return await apply_retention(user.user_id, settings)
+
+
+_push_jwks = None
+
+
+def verify_push_jwt(token: str) -> bool:
+    """Check the OIDC token Pub/Sub signs push requests with
+    
+    Blocking on a signing key cache miss, so call it in a thread.
+    """
+    import jwt
+    
+    global _push_jwks
+    if _push_jwks is None:
+        # Caches Google's signing keys between requests
+        _push_jwks = jwt.PyJWKClient(GOOGLE_JWKS_URL)
+    try:
+        key = _push_jwks.get_signing_key_from_jwt(token)
+        claims = jwt.decode(
+            token, key.key, algorithms=["RS256"], audience=GMAIL_PUSH_AUDIENCE, issuer=GOOGLE_ISSUERS
+        )
+    except jwt.PyJWTError as e:
+        logger.warning(f"Rejected Gmail push token: {e}")
+        return False
+    return bool(claims.get("email_verified")) and claims.get("email") == GMAIL_PUSH_SERVICE_ACCOUNT
+
+
+@api_router.post("/ingest/gmail-push")
+async def ingest_gmail_push(request: Request):
+    """Receive a Pub/Sub push for new Gmail messages and enqueue them
+    
+    Authenticated by the OIDC bearer token of the push subscription, not a
+    shared secret in the URL, which would end up in access logs.
+    """
+    from subsystems.push_ingest import advance_history_cursor, enqueue_messages, list_new_message_ids
+    
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if (
+        not GMAIL_PUSH_AUDIENCE or not GMAIL_PUSH_SERVICE_ACCOUNT
+        or scheme.lower() != "bearer" or not token
+        or not await asyncio.to_thread(verify_push_jwt, token)
+    ):
+        raise HTTPException(status_code=403, detail="Invalid push token")
+    try:
+        envelope = await request.json()
+        data = json.loads(base64.b64decode(envelope["message"]["data"]))
+    except (ValueError, KeyError, TypeError):
+        # Acknowledge malformed messages so Pub/Sub does not redeliver them
+        logger.warning("Ignoring malformed Gmail push message")
+        return Response(status_code=204)
+    
+    user = await db.users.find_one({"email": data.get("emailAddress")}, {"_id": 0, "user_id": 1})
+    if not user:
+        return Response(status_code=204)
+    # Gmail sends a historyId; other publishers may send message ids directly.
+    # Failures below answer 500, so Pub/Sub redelivers with the cursor unmoved.
+    message_ids = data.get("messageIds") or []
+    history_id = None if message_ids else data.get("historyId")
+    if history_id:
+        message_ids = await list_new_message_ids(user["user_id"], str(history_id))
+    if message_ids:
+        await enqueue_messages(user["user_id"], message_ids)
+    if history_id:
+        await advance_history_cursor(user["user_id"], str(history_id))
+    return Response(status_code=204)
+
+
+def profiling_authorized(token: Optional[str]) -> bool:
+    return bool(PROFILING_TOKEN and token and hmac.compare_digest(token, PROFILING_TOKEN))
+
+
+class ProfilingMiddleware:
+    """Profile /api requests sent with an X-Profile header set to PROFILING_TOKEN
+    
+    Only a header is accepted: a query parameter would put the token in
+    access logs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        token = None
+        if scope["type"] == "http" and scope["path"].startswith("/api/"):
+            token = dict(scope["headers"]).get(b"x-profile", b"").decode()
+        if not profiling_authorized(token):
+            await self.app(scope, receive, send)
+            return
         
-        # Update matched invoice status and create attachment
-        if email["matched_invoice"] and email["has_attachment"]:
-            await db.invoices.update_one(
-                {"user_id": user.user_id, "invoice_number": email["matched_invoice"]},
-                {
-                    "$set": {
-                        "status": "downloaded",
-                        "email_subject": email["subject"],
-                        "email_from": email["sender"],
-                        "email_date": email["date"],
-                        "attachment_name": f"{email['matched_invoice']}.pdf",
-                        "drive_link": f"https://drive.google.com/file/d/sample_{email['matched_invoice']}/view",
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }
-                }
-            )
-            
-            # Create attachment record
-            attachment = Attachment(
-                user_id=user.user_id,
-                invoice_number=email["matched_invoice"],
-                filename=f"{email['matched_invoice']}.pdf",
-                drive_file_id=f"sample_{email['matched_invoice']}",
-                drive_link=f"https://drive.google.com/file/d/sample_{email['matched_invoice']}/view",
-                email_subject=email["subject"]
+        from subsystems.profiling import profiled
+        
+        async with profiled("request", f"{scope['method']} {scope['path']}") as profile:
+            async def send_with_profile_id(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile.profile_id.encode())]
+                await send(message)
+            await self.app(scope, receive, send_with_profile_id)
+
+
+@api_router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: str = "html", user: User = Depends(get_current_user)):
+    """Download a stored profile as HTML or speedscope JSON, or its summary"""
+    from subsystems.profiling import PROFILE_FORMATS, render_profile
+    
+    doc = await db.profiles.find_one({"profile_id": profile_id}, {"_id": 0})
+    # Request profiles have no owner, so only admins can read them
+    if not doc or (doc.get("user_id") != user.user_id and user.email.lower() not in ADMIN_EMAILS):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "summary":
+        return {key: value for key, value in doc.items() if key != "session"}
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    extension = "html" if format == "html" else "speedscope.json"
+    return Response(
+        content=render_profile(doc, format),
+        media_type=PROFILE_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.{extension}"'}
+    )
+
+
+async def archived_counts(user_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """Counts of retention-archived documents, kept so totals stay intact"""
+    docs = await db.archive_stats.find({"user_id": {"$in": user_ids}}, {"_id": 0}).to_list(None)
+    return {doc["user_id"]: doc for doc in docs}
+
+# =============================================================================
+# LEASES
+# =============================================================================
+
+# Identifies this process as a lease holder when several workers share the database
+WORKER_ID = f"worker_{uuid.uuid4().hex[:8]}"
+
+
+async def acquire_lease(name: str, holder: str, ttl: timedelta) -> bool:
+    """Take or renew a named lease shared by all workers
+    
+    A lease whose holder died lapses after ttl and can then be taken over.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.leases.update_one(
+            {"_id": name, "$or": [
+                {"holder": holder},
+                {"expires_at": {"$lt": now}}
+            ]},
+            {"$set": {"holder": holder, "expires_at": now + ttl}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The filter missed because someone else holds the lease
+        return False
+    return True
+
+
+async def lease_holder(name: str) -> Optional[str]:
+    lease = await db.leases.find_one({"_id": name})
+    if not lease or lease["expires_at"].replace(tzinfo=timezone.utc) < datetime.now(timezone.utc):
+        return None
+    return lease["holder"]
+
+
+async def release_lease(name: str, holder: str):
+    await db.leases.delete_one({"_id": name, "holder": holder})
+
+# =============================================================================
+# WORKFLOW CONCURRENCY
+# =============================================================================
+
+WORKFLOW_MAX_CONCURRENT_RUNS = int(os.environ.get('WORKFLOW_MAX_CONCURRENT_RUNS', '4'))
+WORKFLOW_MAX_QUEUE_DEPTH = int(os.environ.get('WORKFLOW_MAX_QUEUE_DEPTH', '16'))
+WORKFLOW_RETRY_AFTER_SECONDS = 5
+# Bounds how long a crashed worker's run blocks new triggers for its user
+WORKFLOW_RUN_LEASE = timedelta(seconds=int(os.environ.get('WORKFLOW_RUN_LEASE_SECONDS', '3600')))
+
+
+def workflow_lease(user_id: str) -> str:
+    return f"workflow_run:{user_id}"
+
+
+class WorkflowRunLimiter:
+    """Bound on concurrent runs and queue depth in this worker
+    
+    Per-user single-flight is a lease in Mongo so it holds across workers;
+    the run and queue bounds apply to each worker process.
+    """
+
+    def __init__(self, max_concurrent: int):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.queued = 0
+        self.running = 0
+        self.tasks: set = set()
+
+    def start(self, coro) -> asyncio.Task:
+        """Run a workflow in the background, keeping a reference until it finishes
+        
+        The task gets a fresh context: it outlives the request that started
+        it, so it must not inherit that request's profile.
+        """
+        task = asyncio.create_task(coro, context=contextvars.Context())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_concurrent": WORKFLOW_MAX_CONCURRENT_RUNS,
+            "max_queue_depth": WORKFLOW_MAX_QUEUE_DEPTH,
+        }
+
+
+workflow_limiter = WorkflowRunLimiter(WORKFLOW_MAX_CONCURRENT_RUNS)
+
+# =============================================================================
+# GOOGLE API RATE LIMITS
+# =============================================================================
+
+# Limits are "api:units_per_second:burst,..." and count Google quota units
+GOOGLE_API_USER_LIMITS = os.environ.get('GOOGLE_API_USER_LIMITS', 'gmail:250:250,sheets:1:60,drive:20:100')
+GOOGLE_API_PROJECT_LIMITS = os.environ.get('GOOGLE_API_PROJECT_LIMITS', 'gmail:20000:20000,sheets:5:300,drive:200:1000')
+GOOGLE_API_RATE_BACKEND = os.environ.get('GOOGLE_API_RATE_BACKEND', 'memory')  # memory, mongo
+GMAIL_QUOTA_UNITS = {"history.list": 2, "messages.list": 5, "messages.get": 5}
+
+
+def parse_api_limits(value: str) -> Dict[str, tuple]:
+    limits = {}
+    for entry in value.split(","):
+        if entry.count(":") == 2:
+            api, rate, burst = entry.strip().split(":")
+            limits[api] = (float(rate), float(burst))
+    return limits
+
+
+class TokenBucket:
+    """In-process token bucket; reserve() returns how long to wait for the units"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def reserve(self, units: int) -> float:
+        now = time.monotonic()
+        # Tokens may go negative: that debt is the caller's wait
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate) - units
+        self.updated = now
+        return max(0.0, -self.tokens / self.rate)
+
+
+class MongoTokenBucket:
+    """Token bucket shared by all processes through one document per key"""
+
+    def __init__(self, key: str, rate: float, burst: float):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    async def reserve(self, units: int) -> float:
+        now = time.time()
+        elapsed = {"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}]}
+        refilled = {"$add": [{"$ifNull": ["$tokens", self.burst]}, {"$multiply": [elapsed, self.rate]}]}
+        doc = await db.api_rate_buckets.find_one_and_update(
+            {"_id": self.key},
+            [{"$set": {
+                "tokens": {"$subtract": [{"$min": [self.burst, refilled]}, units]},
+                "updated_at": {"$max": [{"$ifNull": ["$updated_at", now]}, now]},
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return max(0.0, -doc["tokens"] / self.rate)
+
+
+class FairApiQueue:
+    """Hands out one API's project-wide tokens round-robin across tenants"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.waiters: Dict[str, deque] = {}  # user_id -> (future, units)
+        self.ring: deque = deque()  # user_ids with waiters, next to serve first
+        self.pump_task: Optional[asyncio.Task] = None
+
+    async def acquire(self, user_id: str, units: int):
+        future = asyncio.get_running_loop().create_future()
+        if user_id not in self.waiters:
+            self.waiters[user_id] = deque()
+            self.ring.append(user_id)
+        self.waiters[user_id].append((future, units))
+        if self.pump_task is None or self.pump_task.done():
+            self.pump_task = asyncio.create_task(self.pump())
+        await future
+
+    async def pump(self):
+        while self.ring:
+            user_id = self.ring[0]
+            future, units = self.waiters[user_id].popleft()
+            if self.waiters[user_id]:
+                self.ring.rotate(-1)
+            else:
+                del self.waiters[user_id]
+                self.ring.popleft()
+            if future.done():
+                continue  # caller was cancelled while queued
+            try:
+                wait = await self.bucket.reserve(units)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            if wait:
+                await asyncio.sleep(wait)
+            if not future.done():
+                future.set_result(None)
+
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+
+class GoogleApiLimiter:
+    """Per-user and project-wide token buckets that outbound Google calls pass through
+    
+    A user's own bucket caps what one tenant can draw; the project bucket
+    protects the shared quota and is granted fairly across tenants.
+    """
+
+    def __init__(self, user_limits: Dict[str, tuple], project_limits: Dict[str, tuple], backend: str = "memory"):
+        self.user_limits = user_limits
+        self.backend = backend
+        self.user_buckets: Dict[str, Any] = {}
+        self.queues = {
+            api: FairApiQueue(self.make_bucket(f"{api}:*", rate, burst))
+            for api, (rate, burst) in project_limits.items()
+        }
+
+    def make_bucket(self, key: str, rate: float, burst: float):
+        if self.backend == "mongo":
+            return MongoTokenBucket(key, rate, burst)
+        return TokenBucket(rate, burst)
+
+    async def acquire(self, user_id: str, api: str, units: int = 1, usage: Optional[Dict[str, int]] = None):
+        """Wait until the call may be made; add the units to a run's usage if given"""
+        if api in self.user_limits:
+            key = f"{api}:{user_id}"
+            if key not in self.user_buckets:
+                self.user_buckets[key] = self.make_bucket(key, *self.user_limits[api])
+            wait = await self.user_buckets[key].reserve(units)
+            if wait:
+                await asyncio.sleep(wait)
+        if api in self.queues:
+            await self.queues[api].acquire(user_id, units)
+        if usage is not None:
+            usage[api] = usage.get(api, 0) + units
+
+    def stats(self) -> Dict[str, int]:
+        return {api: queue.waiting() for api, queue in self.queues.items()}
+
+
+google_api_limiter = GoogleApiLimiter(
+    parse_api_limits(GOOGLE_API_USER_LIMITS),
+    parse_api_limits(GOOGLE_API_PROJECT_LIMITS),
+    GOOGLE_API_RATE_BACKEND
+)
+
+# =============================================================================
+# WORKFLOW DATA SOURCES
+# =============================================================================
+
+WORKFLOW_DATA_SOURCE = os.environ.get('WORKFLOW_DATA_SOURCE', 'sample')  # sample, synthetic
+WORKFLOW_BATCH_SIZE = int(os.environ.get('WORKFLOW_BATCH_SIZE', '1000'))
+
+
+class SampleDataSource:
+    """The demo sheet and mailbox a run reads until Google is wired up
+    
+    A data source provides sheet_rows() -> [{"invoice_number"}] and emails()
+    -> [{"email_id", "subject", "sender", "date", "body", "attachments":
+    [{"filename", "content"}]}], charging Google quota to the run's usage.
+    The workflow extracts and matches invoice numbers itself.
+    """
+
+    async def sheet_rows(self, user_id: str, api_usage: Dict[str, int]) -> List[Dict[str, Any]]:
+        await google_api_limiter.acquire(user_id, "sheets", usage=api_usage)
+        return [
+            {"invoice_number": number}
+            for number in ("INV-2024-001", "INV-2024-002", "INV-2024-003", "TAX-2024-001", "TAX-2024-002")
+        ]
+
+    async def emails(self, user_id: str, api_usage: Dict[str, int]) -> List[Dict[str, Any]]:
+        date = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M")
+        emails = [
+            {
+                "email_id": f"email_{uuid.uuid4().hex[:8]}",
+                "subject": "Tax Invoice INV-2024-001 attached",
+                "sender": "vendor@example.com",
+                "date": date,
+                "body": "",
+                "attachments": [{"filename": "INV-2024-001.pdf", "content": None}],
+            },
+            {
+                "email_id": f"email_{uuid.uuid4().hex[:8]}",
+                "subject": "Invoice TAX-2024-001 for your records",
+                "sender": "billing@supplier.com",
+                "date": date,
+                "body": "",
+                "attachments": [{"filename": "TAX-2024-001.pdf", "content": None}],
+            },
+            {
+                "email_id": f"email_{uuid.uuid4().hex[:8]}",
+                "subject": "Monthly statement",
+                "sender": "accounts@company.com",
+                "date": date,
+                "body": "",
+                "attachments": [],
+            },
+        ]
+        await google_api_limiter.acquire(
+            user_id, "gmail",
+            units=GMAIL_QUOTA_UNITS["messages.list"] + GMAIL_QUOTA_UNITS["messages.get"] * len(emails),
+            usage=api_usage
+        )
+        return emails
+
+
+def workflow_data_source():
+    if WORKFLOW_DATA_SOURCE == "synthetic":
+        from subsystems.synthetic_data import SyntheticDataSource
+        return SyntheticDataSource.from_env()
+    return SampleDataSource()
+
+
+class StageTimer:
+    """Wall time per workflow stage, stored on the run as stage_ms"""
+
+    def __init__(self):
+        self.stage_ms: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_ms[name] = round((time.perf_counter() - start) * 1000, 2)
+
+# =============================================================================
+# WORKFLOW ENDPOINTS
+# =============================================================================
+
+@api_router.get("/workflow/runs")
+async def get_workflow_runs(request: Request, fields: Optional[str] = None, user: User = Depends(get_current_user)):
+    """Get workflow run history"""
+    projection = list_projection("workflow_runs", fields)
+    async def load():
+        return await db.workflow_runs.find(
+            {"user_id": user.user_id},
+            projection
+        ).sort("started_at", -1).to_list(100)
+    return await cached_json_response(request, user.user_id, "workflow/runs", load)
+
+@api_router.get("/workflow/runs/{run_id}/events")
+async def stream_workflow_run_events(run_id: str, request: Request, user: User = Depends(get_current_user)):
+    """Stream workflow run progress as Server-Sent Events"""
+    queue = run_events.subscribe(run_id)
+    run_doc = await db.workflow_runs.find_one(
+        {"run_id": run_id, "user_id": user.user_id},
+        {"_id": 0}
+    )
+    if not run_doc:
+        run_events.unsubscribe(run_id, queue)
+        raise HTTPException(status_code=404, detail="Workflow run not found")
+
+    async def event_stream():
+        try:
+            snapshot = run_event_from_doc(run_doc)
+            yield format_sse(snapshot)
+            if snapshot["status"] in RUN_TERMINAL_STATUSES:
+                return
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=RUN_EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+                if event["status"] in RUN_TERMINAL_STATUSES:
+                    return
+        finally:
+            run_events.unsubscribe(run_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/workflow/trigger")
+async def trigger_workflow(request: Request, profile_run: bool = False, user: User = Depends(get_current_user)):
+    """Start the invoice matching workflow and return its run_id right away
+    
+    The run executes in the background; follow it on
+    /workflow/runs/{run_id}/events. profile_run=true profiles it, for admins
+    or requests with the X-Profile header.
+    """
+    if profile_run and not (
+        PROFILING_TOKEN and (
+            user.email.lower() in ADMIN_EMAILS or profiling_authorized(request.headers.get("x-profile"))
+        )
+    ):
+        raise HTTPException(status_code=403, detail="Profiling not allowed")
+    
+    # Check if user has settings configured
+    settings = await db.user_settings.find_one(
+        {"user_id": user.user_id},
+        {"_id": 0}
+    )
+    
+    if not settings or not settings.get("google_sheet_url"):
+        raise HTTPException(
+            status_code=400,
+            detail="Please configure Google Sheet URL in settings first"
+        )
+    
+    if workflow_limiter.queued >= WORKFLOW_MAX_QUEUE_DEPTH:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many workflow runs queued, please retry shortly",
+            headers={"Retry-After": str(WORKFLOW_RETRY_AFTER_SECONDS)}
+        )
+    
+    # A second trigger while one is in flight, on any worker, joins the existing run
+    run = WorkflowRun(user_id=user.user_id, status="pending")
+    lease = workflow_lease(user.user_id)
+    while not await acquire_lease(lease, run.run_id, WORKFLOW_RUN_LEASE):
+        existing_run_id = await lease_holder(lease)
+        if existing_run_id:
+            return {"run_id": existing_run_id, "status": "running", "deduplicated": True}
+        # Released between the two reads; try again
+    
+    try:
+        run_doc = run.model_dump()
+        run_doc["started_at"] = run_doc["started_at"].isoformat()
+        await db.workflow_runs.insert_one(run_doc)
+        # The pending run must show up in the list the page refetches now
+        await response_cache.invalidate(user.user_id)
+    except Exception:
+        await release_lease(lease, run.run_id)
+        raise
+    
+    workflow_limiter.start(run_workflow(user, run, profile=profile_run))
+    return {"run_id": run.run_id, "status": "pending"}
+
+
+async def run_workflow(user: User, run: WorkflowRun, source=None, profile: bool = False):
+    """Wait for a run slot and execute the run, marking it failed if it raises"""
+    try:
+        workflow_limiter.queued += 1
+        try:
+            await workflow_limiter.semaphore.acquire()
+        finally:
+            workflow_limiter.queued -= 1
+        workflow_limiter.running += 1
+        try:
+            if profile:
+                await execute_profiled_run(user, run, source)
+            else:
+                await execute_workflow_run(user, run, source)
+        finally:
+            workflow_limiter.running -= 1
+            workflow_limiter.semaphore.release()
+    except asyncio.CancelledError:
+        await mark_run_failed(run, "Run cancelled by server shutdown")
+        raise
+    except Exception as e:
+        logger.exception(f"Workflow run {run.run_id} failed")
+        await mark_run_failed(run, f"{type(e).__name__}: {e}")
+    finally:
+        try:
+            await release_lease(workflow_lease(run.user_id), run.run_id)
+        except Exception as e:
+            logger.error(f"Could not release the lease of run {run.run_id}: {e}")
+
+
+async def mark_run_failed(run: WorkflowRun, error: str):
+    """Move a run to the terminal failed state so subscribers and caches settle"""
+    try:
+        await db.workflow_runs.update_one(
+            {"run_id": run.run_id},
+            {
+                "$set": {
+                    "status": "failed",
+                    "stage": "failed",
+                    "completed_at": datetime.now(timezone.utc).isoformat()
+                },
+                "$push": {"errors": error}
+            }
+        )
+    except Exception as e:
+        logger.error(f"Could not mark run {run.run_id} failed: {e}")
+    if not RUN_EVENTS_CHANGE_STREAM:
+        run_events.publish(run.run_id, run_event_from_doc({
+            "run_id": run.run_id, "status": "failed", "stage": "failed"
+        }))
+    await response_cache.invalidate(run.user_id)
+
+
+async def execute_profiled_run(user: User, run: WorkflowRun, source=None) -> Dict[str, Any]:
+    """Run the workflow under the profiler and link the profile from the run"""
+    from subsystems.profiling import profiled
+    
+    async with profiled("run", run.run_id, user_id=user.user_id, run_id=run.run_id) as profile:
+        await db.workflow_runs.update_one(
+            {"run_id": run.run_id},
+            {"$set": {"profile_id": profile.profile_id, "profile_url": profile.url}}
+        )
+        return await execute_workflow_run(user, run, source)
+
+
+async def sync_sheet_invoices(user_id: str, rows: List[Dict[str, Any]], now: str) -> int:
+    """Insert sheet invoice numbers the user does not have yet"""
+    numbers = list(dict.fromkeys(row["invoice_number"] for row in rows))
+    existing = set()
+    for start in range(0, len(numbers), WORKFLOW_BATCH_SIZE):
+        found = await db.invoices.find(
+            {"user_id": user_id, "invoice_number": {"$in": numbers[start:start + WORKFLOW_BATCH_SIZE]}},
+            {"_id": 0, "invoice_number": 1}
+        ).to_list(None)
+        existing.update(inv["invoice_number"] for inv in found)
+    new_docs = [invoice_record(user_id, number, "not_updated", now) for number in numbers if number not in existing]
+    for start in range(0, len(new_docs), WORKFLOW_BATCH_SIZE):
+        await db.invoices.insert_many(new_docs[start:start + WORKFLOW_BATCH_SIZE])
+    return len(new_docs)
+
+
+def scan_email(email: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract invoice numbers from an email's subject and body"""
+    return {
+        "email_id": email["email_id"],
+        "subject": email["subject"],
+        "sender": email["sender"],
+        "date": email["date"],
+        "has_attachment": bool(email["attachments"]),
+        "attachments": email["attachments"],
+        "extracted_invoice_numbers": extract_invoice_numbers(f"{email['subject']}\n{email.get('body', '')}"),
+        "matched_invoice": None,
+        "match_candidates": [],
+        "status": "scanned",
+    }
+
+
+def match_scanned_emails(scanned: List[Dict[str, Any]], matcher: InvoiceMatcher) -> int:
+    """Fill in matched_invoice/match_candidates in place; returns the match count"""
+    matches = 0
+    for email in scanned:
+        if email["extracted_invoice_numbers"]:
+            email["matched_invoice"], email["match_candidates"] = matcher.match(email["extracted_invoice_numbers"])
+            if email["matched_invoice"]:
+                email["status"] = "matched"
+                matches += 1
+    return matches
+
+
+async def persist_scanned_emails(user_id: str, scanned: List[Dict[str, Any]], api_usage: Dict[str, int]) -> int:
+    """Store scans, mark matched invoices downloaded and record their attachments"""
+    attachments_downloaded = 0
+    for start in range(0, len(scanned), WORKFLOW_BATCH_SIZE):
+        batch = scanned[start:start + WORKFLOW_BATCH_SIZE]
+        now = datetime.now(timezone.utc).isoformat()
+        invoice_updates, attachment_docs, inspections = [], [], []
+        for email in batch:
+            if not (email["matched_invoice"] and email["has_attachment"]):
+                continue
+            matched = email["matched_invoice"]
+            attachment = email["attachments"][0]
+            # Simulated Drive upload
+            await google_api_limiter.acquire(user_id, "drive", usage=api_usage)
+            drive_link = f"https://drive.google.com/file/d/sample_{matched}/view"
+            invoice_updates.append(UpdateOne(
+                {"user_id": user_id, "invoice_number": matched},
+                {"$set": {
+                    "status": "downloaded",
+                    "email_subject": email["subject"],
+                    "email_from": email["sender"],
+                    "email_date": email["date"],
+                    "attachment_name": attachment["filename"],
+                    "drive_link": drive_link,
+                    "updated_at": now
+                }}
+            ))
+            att_doc = attachment_record(
+                user_id,
+                invoice_number=matched,
+                filename=attachment["filename"],
+                email_subject=email["subject"],
+                drive_file_id=f"sample_{matched}",
+                drive_link=drive_link,
+                now=now
             )
-            att_doc = attachment.model_dump()
-            att_doc["downloaded_at"] = att_doc["downloaded_at"].isoformat()
-            await db.attachments.insert_one(att_doc)
-            attachments_downloaded += 1
+            if PDF_INSPECTION_ENABLED and attachment.get("content"):
+                inspections.append((att_doc, attachment["content"]))
+            attachment_docs.append(att_doc)
+        
+        if inspections:
+            from subsystems.pdf_inspection import inspect_attachment
+            results = await asyncio.gather(*(
+                inspect_attachment(content, att_doc["invoice_number"]) for att_doc, content in inspections
+            ))
+            for (att_doc, _), result in zip(inspections, results):
+                att_doc.update(result)
+        
+        await db.email_scans.insert_many([email_scan_record(user_id, email, now) for email in batch])
+        if invoice_updates:
+            await db.invoices.bulk_write(invoice_updates, ordered=False)
+        if attachment_docs:
+            await db.attachments.insert_many(attachment_docs)
+        attachments_downloaded += len(attachment_docs)
+    return attachments_downloaded
+
+
+async def execute_workflow_run(user: User, run: WorkflowRun, source=None, stages: Optional[StageTimer] = None) -> Dict[str, Any]:
+    """Run the invoice matching workflow for an already-created run"""
+    source = source or workflow_data_source()
+    stages = stages or StageTimer()
+    api_usage: Dict[str, int] = {}
+    started_at = datetime.now(timezone.utc)
+    await db.workflow_runs.update_one(
+        {"run_id": run.run_id},
+        {"$set": {"status": "running", "started_at": started_at.isoformat()}}
+    )
+    await response_cache.invalidate(user.user_id)
+    await publish_run_progress(run.run_id, "running", "started")
+    
+    with stages.stage("read_sheet"):
+        rows = await source.sheet_rows(user.user_id, api_usage)
+    with stages.stage("sync_invoices"):
+        invoices_processed = await sync_sheet_invoices(user.user_id, rows, started_at.isoformat())
+    
+    await publish_run_progress(
+        run.run_id, "running", "invoices_synced",
+        invoices_processed=invoices_processed
+    )
+    
+    with stages.stage("fetch_emails"):
+        emails = await source.emails(user.user_id, api_usage)
+    with stages.stage("extract"):
+        scanned = [scan_email(email) for email in emails]
+    with stages.stage("match"):
+        matcher = await load_matcher(user.user_id)
+        matches = match_scanned_emails(scanned, matcher)
+    with stages.stage("persist"):
+        attachments_downloaded = await persist_scanned_emails(user.user_id, scanned, api_usage)
+    emails_scanned = len(scanned)
+    
+    await publish_run_progress(
+        run.run_id, "running", "emails_processed",
+        invoices_processed=invoices_processed,
+        emails_scanned=emails_scanned,
+        attachments_downloaded=attachments_downloaded
+    )
     
     # Update workflow run status
+    completed_at = datetime.now(timezone.utc)
     await db.workflow_runs.update_one(
         {"run_id": run.run_id},
         {
             "$set": {
                 "status": "completed",
-                "completed_at": datetime.now(timezone.utc).isoformat(),
+                "stage": "completed",
+                "completed_at": completed_at.isoformat(),
                 "invoices_processed": invoices_processed,
                 "emails_scanned": emails_scanned,
-                "attachments_downloaded": attachments_downloaded
+                "attachments_downloaded": attachments_downloaded,
+                "api_usage": api_usage,
+                "stage_ms": stages.stage_ms
             }
         }
     )
+    from subsystems.metrics import record_run_metrics
+    try:
+        await record_run_metrics(user.user_id, started_at, completed_at, {
+            "emails_scanned": emails_scanned,
+            "attachments_downloaded": attachments_downloaded,
+            "matches": matches,
+        })
+    except Exception as e:
+        # The run is already completed; a lost rollup must not fail it
+        logger.error(f"Recording metrics for run {run.run_id} failed: {e}")
+    await response_cache.invalidate(user.user_id)
+    if not RUN_EVENTS_CHANGE_STREAM:
+        run_events.publish(run.run_id, run_event_from_doc({
+            "run_id": run.run_id,
+            "status": "completed",
+            "invoices_processed": invoices_processed,
+            "emails_scanned": emails_scanned,
+            "attachments_downloaded": attachments_downloaded
+        }))
     
     return {
         "run_id": run.run_id,
@@ -532,6 +2271,12 @@ async def trigger_workflow(user: User = Depends(get_current_user)):
         "attachments_downloaded": attachments_downloaded
     }
 
+def extract_sheet_id(sheet_url: str) -> str:
+    """Extract sheet ID from URL if full URL provided"""
+    if "spreadsheets/d/" in sheet_url:
+        return sheet_url.split("spreadsheets/d/")[1].split("/")[0]
+    return sheet_url
+
 @api_router.get("/workflow/n8n-json")
 async def get_n8n_workflow_json(user: User = Depends(get_current_user)):
     """Generate n8n workflow JSON for export"""
@@ -543,303 +2288,43 @@ async def get_n8n_workflow_json(user: User = Depends(get_current_user)):
     sheet_url = settings.get("google_sheet_url", "YOUR_GOOGLE_SHEET_URL") if settings else "YOUR_GOOGLE_SHEET_URL"
     folder_id = settings.get("google_drive_folder_id", "YOUR_DRIVE_FOLDER_ID") if settings else "YOUR_DRIVE_FOLDER_ID"
     
-    # Extract sheet ID from URL if full URL provided
-    sheet_id = sheet_url
-    if "spreadsheets/d/" in sheet_url:
-        sheet_id = sheet_url.split("spreadsheets/d/")[1].split("/")[0]
+    sheet_id = extract_sheet_id(sheet_url)
     
-    n8n_workflow = {
-        "name": "Invoice Email Matching Workflow",
-        "nodes": [
-            {
-                "parameters": {},
-                "id": "trigger-1",
-                "name": "Manual Trigger",
-                "type": "n8n-nodes-base.manualTrigger",
-                "typeVersion": 1,
-                "position": [250, 300]
-            },
-            {
-                "parameters": {
-                    "operation": "read",
-                    "documentId": {
-                        "__rl": True,
-                        "value": sheet_id,
-                        "mode": "id"
-                    },
-                    "sheetName": {
-                        "__rl": True,
-                        "value": "gid=1919138850",
-                        "mode": "id"
-                    },
-                    "options": {
-                        "range": "A:D"
-                    }
-                },
-                "id": "sheets-1",
-                "name": "Read Google Sheet",
-                "type": "n8n-nodes-base.googleSheets",
-                "typeVersion": 4.5,
-                "position": [450, 300],
-                "credentials": {
-                    "googleSheetsOAuth2Api": {
-                        "id": "YOUR_CREDENTIAL_ID",
-                        "name": "Google Sheets OAuth2"
-                    }
-                },
-                "notes": "Sheet columns: A=S.No, B=Invoice No, C=Organization, D=status"
-            },
-            {
-                "parameters": {
-                    "conditions": {
-                        "options": {
-                            "caseSensitive": False,
-                            "leftValue": "",
-                            "typeValidation": "loose"
-                        },
-                        "conditions": [
-                            {
-                                "id": "condition-1",
-                                "leftValue": "={{ $json.status }}",
-                                "rightValue": "not updated",
-                                "operator": {
-                                    "type": "string",
-                                    "operation": "equals"
-                                }
-                            }
-                        ],
-                        "combinator": "and"
-                    },
-                    "options": {}
-                },
-                "id": "filter-1",
-                "name": "Filter Not Updated",
-                "type": "n8n-nodes-base.filter",
-                "typeVersion": 2,
-                "position": [650, 300],
-                "notes": "Filter rows where status column (D) = 'not updated'"
-            },
-            {
-                "parameters": {
-                    "resource": "message",
-                    "operation": "getAll",
-                    "returnAll": False,
-                    "limit": 100,
-                    "filters": {
-                        "q": "subject:(tax invoice OR invoice) has:attachment"
-                    },
-                    "options": {}
-                },
-                "id": "gmail-1",
-                "name": "Get Gmail Messages",
-                "type": "n8n-nodes-base.gmail",
-                "typeVersion": 2.1,
-                "position": [850, 300],
-                "credentials": {
-                    "gmailOAuth2": {
-                        "id": "YOUR_GMAIL_CREDENTIAL_ID",
-                        "name": "Gmail OAuth2"
-                    }
-                }
-            },
-            {
-                "parameters": {
-                    "jsCode": """// Extract invoice numbers from email subject and body
-// Sheet columns: A=S.No, B=Invoice No, C=Organization, D=status
-
-const invoicePatterns = [
-  /[A-Z]{2,4}[-/]?\\d{2,4}[-/]?\\d{2,6}/gi,
-  /INVOICE\\s*#?\\s*[A-Z0-9-]+/gi,
-  /TAX\\s*INVOICE\\s*#?\\s*[A-Z0-9-]+/gi
-];
-
-const emails = $input.all();
-const invoices = $('Filter Not Updated').all();
-
-const results = [];
-
-for (const email of emails) {
-  const subject = email.json.subject || '';
-  const snippet = email.json.snippet || '';
-  const body = email.json.body || '';
-  const text = (subject + ' ' + snippet + ' ' + body).toUpperCase();
-  
-  let extractedNumbers = [];
-  for (const pattern of invoicePatterns) {
-    const matches = text.match(pattern);
-    if (matches) {
-      extractedNumbers = extractedNumbers.concat(matches.map(m => m.trim()));
-    }
-  }
-  
-  // Find matching invoice from sheet (Column B = "Invoice No")
-  for (const inv of invoices) {
-    const invNumber = (inv.json['Invoice No'] || inv.json.invoice_number || inv.json.invoiceNumber || '').toString().toUpperCase();
-    
-    if (!invNumber) continue;
-    
-    const matched = extractedNumbers.some(extracted => {
-      const cleanExtracted = extracted.replace(/[-\\s/]/g, '');
-      const cleanInv = invNumber.replace(/[-\\s/]/g, '');
-      return cleanExtracted.includes(cleanInv) || cleanInv.includes(cleanExtracted) || extracted.includes(invNumber);
-    });
-    
-    if (matched) {
-      results.push({
-        emailId: email.json.id,
-        invoiceNumber: inv.json['Invoice No'] || invNumber,
-        rowNumber: inv.json['S.No'],
-        organization: inv.json['Organization'],
-        subject: subject,
-        hasMatch: true
-      });
-    }
-  }
-}
-
-return results.map(r => ({json: r}));"""
-                },
-                "id": "code-1",
-                "name": "Match Invoices",
-                "type": "n8n-nodes-base.code",
-                "typeVersion": 2,
-                "position": [1050, 300],
-                "notes": "Matches invoice numbers from emails with Column B (Invoice No) from sheet"
-            },
-            {
-                "parameters": {
-                    "resource": "message",
-                    "operation": "get",
-                    "messageId": "={{ $json.emailId }}",
-                    "options": {
-                        "attachmentPrefix": "attachment_"
-                    }
-                },
-                "id": "gmail-2",
-                "name": "Get Email Attachments",
-                "type": "n8n-nodes-base.gmail",
-                "typeVersion": 2.1,
-                "position": [1250, 300],
-                "credentials": {
-                    "gmailOAuth2": {
-                        "id": "YOUR_GMAIL_CREDENTIAL_ID",
-                        "name": "Gmail OAuth2"
-                    }
-                }
-            },
-            {
-                "parameters": {
-                    "operation": "upload",
-                    "folderId": folder_id,
-                    "name": "={{ $json.invoiceNumber }}_{{ $now.format('yyyy-MM-dd') }}.pdf",
-                    "options": {}
-                },
-                "id": "drive-1",
-                "name": "Upload to Google Drive",
-                "type": "n8n-nodes-base.googleDrive",
-                "typeVersion": 3,
-                "position": [1450, 300],
-                "credentials": {
-                    "googleDriveOAuth2Api": {
-                        "id": "YOUR_DRIVE_CREDENTIAL_ID",
-                        "name": "Google Drive OAuth2"
-                    }
-                }
-            },
-            {
-                "parameters": {
-                    "operation": "update",
-                    "documentId": {
-                        "__rl": True,
-                        "value": sheet_id,
-                        "mode": "id"
-                    },
-                    "sheetName": {
-                        "__rl": True,
-                        "value": "gid=1919138850",
-                        "mode": "id"
-                    },
-                    "columns": {
-                        "mappingMode": "defineBelow",
-                        "value": {
-                            "status": "downloaded"
-                        }
-                    },
-                    "options": {
-                        "cellFormat": "USER_ENTERED",
-                        "valueRenderOption": "UNFORMATTED_VALUE"
-                    }
-                },
-                "id": "sheets-2",
-                "name": "Update Sheet Status",
-                "type": "n8n-nodes-base.googleSheets",
-                "typeVersion": 4.5,
-                "position": [1650, 300],
-                "credentials": {
-                    "googleSheetsOAuth2Api": {
-                        "id": "YOUR_CREDENTIAL_ID",
-                        "name": "Google Sheets OAuth2"
-                    }
-                },
-                "notes": "Updates status column (D) from 'not updated' to 'downloaded'"
-            }
-        ],
-        "connections": {
-            "Manual Trigger": {
-                "main": [[{"node": "Read Google Sheet", "type": "main", "index": 0}]]
-            },
-            "Read Google Sheet": {
-                "main": [[{"node": "Filter Not Updated", "type": "main", "index": 0}]]
-            },
-            "Filter Not Updated": {
-                "main": [[{"node": "Get Gmail Messages", "type": "main", "index": 0}]]
-            },
-            "Get Gmail Messages": {
-                "main": [[{"node": "Match Invoices", "type": "main", "index": 0}]]
-            },
-            "Match Invoices": {
-                "main": [[{"node": "Get Email Attachments", "type": "main", "index": 0}]]
-            },
-            "Get Email Attachments": {
-                "main": [[{"node": "Upload to Google Drive", "type": "main", "index": 0}]]
-            },
-            "Upload to Google Drive": {
-                "main": [[{"node": "Update Sheet Status", "type": "main", "index": 0}]]
-            }
-        },
-        "settings": {
-            "executionOrder": "v1"
-        },
-        "staticData": None,
-        "meta": {
-            "instanceId": "generated-workflow"
-        },
-        "tags": ["invoice", "automation", "email"]
-    }
+    from subsystems.n8n_export import render_n8n_workflow
     
-    return n8n_workflow
+    return Response(
+        content=render_n8n_workflow(sheet_id, folder_id),
+        media_type="application/json"
+    )
 
 # =============================================================================
 # DASHBOARD STATS
 # =============================================================================
 
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats(user: User = Depends(get_current_user)):
+async def get_dashboard_stats(request: Request, user: User = Depends(get_current_user)):
     """Get dashboard overview statistics"""
+    return await cached_json_response(
+        request, user.user_id, "dashboard/stats", lambda: compute_dashboard_stats(user)
+    )
+
+async def compute_dashboard_stats(user: User) -> Dict[str, Any]:
     invoice_stats = await get_invoice_stats(user)
     
     recent_runs = await db.workflow_runs.find(
         {"user_id": user.user_id},
-        {"_id": 0}
+        list_projection("workflow_runs")
     ).sort("started_at", -1).to_list(5)
     
     recent_attachments = await db.attachments.find(
         {"user_id": user.user_id},
-        {"_id": 0}
+        list_projection("attachments")
     ).sort("downloaded_at", -1).to_list(5)
     
     total_runs = await db.workflow_runs.count_documents({"user_id": user.user_id})
     total_attachments = await db.attachments.count_documents({"user_id": user.user_id})
+    archived = (await archived_counts([user.user_id])).get(user.user_id, {})
+    total_runs += archived.get("workflow_runs_archived", 0)
     
     return {
         "invoice_stats": invoice_stats,
@@ -849,6 +2334,81 @@ async def get_dashboard_stats(user: User = Depends(get_current_user)):
         "total_attachments": total_attachments
     }
 
+# =============================================================================
+# ADMIN DASHBOARD
+# =============================================================================
+
+ADMIN_DASHBOARD_MAX_PAGE = 500
+
+
+@api_router.get("/admin/dashboard/stats")
+async def get_admin_dashboard_stats(
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    user_ids: Optional[str] = None,
+    admin: User = Depends(require_admin)
+):
+    """Dashboard stats for a page of users, ordered by user_id"""
+    if not 0 < limit <= ADMIN_DASHBOARD_MAX_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit must be 1-{ADMIN_DASHBOARD_MAX_PAGE}")
+    
+    query: Dict[str, Any] = {}
+    if user_ids:
+        query["user_id"] = {"$in": [u.strip() for u in user_ids.split(",") if u.strip()]}
+    if cursor:
+        query.setdefault("user_id", {})["$gt"] = cursor
+    users = await db.users.find(
+        query,
+        {"_id": 0, "user_id": 1, "email": 1, "name": 1}
+    ).sort("user_id", 1).to_list(limit)
+    page_ids = [u["user_id"] for u in users]
+    if not page_ids:
+        return {"items": [], "next_cursor": None}
+    
+    invoice_stats, run_stats, attachment_stats, archived = await asyncio.gather(
+        aggregate_invoice_stats(page_ids),
+        db.workflow_runs.aggregate([
+            {"$match": {"user_id": {"$in": page_ids}}},
+            {"$group": {
+                "_id": "$user_id",
+                "total_runs": {"$sum": 1},
+                "last_run_at": {"$max": "$started_at"},
+                "failed_runs": {"$sum": {"$cond": [{"$eq": ["$status", "failed"]}, 1, 0]}}
+            }}
+        ]).to_list(None),
+        db.attachments.aggregate([
+            {"$match": {"user_id": {"$in": page_ids}}},
+            {"$group": {
+                "_id": "$user_id",
+                "total_attachments": {"$sum": 1},
+                "last_downloaded_at": {"$max": "$downloaded_at"}
+            }}
+        ]).to_list(None),
+        archived_counts(page_ids)
+    )
+    runs_by_user = {row.pop("_id"): row for row in run_stats}
+    attachments_by_user = {row.pop("_id"): row for row in attachment_stats}
+    
+    items = []
+    for u in users:
+        runs = runs_by_user.get(u["user_id"], {})
+        attachments = attachments_by_user.get(u["user_id"], {})
+        items.append({
+            **u,
+            "invoice_stats": invoice_stats[u["user_id"]],
+            "total_runs": runs.get("total_runs", 0)
+                + archived.get(u["user_id"], {}).get("workflow_runs_archived", 0),
+            "failed_runs": runs.get("failed_runs", 0),
+            "last_run_at": runs.get("last_run_at"),
+            "total_attachments": attachments.get("total_attachments", 0),
+            "last_downloaded_at": attachments.get("last_downloaded_at"),
+        })
+    
+    return {
+        "items": items,
+        "next_cursor": page_ids[-1] if len(users) == limit else None
+    }
+
 # =============================================================================
 # HEALTH CHECK
 # =============================================================================
@@ -859,11 +2419,85 @@ async def root():
 
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "workflow_queue": workflow_limiter.stats(),
+        "google_api_waiting": google_api_limiter.stats()
+    }
+
+# =============================================================================
+# STARTUP / SHUTDOWN
+# =============================================================================
+
+async def warm_mongo_pool():
+    """Open the minimum pool of connections before serving traffic"""
+    await client.admin.command("ping")
+    # Concurrent commands force the pool to open that many sockets
+    await asyncio.gather(*(db.command("ping") for _ in range(MONGO_MIN_POOL_SIZE)))
+
+
+def warm_caches(app: FastAPI):
+    """Build lazily-initialised state the first requests would otherwise pay for"""
+    from subsystems.n8n_export import n8n_workflow_template
+    
+    app.openapi()
+    n8n_workflow_template()
+    extract_invoice_numbers("INVOICE INV-2024-001")
+    InvoiceMatcher(["INV-2024-001"]).match(["INV2024001"])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = datetime.now(timezone.utc)
+    try:
+        await warm_mongo_pool()
+        await ensure_indexes()
+        await backfill_search_fields()
+    except Exception as e:
+        logger.error(f"Startup database warmup failed: {e}")
+    warm_caches(app)
+    
+    tasks = []
+    if RUN_EVENTS_CHANGE_STREAM:
+        tasks.append(asyncio.create_task(watch_workflow_runs()))
+    if SESSION_SIGNING_KEYS:
+        tasks.append(asyncio.create_task(refresh_revocations_periodically()))
+    if RETENTION_INTERVAL_SECONDS > 0:
+        from subsystems.retention import apply_retention_periodically
+        tasks.append(asyncio.create_task(apply_retention_periodically()))
+    if SHEET_SYNC_ENABLED:
+        from subsystems.sheet_sync import run_sheet_sync
+        tasks.append(asyncio.create_task(run_sheet_sync()))
+    if GMAIL_PUSH_AUDIENCE:
+        from subsystems.push_ingest import resume_pending_batches
+        await resume_pending_batches()
+    logger.info(f"Startup warmup finished in {(datetime.now(timezone.utc) - started).total_seconds():.2f}s")
+    
+    yield
+    
+    for task in tasks:
+        task.cancel()
+    # Let them finish their cleanup, such as handing back leases, before the client closes
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if "subsystems.push_ingest" in sys.modules:
+        await sys.modules["subsystems.push_ingest"].shutdown_push_windows()
+    # Cancelled runs are marked failed, so they need the client still open
+    await workflow_limiter.shutdown()
+    if "subsystems.pdf_inspection" in sys.modules:
+        sys.modules["subsystems.pdf_inspection"].shutdown_pdf_pool()
+    client.close()
+
+
+# Create the main app
+app = FastAPI(lifespan=lifespan)
 
 # Include router and configure app
 app.include_router(api_router)
 
+if PROFILING_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -871,7 +2505,3 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1 @@
+"""Optional backend subsystems, imported lazily by server.py on first use"""
@@ -0,0 +1,84 @@
+"""Time-bucketed run metrics
+
+Per-user hourly and daily buckets, upserted with $inc as each run completes.
+A plain collection rather than a time-series one: time-series collections
+cannot be incrementally updated in place.
+"""
+import asyncio
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+from server import db
+
+METRICS_GRANULARITIES = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+METRICS_MAX_BUCKETS = 2000
+METRICS_COUNTERS = ("runs", "emails_scanned", "attachments_downloaded", "matches", "duration_ms")
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    ts = ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def record_run_metrics(user_id: str, started_at: datetime, completed_at: datetime, counters: Dict[str, int]):
+    """Add a completed run to the user's hourly and daily rollups"""
+    duration_ms = int((completed_at - started_at).total_seconds() * 1000)
+    increments = {"runs": 1, "duration_ms": duration_ms, **counters}
+    await asyncio.gather(*(
+        db.metrics_rollups.update_one(
+            {
+                "user_id": user_id,
+                "granularity": granularity,
+                "bucket_start": bucket_start(completed_at, granularity)
+            },
+            {"$inc": increments, "$max": {"max_duration_ms": duration_ms}},
+            upsert=True
+        )
+        for granularity in METRICS_GRANULARITIES
+    ))
+
+
+
+async def metrics_history(
+    user_id: str,
+    granularity: str,
+    start: Optional[datetime],
+    end: Optional[datetime]
+) -> Dict[str, Any]:
+    """Build a dense time series of run metrics from the rollups"""
+    step = METRICS_GRANULARITIES.get(granularity)
+    if step is None:
+        raise HTTPException(status_code=400, detail=f"Unknown granularity: {granularity}")
+    end = bucket_start(end or datetime.now(timezone.utc), granularity)
+    start = bucket_start(start or end - step * 29, granularity)
+    if start > end or (end - start) / step >= METRICS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail="Invalid or too large time range")
+    
+    rows = await db.metrics_rollups.find(
+        {
+            "user_id": user_id,
+            "granularity": granularity,
+            "bucket_start": {"$gte": start, "$lte": end}
+        },
+        {"_id": 0, "user_id": 0, "granularity": 0}
+    ).to_list(METRICS_MAX_BUCKETS)
+    by_bucket = {row["bucket_start"].replace(tzinfo=timezone.utc): row for row in rows}
+    
+    buckets = []
+    ts = start
+    while ts <= end:
+        row = by_bucket.get(ts, {})
+        buckets.append({
+            "bucket_start": ts.isoformat(),
+            **{counter: row.get(counter, 0) for counter in METRICS_COUNTERS},
+            "max_duration_ms": row.get("max_duration_ms", 0),
+        })
+        ts += step
+    return {"granularity": granularity, "buckets": buckets}
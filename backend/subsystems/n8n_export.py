@@ -0,0 +1,291 @@
+"""n8n workflow export, built once and rendered per user by id substitution"""
+import functools
+import json
+from typing import Any, Dict
+
+N8N_SHEET_PLACEHOLDER = "__N8N_SHEET_ID__"
+N8N_FOLDER_PLACEHOLDER = "__N8N_FOLDER_ID__"
+
+@functools.lru_cache(maxsize=1)
+def n8n_workflow_template() -> str:
+    """Serialized n8n workflow with placeholder sheet and folder ids"""
+    return json.dumps(build_n8n_workflow(N8N_SHEET_PLACEHOLDER, N8N_FOLDER_PLACEHOLDER))
+
+def render_n8n_workflow(sheet_id: str, folder_id: str) -> str:
+    return (
+        n8n_workflow_template()
+        .replace(json.dumps(N8N_SHEET_PLACEHOLDER), json.dumps(sheet_id))
+        .replace(json.dumps(N8N_FOLDER_PLACEHOLDER), json.dumps(folder_id))
+    )
+
+def build_n8n_workflow(sheet_id: str, folder_id: str) -> Dict[str, Any]:
+    n8n_workflow = {
+        "name": "Invoice Email Matching Workflow",
+        "nodes": [
+            {
+                "parameters": {},
+                "id": "trigger-1",
+                "name": "Manual Trigger",
+                "type": "n8n-nodes-base.manualTrigger",
+                "typeVersion": 1,
+                "position": [250, 300]
+            },
+            {
+                "parameters": {
+                    "operation": "read",
+                    "documentId": {
+                        "__rl": True,
+                        "value": sheet_id,
+                        "mode": "id"
+                    },
+                    "sheetName": {
+                        "__rl": True,
+                        "value": "gid=1919138850",
+                        "mode": "id"
+                    },
+                    "options": {
+                        "range": "A:D"
+                    }
+                },
+                "id": "sheets-1",
+                "name": "Read Google Sheet",
+                "type": "n8n-nodes-base.googleSheets",
+                "typeVersion": 4.5,
+                "position": [450, 300],
+                "credentials": {
+                    "googleSheetsOAuth2Api": {
+                        "id": "YOUR_CREDENTIAL_ID",
+                        "name": "Google Sheets OAuth2"
+                    }
+                },
+                "notes": "Sheet columns: A=S.No, B=Invoice No, C=Organization, D=status"
+            },
+            {
+                "parameters": {
+                    "conditions": {
+                        "options": {
+                            "caseSensitive": False,
+                            "leftValue": "",
+                            "typeValidation": "loose"
+                        },
+                        "conditions": [
+                            {
+                                "id": "condition-1",
+                                "leftValue": "={{ $json.status }}",
+                                "rightValue": "not updated",
+                                "operator": {
+                                    "type": "string",
+                                    "operation": "equals"
+                                }
+                            }
+                        ],
+                        "combinator": "and"
+                    },
+                    "options": {}
+                },
+                "id": "filter-1",
+                "name": "Filter Not Updated",
+                "type": "n8n-nodes-base.filter",
+                "typeVersion": 2,
+                "position": [650, 300],
+                "notes": "Filter rows where status column (D) = 'not updated'"
+            },
+            {
+                "parameters": {
+                    "resource": "message",
+                    "operation": "getAll",
+                    "returnAll": False,
+                    "limit": 100,
+                    "filters": {
+                        "q": "subject:(tax invoice OR invoice) has:attachment"
+                    },
+                    "options": {}
+                },
+                "id": "gmail-1",
+                "name": "Get Gmail Messages",
+                "type": "n8n-nodes-base.gmail",
+                "typeVersion": 2.1,
+                "position": [850, 300],
+                "credentials": {
+                    "gmailOAuth2": {
+                        "id": "YOUR_GMAIL_CREDENTIAL_ID",
+                        "name": "Gmail OAuth2"
+                    }
+                }
+            },
+            {
+                "parameters": {
+                    "jsCode": """// Extract invoice numbers from email subject and body
+// Sheet columns: A=S.No, B=Invoice No, C=Organization, D=status
+
+const invoicePatterns = [
+  /[A-Z]{2,4}[-/]?\\d{2,4}[-/]?\\d{2,6}/gi,
+  /INVOICE\\s*#?\\s*[A-Z0-9-]+/gi,
+  /TAX\\s*INVOICE\\s*#?\\s*[A-Z0-9-]+/gi
+];
+
+const emails = $input.all();
+const invoices = $('Filter Not Updated').all();
+
+const results = [];
+
+for (const email of emails) {
+  const subject = email.json.subject || '';
+  const snippet = email.json.snippet || '';
+  const body = email.json.body || '';
+  const text = (subject + ' ' + snippet + ' ' + body).toUpperCase();
+  
+  let extractedNumbers = [];
+  for (const pattern of invoicePatterns) {
+    const matches = text.match(pattern);
+    if (matches) {
+      extractedNumbers = extractedNumbers.concat(matches.map(m => m.trim()));
+    }
+  }
+  
+  // Find matching invoice from sheet (Column B = "Invoice No")
+  for (const inv of invoices) {
+    const invNumber = (inv.json['Invoice No'] || inv.json.invoice_number || inv.json.invoiceNumber || '').toString().toUpperCase();
+    
+    if (!invNumber) continue;
+    
+    const matched = extractedNumbers.some(extracted => {
+      const cleanExtracted = extracted.replace(/[-\\s/]/g, '');
+      const cleanInv = invNumber.replace(/[-\\s/]/g, '');
+      return cleanExtracted.includes(cleanInv) || cleanInv.includes(cleanExtracted) || extracted.includes(invNumber);
+    });
+    
+    if (matched) {
+      results.push({
+        emailId: email.json.id,
+        invoiceNumber: inv.json['Invoice No'] || invNumber,
+        rowNumber: inv.json['S.No'],
+        organization: inv.json['Organization'],
+        subject: subject,
+        hasMatch: true
+      });
+    }
+  }
+}
+
+return results.map(r => ({json: r}));"""
+                },
+                "id": "code-1",
+                "name": "Match Invoices",
+                "type": "n8n-nodes-base.code",
+                "typeVersion": 2,
+                "position": [1050, 300],
+                "notes": "Matches invoice numbers from emails with Column B (Invoice No) from sheet"
+            },
+            {
+                "parameters": {
+                    "resource": "message",
+                    "operation": "get",
+                    "messageId": "={{ $json.emailId }}",
+                    "options": {
+                        "attachmentPrefix": "attachment_"
+                    }
+                },
+                "id": "gmail-2",
+                "name": "Get Email Attachments",
+                "type": "n8n-nodes-base.gmail",
+                "typeVersion": 2.1,
+                "position": [1250, 300],
+                "credentials": {
+                    "gmailOAuth2": {
+                        "id": "YOUR_GMAIL_CREDENTIAL_ID",
+                        "name": "Gmail OAuth2"
+                    }
+                }
+            },
+            {
+                "parameters": {
+                    "operation": "upload",
+                    "folderId": folder_id,
+                    "name": "={{ $json.invoiceNumber }}_{{ $now.format('yyyy-MM-dd') }}.pdf",
+                    "options": {}
+                },
+                "id": "drive-1",
+                "name": "Upload to Google Drive",
+                "type": "n8n-nodes-base.googleDrive",
+                "typeVersion": 3,
+                "position": [1450, 300],
+                "credentials": {
+                    "googleDriveOAuth2Api": {
+                        "id": "YOUR_DRIVE_CREDENTIAL_ID",
+                        "name": "Google Drive OAuth2"
+                    }
+                }
+            },
+            {
+                "parameters": {
+                    "operation": "update",
+                    "documentId": {
+                        "__rl": True,
+                        "value": sheet_id,
+                        "mode": "id"
+                    },
+                    "sheetName": {
+                        "__rl": True,
+                        "value": "gid=1919138850",
+                        "mode": "id"
+                    },
+                    "columns": {
+                        "mappingMode": "defineBelow",
+                        "value": {
+                            "status": "downloaded"
+                        }
+                    },
+                    "options": {
+                        "cellFormat": "USER_ENTERED",
+                        "valueRenderOption": "UNFORMATTED_VALUE"
+                    }
+                },
+                "id": "sheets-2",
+                "name": "Update Sheet Status",
+                "type": "n8n-nodes-base.googleSheets",
+                "typeVersion": 4.5,
+                "position": [1650, 300],
+                "credentials": {
+                    "googleSheetsOAuth2Api": {
+                        "id": "YOUR_CREDENTIAL_ID",
+                        "name": "Google Sheets OAuth2"
+                    }
+                },
+                "notes": "Updates status column (D) from 'not updated' to 'downloaded'"
+            }
+        ],
+        "connections": {
+            "Manual Trigger": {
+                "main": [[{"node": "Read Google Sheet", "type": "main", "index": 0}]]
+            },
+            "Read Google Sheet": {
+                "main": [[{"node": "Filter Not Updated", "type": "main", "index": 0}]]
+            },
+            "Filter Not Updated": {
+                "main": [[{"node": "Get Gmail Messages", "type": "main", "index": 0}]]
+            },
+            "Get Gmail Messages": {
+                "main": [[{"node": "Match Invoices", "type": "main", "index": 0}]]
+            },
+            "Match Invoices": {
+                "main": [[{"node": "Get Email Attachments", "type": "main", "index": 0}]]
+            },
+            "Get Email Attachments": {
+                "main": [[{"node": "Upload to Google Drive", "type": "main", "index": 0}]]
+            },
+            "Upload to Google Drive": {
+                "main": [[{"node": "Update Sheet Status", "type": "main", "index": 0}]]
+            }
+        },
+        "settings": {
+            "executionOrder": "v1"
+        },
+        "staticData": None,
+        "meta": {
+            "instanceId": "generated-workflow"
+        },
+        "tags": ["invoice", "automation", "email"]
+    }
+    
+    return n8n_workflow
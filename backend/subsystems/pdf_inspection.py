@@ -0,0 +1,119 @@
+"""Attachment inspection: confirm matches from the text of PDF attachments
+
+Parses the first pages of PDF attachments in a process pool and checks the
+matched invoice number appears in the document. Results are cached by
+content hash and concurrent inspections of the same file share one parse,
+so a file is parsed at most once. At most one parse per pool worker is in
+flight, so the timeout measures parsing rather than queueing; a parse that
+times out takes its pool down with it, because the worker process would
+otherwise keep running it.
+"""
+import asyncio
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from server import db, logger, extract_invoice_numbers, InvoiceMatcher
+
+PDF_INSPECTION_MAX_PAGES = int(os.environ.get('PDF_INSPECTION_MAX_PAGES', '2'))
+PDF_INSPECTION_TIMEOUT_SECONDS = float(os.environ.get('PDF_INSPECTION_TIMEOUT_SECONDS', '10'))
+PDF_INSPECTION_WORKERS = int(os.environ.get('PDF_INSPECTION_WORKERS', '2'))
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_slots = asyncio.Semaphore(PDF_INSPECTION_WORKERS)
+# content_hash -> parse in flight, so a file sent twice in a batch is parsed once
+_parses: Dict[str, asyncio.Future] = {}
+
+
+def extract_pdf_text(content: bytes, max_pages: int) -> str:
+    """Extract text from the first pages of a PDF (runs in a worker process)"""
+    from pypdf import PdfReader
+    
+    reader = PdfReader(io.BytesIO(content))
+    return "\n".join(page.extract_text() or "" for page in reader.pages[:max_pages])
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_INSPECTION_WORKERS)
+    return _pdf_pool
+
+
+def recycle_pdf_pool(pool: ProcessPoolExecutor):
+    """Replace a pool whose worker is stuck on a timed-out parse"""
+    global _pdf_pool
+    if _pdf_pool is not pool:
+        # Another timeout already replaced it
+        return
+    _pdf_pool = None
+    # shutdown() does not stop running tasks, so end the workers directly;
+    # other parses on this pool fail and are reported as unconfirmed
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def parse_pdf_invoice_numbers(content: bytes, content_hash: str) -> Optional[List[str]]:
+    """Invoice numbers in a PDF from the cache or a parse; None if parsing failed"""
+    cached = await db.pdf_text_cache.find_one({"content_hash": content_hash}, {"_id": 0})
+    if cached:
+        return cached["invoice_numbers"]
+    loop = asyncio.get_running_loop()
+    try:
+        async with _pdf_slots:
+            pool = get_pdf_pool()
+            try:
+                text = await asyncio.wait_for(
+                    loop.run_in_executor(pool, extract_pdf_text, content, PDF_INSPECTION_MAX_PAGES),
+                    timeout=PDF_INSPECTION_TIMEOUT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                recycle_pdf_pool(pool)
+                raise
+    except Exception as e:
+        logger.warning(f"PDF inspection failed for {content_hash[:12]}: {e!r}")
+        return None
+    numbers = extract_invoice_numbers(text)
+    await db.pdf_text_cache.update_one(
+        {"content_hash": content_hash},
+        {"$setOnInsert": {
+            "content_hash": content_hash,
+            "invoice_numbers": numbers,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
+    )
+    return numbers
+
+
+async def pdf_invoice_numbers(content: bytes, content_hash: str) -> Optional[List[str]]:
+    """Single-flight wrapper: concurrent inspections of one file share a parse"""
+    pending = _parses.get(content_hash)
+    if pending is None:
+        pending = asyncio.ensure_future(parse_pdf_invoice_numbers(content, content_hash))
+        _parses[content_hash] = pending
+        pending.add_done_callback(lambda _: _parses.pop(content_hash, None))
+    # Shielded so one cancelled caller does not cancel the others' parse
+    return await asyncio.shield(pending)
+
+
+async def inspect_attachment(content: bytes, invoice_number: str) -> Dict[str, Any]:
+    """Confirm a matched invoice number against the attachment's PDF text"""
+    content_hash = hashlib.sha256(content).hexdigest()
+    numbers = await pdf_invoice_numbers(content, content_hash)
+    if numbers is None:
+        return {"content_hash": content_hash, "content_invoice_numbers": [], "content_confirmed": None}
+    return {
+        "content_hash": content_hash,
+        "content_invoice_numbers": numbers,
+        "content_confirmed": InvoiceMatcher([invoice_number]).match_exact(numbers) is not None,
+    }
+
+
+def shutdown_pdf_pool():
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,145 @@
+"""On-demand profiling of API requests and workflow runs
+
+A profile samples only the profiled task's async context with pyinstrument,
+so other tenants' work shows up as time spent awaiting rather than as frames
+of its own. Each profile is stored compressed in the profiles collection
+together with a breakdown of what the task was waiting on.
+"""
+import contextvars
+import json
+import os
+import uuid
+import zlib
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from server import db, logger
+
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', '0.001'))
+APP_DIR = str(Path(__file__).resolve().parents[1])
+# (path fragment, function or None) -> what an await inside that frame waits on
+WAIT_CATEGORIES = [
+    ("/motor/", None, "mongo"),
+    ("/pymongo/", None, "mongo"),
+    ("/httpx/", None, "http"),
+    ("/httpcore/", None, "http"),
+    ("/asyncio/", "sleep", "sleep"),
+    ("/asyncio/locks.py", None, "lock"),
+    ("/asyncio/queues.py", None, "queue"),
+    ("/concurrent/futures/", None, "executor"),
+]
+
+_active_profile: contextvars.ContextVar = contextvars.ContextVar("active_profile", default=None)
+
+
+class ProfileHandle:
+    def __init__(self, kind: str, label: str, user_id: Optional[str], run_id: Optional[str]):
+        self.profile_id = f"prof_{uuid.uuid4().hex[:12]}"
+        self.kind = kind
+        self.label = label
+        self.user_id = user_id
+        self.run_id = run_id
+
+    @property
+    def url(self) -> str:
+        return f"/api/profiles/{self.profile_id}"
+
+
+@asynccontextmanager
+async def profiled(kind: str, label: str, user_id: Optional[str] = None, run_id: Optional[str] = None):
+    """Profile the enclosed block in the current task and store the result"""
+    active = _active_profile.get()
+    if active is not None:
+        # Nested inside a profiled request: the outer profile covers this block
+        active.user_id = active.user_id or user_id
+        active.run_id = active.run_id or run_id
+        yield active
+        return
+
+    from pyinstrument import Profiler
+
+    handle = ProfileHandle(kind, label, user_id, run_id)
+    profiler = Profiler(interval=PROFILE_INTERVAL_SECONDS, async_mode="enabled")
+    token = _active_profile.set(handle)
+    started_at = datetime.now(timezone.utc)
+    profiler.start()
+    try:
+        yield handle
+    finally:
+        profiler.stop()
+        _active_profile.reset(token)
+        try:
+            await store_profile(handle, profiler.last_session, started_at)
+        except Exception as e:
+            logger.error(f"Storing profile {handle.profile_id} failed: {e}")
+
+
+def wait_category(stack: List[Any]) -> str:
+    for frame in reversed(stack):
+        path = (frame.file_path or "").replace("\\", "/")
+        for fragment, function, category in WAIT_CATEGORIES:
+            if fragment in path and function in (None, frame.function):
+                return category
+    return "other"
+
+
+def app_function(stack: List[Any]) -> str:
+    for frame in reversed(stack):
+        if (frame.file_path or "").startswith(APP_DIR) and "site-packages" not in frame.file_path:
+            return frame.function
+    return "-"
+
+
+def wait_breakdown(root) -> Tuple[float, List[Dict[str, Any]]]:
+    """Total await time and its split by app function and what it waited on"""
+    from pyinstrument.frame import AWAIT_FRAME_IDENTIFIER
+
+    totals: Dict[Tuple[str, str], float] = {}
+    pending = [(root, [])]
+    while pending:
+        frame, stack = pending.pop()
+        if frame.identifier == AWAIT_FRAME_IDENTIFIER:
+            key = (app_function(stack), wait_category(stack))
+            totals[key] = totals.get(key, 0.0) + frame.time
+            continue
+        stack = stack + [frame] if not frame.is_synthetic else stack
+        pending.extend((child, stack) for child in frame.children)
+    waits = [
+        {"awaited_in": function, "waiting_on": category, "ms": round(seconds * 1000, 2)}
+        for (function, category), seconds in sorted(totals.items(), key=lambda item: -item[1])
+    ]
+    return sum(totals.values()), waits
+
+
+async def store_profile(handle: ProfileHandle, session, started_at: datetime):
+    root = session.root_frame()
+    await_seconds, waits = wait_breakdown(root) if root else (0.0, [])
+    await db.profiles.insert_one({
+        "profile_id": handle.profile_id,
+        "kind": handle.kind,
+        "label": handle.label,
+        "user_id": handle.user_id,
+        "run_id": handle.run_id,
+        # A datetime, not a string, so the TTL index can expire it
+        "created_at": started_at,
+        "duration_ms": round(session.duration * 1000, 2),
+        "cpu_ms": round(session.cpu_time * 1000, 2),
+        "await_ms": round(await_seconds * 1000, 2),
+        "sample_count": session.sample_count,
+        "waits": waits,
+        "session": zlib.compress(json.dumps(session.to_json()).encode()),
+    })
+
+
+PROFILE_FORMATS = {"html": "text/html", "speedscope": "application/json"}
+
+
+def render_profile(doc: Dict[str, Any], fmt: str) -> str:
+    from pyinstrument.renderers import HTMLRenderer, SpeedscopeRenderer
+    from pyinstrument.session import Session
+
+    session = Session.from_json(json.loads(zlib.decompress(doc["session"])))
+    renderer = SpeedscopeRenderer() if fmt == "speedscope" else HTMLRenderer()
+    return renderer.render(session)
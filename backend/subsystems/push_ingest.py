@@ -0,0 +1,253 @@
+"""Push ingestion: process new Gmail messages within seconds of arrival
+
+The push endpoint stores message ids per user in push_pending before it
+acknowledges the notification and advances the user's Gmail history
+cursor, so a failed listing is redelivered and a restart loses nothing.
+The first id for a user opens a PUSH_COALESCE_SECONDS window; everything
+pending when it closes is processed as one micro-batch run of the regular
+workflow over just those messages, with no sheet read and no full rescan.
+Micro-batch runs take the user's workflow lease and a workflow_limiter
+slot like manual runs; while another run holds the lease the ids stay
+pending and the window is reopened.
+"""
+import asyncio
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+from server import (
+    db, logger, google_api_limiter, response_cache, acquire_lease, release_lease, run_workflow,
+    workflow_lease, workflow_limiter, GMAIL_QUOTA_UNITS, WORKER_ID, WORKFLOW_RUN_LEASE, User, WorkflowRun,
+)
+
+PUSH_COALESCE_SECONDS = float(os.environ.get('PUSH_COALESCE_SECONDS', '3'))
+# Held while a worker drains a user's pending ids, so workers do not overlap
+PUSH_BATCH_LEASE = timedelta(minutes=5)
+GMAIL_API = "https://gmail.googleapis.com/gmail/v1/users/me"
+
+_windows: Dict[str, asyncio.Task] = {}
+# Every window task, including those past their sleep and draining
+_window_tasks: set = set()
+
+
+async def enqueue_messages(user_id: str, message_ids: List[str]):
+    """Store message ids as pending and open the user's coalescing window"""
+    await db.push_pending.update_one(
+        {"user_id": user_id},
+        {
+            "$addToSet": {"message_ids": {"$each": message_ids}},
+            "$setOnInsert": {"first_at": datetime.now(timezone.utc)}
+        },
+        upsert=True
+    )
+    open_window(user_id)
+
+
+def open_window(user_id: str):
+    if user_id not in _windows:
+        task = asyncio.create_task(_close_window(user_id))
+        _windows[user_id] = task
+        _window_tasks.add(task)
+        task.add_done_callback(_window_tasks.discard)
+
+
+async def shutdown_push_windows():
+    """Cancel open windows and drains; their ids stay pending for the next start"""
+    for task in _window_tasks:
+        task.cancel()
+    await asyncio.gather(*_window_tasks, return_exceptions=True)
+    # A window cancelled before it first ran never removed itself
+    _windows.clear()
+
+
+async def _close_window(user_id: str):
+    try:
+        await asyncio.sleep(PUSH_COALESCE_SECONDS)
+    finally:
+        # Ids arriving after this point open a new window
+        del _windows[user_id]
+    lease = f"push_batch:{user_id}"
+    if not await acquire_lease(lease, WORKER_ID, PUSH_BATCH_LEASE):
+        # The worker holding it picks up our ids before it lets go
+        return
+    drained = True
+    try:
+        drained = await drain_pending(user_id)
+    except Exception as e:
+        logger.error(f"Push micro-batch failed for {user_id}: {e}")
+    finally:
+        await release_lease(lease, WORKER_ID)
+    if not drained:
+        # Another run holds the user's workflow lease; try again after it
+        open_window(user_id)
+
+
+async def drain_pending(user_id: str) -> bool:
+    """Process the user's pending ids until none are left
+    
+    Returns False if it stopped because another run holds the user's
+    workflow lease, leaving the remaining ids pending.
+    """
+    while True:
+        state = await db.push_pending.find_one({"user_id": user_id}, {"_id": 0, "message_ids": 1})
+        message_ids = (state or {}).get("message_ids", [])
+        if not message_ids:
+            await db.push_pending.delete_one({"user_id": user_id, "message_ids": {"$size": 0}})
+            return True
+        if await process_micro_batch(user_id, sorted(message_ids)) is None:
+            return False
+        # Only once the batch is persisted; a crash before this retries it
+        await db.push_pending.update_one(
+            {"user_id": user_id}, {"$pull": {"message_ids": {"$in": message_ids}}}
+        )
+
+
+async def resume_pending_batches():
+    """Reopen windows for ids left pending by a stopped worker"""
+    try:
+        user_ids = await db.push_pending.distinct("user_id", {"message_ids.0": {"$exists": True}})
+    except Exception as e:
+        logger.error(f"Could not resume pending push batches: {e}")
+        return
+    for user_id in user_ids:
+        open_window(user_id)
+
+
+async def gmail_token(user_id: str) -> Optional[str]:
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "google_access_token": 1})
+    return (user or {}).get("google_access_token")
+
+
+async def list_new_message_ids(user_id: str, history_id: str) -> List[str]:
+    """Resolve a Gmail historyId notification into newly added message ids
+    
+    Does not move the user's cursor; call advance_history_cursor once the
+    ids are stored. Raises if Gmail fails, so the notification is redelivered.
+    """
+    import httpx
+
+    state = await db.gmail_sync_state.find_one({"user_id": user_id}, {"_id": 0})
+    if not state:
+        # First notification only records where to start from
+        return []
+    token = await gmail_token(user_id)
+    if not token:
+        raise RuntimeError(f"No Google access token for {user_id}")
+    message_ids: List[str] = []
+    params = {"startHistoryId": state["history_id"], "historyTypes": "messageAdded"}
+    async with httpx.AsyncClient(timeout=30) as client_http:
+        while True:
+            await google_api_limiter.acquire(user_id, "gmail", units=GMAIL_QUOTA_UNITS["history.list"])
+            resp = await client_http.get(
+                f"{GMAIL_API}/history", headers={"Authorization": f"Bearer {token}"}, params=params
+            )
+            if resp.status_code == 404:
+                # The cursor is older than Gmail keeps history; the next full run catches up
+                logger.warning(f"Gmail history for {user_id} expired; restarting from {history_id}")
+                return message_ids
+            resp.raise_for_status()
+            data = resp.json()
+            message_ids.extend(
+                added["message"]["id"]
+                for record in data.get("history", [])
+                for added in record.get("messagesAdded", [])
+            )
+            if not data.get("nextPageToken"):
+                return message_ids
+            params["pageToken"] = data["nextPageToken"]
+
+
+async def advance_history_cursor(user_id: str, history_id: str):
+    await db.gmail_sync_state.update_one(
+        {"user_id": user_id}, {"$max": {"history_id": int(history_id)}}, upsert=True
+    )
+
+
+async def fetch_messages(user_id: str, message_ids: List[str], usage: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Fetch messages in the workflow data source's email shape
+    
+    The body is Gmail's snippet; attachments carry only their filename.
+    """
+    import httpx
+
+    token = await gmail_token(user_id)
+    if not token:
+        raise RuntimeError(f"No Google access token for {user_id}")
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"format": "full", "fields": "id,snippet,payload(headers,parts(filename))"}
+
+    async def get_message(client_http, message_id):
+        await google_api_limiter.acquire(user_id, "gmail", units=GMAIL_QUOTA_UNITS["messages.get"], usage=usage)
+        return await client_http.get(f"{GMAIL_API}/messages/{message_id}", headers=headers, params=params)
+
+    async with httpx.AsyncClient(timeout=30) as client_http:
+        responses = await asyncio.gather(*(get_message(client_http, message_id) for message_id in message_ids))
+    messages = []
+    for resp in responses:
+        if resp.status_code != 200:
+            continue
+        data = resp.json()
+        payload = data.get("payload", {})
+        header = {h["name"].lower(): h["value"] for h in payload.get("headers", [])}
+        messages.append({
+            "email_id": data["id"],
+            "subject": header.get("subject", ""),
+            "sender": header.get("from", ""),
+            "date": header.get("date", ""),
+            "body": data.get("snippet", ""),
+            "attachments": [
+                {"filename": part["filename"], "content": None}
+                for part in payload.get("parts", []) if part.get("filename")
+            ],
+        })
+    return messages
+
+
+class PushMessageSource:
+    """Workflow data source for the pushed messages only; reads no sheet"""
+
+    def __init__(self, message_ids: List[str]):
+        self.message_ids = message_ids
+
+    async def sheet_rows(self, user_id: str, api_usage: Dict[str, int]) -> List[Dict[str, Any]]:
+        return []
+
+    async def emails(self, user_id: str, api_usage: Dict[str, int]) -> List[Dict[str, Any]]:
+        return await fetch_messages(user_id, self.message_ids, api_usage)
+
+
+async def process_micro_batch(user_id: str, message_ids: List[str]) -> Optional[Dict[str, Any]]:
+    """Extract, match and persist just the given messages as one run
+    
+    The run goes through the regular workflow, so matched invoices are
+    downloaded and run metrics recorded as for a manual run. A failed run
+    is recorded as failed; the next full run picks its messages up.
+    Returns None without starting a run if another run holds the user's
+    workflow lease.
+    """
+    user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+    if not user_doc:
+        return {}
+    run = WorkflowRun(user_id=user_id, status="pending", trigger="push")
+    lease = workflow_lease(user_id)
+    if not await acquire_lease(lease, run.run_id, WORKFLOW_RUN_LEASE):
+        return None
+
+    try:
+        # Checked under the lease so a run that just finished is seen
+        already = set(await db.email_scans.distinct("email_id", {"user_id": user_id, "email_id": {"$in": message_ids}}))
+        message_ids = [m for m in message_ids if m not in already]
+        if not message_ids:
+            await release_lease(lease, run.run_id)
+            return {}
+        run_doc = run.model_dump()
+        run_doc["started_at"] = run_doc["started_at"].isoformat()
+        await db.workflow_runs.insert_one(run_doc)
+        await response_cache.invalidate(user_id)
+    except Exception:
+        await release_lease(lease, run.run_id)
+        raise
+
+    # run_workflow releases the lease; wait for it so the ids are only cleared once persisted
+    await workflow_limiter.start(run_workflow(User(**user_doc), run, PushMessageSource(message_ids)))
+    return {"run_id": run.run_id}
@@ -0,0 +1,135 @@
+"""Retention: archival and compaction of old email scans and workflow runs
+
+Old scans and runs are moved out of the hot collections in batches, either
+into zlib-compressed archive collections or gzip NDJSON files on disk.
+Unmatched scans past their window are deleted outright. Archived counts are
+kept in archive_stats so dashboard totals do not change.
+"""
+import asyncio
+import gzip
+import json
+import os
+import zlib
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+from server import (
+    db, logger, response_cache, acquire_lease, ROOT_DIR, RETENTION_INTERVAL_SECONDS, WORKER_ID
+)
+
+ARCHIVE_BACKEND = os.environ.get('ARCHIVE_BACKEND', 'collection')  # collection, file
+ARCHIVE_DIR = Path(os.environ.get('ARCHIVE_DIR', ROOT_DIR / 'archive'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+# One worker runs retention; the lease lapses if it stops renewing it
+RETENTION_LEASE_NAME = "retention"
+RETENTION_LEASE = timedelta(seconds=RETENTION_INTERVAL_SECONDS * 2)
+
+RETENTION_TARGETS = {
+    "email_scans": {"setting": "scan_retention_days", "time_field": "created_at", "id_field": "scan_id"},
+    "workflow_runs": {"setting": "run_retention_days", "time_field": "started_at", "id_field": "run_id"},
+}
+
+
+def write_archive_file(path: Path, docs: List[Dict[str, Any]]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json.dumps(doc, default=str) + "\n")
+
+
+async def archive_batch(collection: str, user_id: str, docs: List[Dict[str, Any]]):
+    """Persist a batch of documents to the configured archive backend"""
+    if ARCHIVE_BACKEND == "file":
+        path = ARCHIVE_DIR / user_id / f"{collection}-{datetime.now(timezone.utc):%Y%m%d}.ndjson.gz"
+        await asyncio.to_thread(write_archive_file, path, docs)
+        return
+    payload = json.dumps(docs, default=str, separators=(",", ":")).encode()
+    await db[f"{collection}_archive"].insert_one({
+        "user_id": user_id,
+        "archived_at": datetime.now(timezone.utc),
+        "count": len(docs),
+        "first": docs[0],
+        "last": docs[-1],
+        "encoding": "zlib+json",
+        "data": zlib.compress(payload),
+    })
+
+
+async def archive_older_than(collection: str, user_id: str, days: int) -> int:
+    """Move a user's documents older than the window into the archive"""
+    target = RETENTION_TARGETS[collection]
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    archived = 0
+    while True:
+        docs = await db[collection].find(
+            {"user_id": user_id, target["time_field"]: {"$lt": cutoff}},
+            {"_id": 0}
+        ).sort(target["time_field"], 1).to_list(ARCHIVE_BATCH_SIZE)
+        if not docs:
+            return archived
+        # Archive before deleting so a crash can only duplicate, never lose
+        await archive_batch(collection, user_id, docs)
+        # user_id leads the filter so the delete uses the (user_id, ...) indexes
+        deleted = await db[collection].delete_many({
+            "user_id": user_id,
+            target["id_field"]: {"$in": [d[target["id_field"]] for d in docs]}
+        })
+        # Count what this pass removed; an overlapping pass may have taken some
+        if deleted.deleted_count:
+            await db.archive_stats.update_one(
+                {"user_id": user_id},
+                {"$inc": {f"{collection}_archived": deleted.deleted_count}},
+                upsert=True
+            )
+        archived += deleted.deleted_count
+
+
+async def apply_retention(user_id: str, settings: Dict[str, Any]) -> Dict[str, int]:
+    """Apply a user's retention windows"""
+    result = {"email_scans_deleted": 0, "email_scans_archived": 0, "workflow_runs_archived": 0}
+    
+    unmatched_days = settings.get("unmatched_scan_retention_days")
+    if unmatched_days:
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=unmatched_days)).isoformat()
+        deleted = await db.email_scans.delete_many(
+            {"user_id": user_id, "matched_invoice": None, "created_at": {"$lt": cutoff}}
+        )
+        result["email_scans_deleted"] = deleted.deleted_count
+        if deleted.deleted_count:
+            await db.archive_stats.update_one(
+                {"user_id": user_id},
+                {"$inc": {"email_scans_deleted": deleted.deleted_count}},
+                upsert=True
+            )
+    
+    for collection, target in RETENTION_TARGETS.items():
+        days = settings.get(target["setting"])
+        if days:
+            result[f"{collection}_archived"] = await archive_older_than(collection, user_id, days)
+    
+    if any(result.values()):
+        await response_cache.invalidate(user_id)
+    return result
+
+
+async def apply_retention_periodically():
+    retention_fields = [target["setting"] for target in RETENTION_TARGETS.values()]
+    retention_fields.append("unmatched_scan_retention_days")
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+        try:
+            if not await acquire_lease(RETENTION_LEASE_NAME, WORKER_ID, RETENTION_LEASE):
+                continue
+            async for settings in db.user_settings.find(
+                {"$or": [{field: {"$gt": 0}} for field in retention_fields]},
+                {"_id": 0}
+            ):
+                # Renewed per user so a long pass keeps it; stop if it was lost
+                if not await acquire_lease(RETENTION_LEASE_NAME, WORKER_ID, RETENTION_LEASE):
+                    break
+                await apply_retention(settings["user_id"], settings)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Retention pass failed: {e}")
@@ -0,0 +1,251 @@
+"""Change-stream driven sync of invoice status changes to Google Sheets
+
+Watches the invoices collection for status updates, coalesces them per
+spreadsheet and flushes each batch after SHEET_SYNC_FLUSH_SECONDS or once
+SHEET_SYNC_BATCH_SIZE updates are pending. The change stream resume token
+is saved only after a flush succeeds, so a restart replays anything not yet
+written. Writes set absolute status values, so a replayed batch is
+idempotent and cannot double-apply.
+
+A batch whose write fails is parked in sheet_sync_parked and does not hold
+up other spreadsheets or the resume token. Parked batches are retried with
+backoff, writing the invoices' current statuses, so a retry never restores
+an older value.
+
+The shared "sheet_sync" lease keeps a single consumer active across workers.
+Change streams need a replica set; for local testing run a single-node one
+(mongod --replSet rs0, then rs.initiate()) with SHEET_SYNC_WRITER=collection
+to record flushed batches in sheet_sync_log instead of calling Google.
+"""
+import asyncio
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+
+from server import (
+    db, logger, extract_sheet_id, google_api_limiter, acquire_lease, lease_holder, release_lease, WORKER_ID
+)
+
+SHEET_SYNC_FLUSH_SECONDS = float(os.environ.get('SHEET_SYNC_FLUSH_SECONDS', '2'))
+SHEET_SYNC_BATCH_SIZE = int(os.environ.get('SHEET_SYNC_BATCH_SIZE', '100'))
+SHEET_SYNC_WRITER = os.environ.get('SHEET_SYNC_WRITER', 'google')  # google, collection
+SHEET_SYNC_LEASE = timedelta(seconds=30)
+SHEET_SYNC_MAX_RETRY_DELAY = timedelta(hours=1)
+SHEET_STATUS_COLUMN = "D"
+SHEET_INVOICE_COLUMN = "B"
+SHEETS_API = "https://sheets.googleapis.com/v4/spreadsheets"
+
+STATE_ID = "sheet_sync"
+SHEET_SYNC_LEASE_NAME = "sheet_sync"
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+def sheet_status(status: str) -> str:
+    """App status to the sheet's wording ("not_updated" -> "not updated")"""
+    return status.replace("_", " ")
+
+
+class CollectionSheetWriter:
+    """Records flushed batches in Mongo; for local replica-set testing"""
+
+    async def write(self, spreadsheet_id: str, user_id: str, updates: Dict[str, str]):
+        await db.sheet_sync_log.insert_one({
+            "spreadsheet_id": spreadsheet_id,
+            "user_id": user_id,
+            "updates": updates,
+            "flushed_at": datetime.now(timezone.utc)
+        })
+
+
+class GoogleSheetWriter:
+    """Writes status cells through the Sheets API with the owner's token"""
+
+    async def write(self, spreadsheet_id: str, user_id: str, updates: Dict[str, str]):
+        import httpx
+
+        user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "google_access_token": 1})
+        token = (user or {}).get("google_access_token")
+        if not token:
+            # Raised so the batch is parked and retried once the user signs in again
+            raise RuntimeError(f"No Google access token for {user_id}")
+        headers = {"Authorization": f"Bearer {token}"}
+        async with httpx.AsyncClient(timeout=30) as client_http:
+            # One read of the invoice column maps invoice numbers to rows
+            await google_api_limiter.acquire(user_id, "sheets")
+            resp = await client_http.get(
+                f"{SHEETS_API}/{spreadsheet_id}/values/{SHEET_INVOICE_COLUMN}:{SHEET_INVOICE_COLUMN}",
+                headers=headers
+            )
+            resp.raise_for_status()
+            rows = {
+                (values[0] if values else ""): index
+                for index, values in enumerate(resp.json().get("values", []), start=1)
+            }
+            data = [
+                {"range": f"{SHEET_STATUS_COLUMN}{rows[number]}", "values": [[status]]}
+                for number, status in updates.items() if number in rows
+            ]
+            if data:
+                await google_api_limiter.acquire(user_id, "sheets")
+                resp = await client_http.post(
+                    f"{SHEETS_API}/{spreadsheet_id}/values:batchUpdate",
+                    headers=headers,
+                    json={"valueInputOption": "USER_ENTERED", "data": data}
+                )
+                resp.raise_for_status()
+
+
+class SheetSyncBatcher:
+    """Pending status changes keyed by (spreadsheet, user), latest wins"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending: Dict[tuple, Dict[str, str]] = {}
+        self.size = 0
+        self.dirty = False
+        self.resume_token: Optional[Dict[str, Any]] = None
+        self.sheet_ids: Dict[str, Optional[str]] = {}
+
+    async def sheet_for(self, user_id: str) -> Optional[str]:
+        if user_id not in self.sheet_ids:
+            settings = await db.user_settings.find_one(
+                {"user_id": user_id}, {"_id": 0, "google_sheet_url": 1}
+            )
+            url = (settings or {}).get("google_sheet_url")
+            self.sheet_ids[user_id] = extract_sheet_id(url) if url else None
+        return self.sheet_ids[user_id]
+
+    async def add(self, invoice: Dict[str, Any], resume_token: Dict[str, Any]):
+        self.resume_token = resume_token
+        self.dirty = True
+        spreadsheet_id = await self.sheet_for(invoice["user_id"])
+        if not spreadsheet_id:
+            return
+        updates = self.pending.setdefault((spreadsheet_id, invoice["user_id"]), {})
+        if invoice["invoice_number"] not in updates:
+            self.size += 1
+        updates[invoice["invoice_number"]] = sheet_status(invoice["status"])
+
+    async def flush(self):
+        for (spreadsheet_id, user_id), updates in self.pending.items():
+            try:
+                await self.writer.write(spreadsheet_id, user_id, updates)
+            except Exception as e:
+                logger.error(f"Sheet sync of {spreadsheet_id} for {user_id} failed, parking it: {e}")
+                await park(spreadsheet_id, user_id, list(updates), str(e))
+        if self.resume_token is not None:
+            await db.sync_state.update_one(
+                {"_id": STATE_ID},
+                {"$set": {"resume_token": self.resume_token}},
+                upsert=True
+            )
+        self.pending = {}
+        self.size = 0
+        self.dirty = False
+        # Settings may change; refresh the sheet lookup every flush
+        self.sheet_ids = {}
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return min(timedelta(seconds=SHEET_SYNC_FLUSH_SECONDS * 2 ** attempts), SHEET_SYNC_MAX_RETRY_DELAY)
+
+
+async def park(spreadsheet_id: str, user_id: str, invoice_numbers: List[str], error: str):
+    """Set a failed batch aside for retry; only the invoice numbers are kept"""
+    parked = await db.sheet_sync_parked.find_one_and_update(
+        {"spreadsheet_id": spreadsheet_id, "user_id": user_id},
+        {
+            "$addToSet": {"invoice_numbers": {"$each": invoice_numbers}},
+            "$set": {"error": error},
+            "$inc": {"attempts": 1}
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    await db.sheet_sync_parked.update_one(
+        {"_id": parked["_id"]},
+        {"$set": {"retry_at": datetime.now(timezone.utc) + retry_delay(parked["attempts"])}}
+    )
+
+
+async def retry_parked(writer):
+    """Write the current status of parked invoices whose retry is due"""
+    due = await db.sheet_sync_parked.find(
+        {"retry_at": {"$lte": datetime.now(timezone.utc)}}
+    ).to_list(None)
+    for parked in due:
+        invoices = await db.invoices.find(
+            {"user_id": parked["user_id"], "invoice_number": {"$in": parked["invoice_numbers"]}},
+            {"_id": 0, "invoice_number": 1, "status": 1}
+        ).to_list(None)
+        updates = {inv["invoice_number"]: sheet_status(inv["status"]) for inv in invoices}
+        try:
+            if updates:
+                await writer.write(parked["spreadsheet_id"], parked["user_id"], updates)
+        except Exception as e:
+            logger.error(f"Retry of parked sheet sync for {parked['user_id']} failed: {e}")
+            await park(parked["spreadsheet_id"], parked["user_id"], [], str(e))
+            continue
+        await db.sheet_sync_parked.delete_one({"_id": parked["_id"]})
+
+
+async def consume(batcher: SheetSyncBatcher):
+    state = await db.sync_state.find_one({"_id": STATE_ID}) or {}
+    pipeline = [{"$match": {
+        "operationType": "update",
+        "updateDescription.updatedFields.status": {"$exists": True}
+    }}]
+    async with db.invoices.watch(
+        pipeline,
+        full_document="updateLookup",
+        resume_after=state.get("resume_token"),
+        max_await_time_ms=int(SHEET_SYNC_FLUSH_SECONDS * 1000)
+    ) as stream:
+        deadline = asyncio.get_running_loop().time() + SHEET_SYNC_FLUSH_SECONDS
+        while stream.alive:
+            change = await stream.try_next()
+            if change and change.get("fullDocument"):
+                await batcher.add(change["fullDocument"], change["_id"])
+            elif change:
+                # Invoice deleted since the update; just move the token on
+                batcher.resume_token, batcher.dirty = change["_id"], True
+            now = asyncio.get_running_loop().time()
+            if batcher.size >= SHEET_SYNC_BATCH_SIZE or (now >= deadline and batcher.dirty):
+                await batcher.flush()
+            if now >= deadline:
+                if not await acquire_lease(SHEET_SYNC_LEASE_NAME, WORKER_ID, SHEET_SYNC_LEASE):
+                    holder = await lease_holder(SHEET_SYNC_LEASE_NAME)
+                    logger.warning(f"Sheet sync lease lost to {holder}; stopping this consumer")
+                    return
+                await retry_parked(batcher.writer)
+                deadline = now + SHEET_SYNC_FLUSH_SECONDS
+
+
+async def run_sheet_sync():
+    """Hold the sync lease and consume invoice status changes"""
+    writer = CollectionSheetWriter() if SHEET_SYNC_WRITER == "collection" else GoogleSheetWriter()
+    while True:
+        try:
+            if await acquire_lease(SHEET_SYNC_LEASE_NAME, WORKER_ID, SHEET_SYNC_LEASE):
+                await consume(SheetSyncBatcher(writer))
+            else:
+                await asyncio.sleep(SHEET_SYNC_LEASE.total_seconds() / 3)
+        except asyncio.CancelledError:
+            # Hand over at shutdown instead of making the next worker wait out the lease
+            await release_lease(SHEET_SYNC_LEASE_NAME, WORKER_ID)
+            raise
+        except OperationFailure as e:
+            if e.code == CHANGE_STREAM_HISTORY_LOST:
+                # The oplog no longer has the saved token; resuming would fail forever
+                logger.error("Sheet sync resume token is older than the oplog; restarting from now, "
+                             "status changes since the last flush are not synced")
+                await db.sync_state.update_one({"_id": STATE_ID}, {"$unset": {"resume_token": ""}})
+                continue
+            logger.error(f"Sheet sync failed, resuming from last flushed token: {e}")
+            await asyncio.sleep(5)
+        except Exception as e:
+            logger.error(f"Sheet sync failed, resuming from last flushed token: {e}")
+            await asyncio.sleep(5)
@@ -0,0 +1,129 @@
+"""Seeded synthetic sheet rows and emails for exercising the workflow at scale
+
+The same seed and options always produce the same data, so live runs and
+offline replays are comparable. Select it for live runs with
+WORKFLOW_DATA_SOURCE=synthetic and size it with the SYNTHETIC_* variables.
+"""
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+INVOICE_PREFIXES = ["INV", "TAX", "BILL", "SI"]
+INVOICE_SEPARATORS = ["-", "/", ""]
+# Letters vendors type in place of digits; the inverse of the matcher's folding
+DIGIT_TYPOS = {"0": "O", "1": "I", "5": "S", "8": "B", "2": "Z"}
+# Filler has no digits and no "invoice", so it never yields candidates
+FILLER_WORDS = (
+    "please find the attached document regarding our recent order and let us know "
+    "if anything is missing kind regards accounts team payment terms remain as agreed"
+).split()
+
+
+class SyntheticDataSource:
+    """Generates N sheet rows and M emails with controllable match and typo rates
+
+    match_rate is the share of emails that reference a sheet invoice (with
+    an attachment); typo_rate is the share of those references that are
+    mistyped. The rest reference unknown numbers or none at all.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        invoices: int = 1000,
+        emails: int = 1000,
+        match_rate: float = 0.5,
+        typo_rate: float = 0.1,
+        body_bytes: int = 2048,
+        attachment_bytes: int = 16384,
+    ):
+        self.seed = seed
+        self.invoice_count = invoices
+        self.email_count = emails
+        self.match_rate = match_rate
+        self.typo_rate = typo_rate
+        self.body_bytes = body_bytes
+        self.attachment_bytes = attachment_bytes
+        self.invoice_numbers = self.generate_invoice_numbers()
+        self.expected_references = 0
+        self.expected_typos = 0
+
+    @classmethod
+    def from_env(cls) -> "SyntheticDataSource":
+        return cls(
+            seed=int(os.environ.get('SYNTHETIC_SEED', '0')),
+            invoices=int(os.environ.get('SYNTHETIC_INVOICES', '1000')),
+            emails=int(os.environ.get('SYNTHETIC_EMAILS', '1000')),
+            match_rate=float(os.environ.get('SYNTHETIC_MATCH_RATE', '0.5')),
+            typo_rate=float(os.environ.get('SYNTHETIC_TYPO_RATE', '0.1')),
+            body_bytes=int(os.environ.get('SYNTHETIC_BODY_BYTES', '2048')),
+            attachment_bytes=int(os.environ.get('SYNTHETIC_ATTACHMENT_BYTES', '16384')),
+        )
+
+    def generate_invoice_numbers(self) -> List[str]:
+        rng = random.Random(f"{self.seed}:invoices")
+        numbers = []
+        for i in range(self.invoice_count):
+            prefix = INVOICE_PREFIXES[i % len(INVOICE_PREFIXES)]
+            sep = rng.choice(INVOICE_SEPARATORS)
+            numbers.append(f"{prefix}{sep}{2020 + rng.randrange(6)}{sep}{i:06d}")
+        return numbers
+
+    def mistype(self, number: str, rng: random.Random) -> str:
+        kind = rng.randrange(3)
+        if kind == 0:
+            # Different or missing separators
+            return number.replace("-", "").replace("/", "") if rng.random() < 0.5 else number.replace("-", "/")
+        digits = [i for i, ch in enumerate(number) if ch.isdigit()]
+        i = rng.choice(digits[:-1])
+        if kind == 1 and number[i] in DIGIT_TYPOS:
+            return number[:i] + DIGIT_TYPOS[number[i]] + number[i + 1:]
+        # Transposed neighbouring characters
+        return number[:i] + number[i + 1] + number[i] + number[i + 2:]
+
+    def filler(self, rng: random.Random, size: int) -> str:
+        words, length = [], 0
+        while length < size:
+            word = rng.choice(FILLER_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:size]
+
+    def attachment(self, filename: str, rng: random.Random) -> Dict[str, Any]:
+        header = b"%PDF-1.4\n"
+        padding = max(0, self.attachment_bytes - len(header))
+        return {"filename": filename, "content": header + rng.randbytes(padding)}
+
+    async def sheet_rows(self, user_id: str, api_usage: Dict[str, int]) -> List[Dict[str, Any]]:
+        return [{"invoice_number": number} for number in self.invoice_numbers]
+
+    async def emails(self, user_id: str, api_usage: Dict[str, int]) -> List[Dict[str, Any]]:
+        rng = random.Random(f"{self.seed}:emails")
+        base_date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.expected_references = self.expected_typos = 0
+        emails = []
+        for i in range(self.email_count):
+            body = self.filler(rng, self.body_bytes)
+            attachments = []
+            if self.invoice_numbers and rng.random() < self.match_rate:
+                number = rng.choice(self.invoice_numbers)
+                self.expected_references += 1
+                if rng.random() < self.typo_rate:
+                    number = self.mistype(number, rng)
+                    self.expected_typos += 1
+                subject = f"Invoice {number} attached"
+                attachments.append(self.attachment(f"{number}.pdf", rng))
+            elif rng.random() < 0.5:
+                subject = f"Purchase order PO-1999-{i:06d} confirmed"
+            else:
+                subject = "Monthly statement"
+            emails.append({
+                "email_id": f"synthetic_{self.seed}_{i:08d}",
+                "subject": subject,
+                "sender": f"vendor{rng.randrange(50)}@example.com",
+                "date": (base_date + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M"),
+                "body": body,
+                "attachments": attachments,
+            })
+        return emails
@@ -0,0 +1,20 @@
+const TERMINAL_STATUSES = ["completed", "failed"];
+
+// Resolves with the final status once the run completes or fails, or with
+// null if the event stream drops; callers refetch either way.
+export function waitForRun(api, runId) {
+  return new Promise((resolve) => {
+    const source = new EventSource(`${api}/workflow/runs/${runId}/events`, {
+      withCredentials: true
+    });
+    const finish = (status) => {
+      source.close();
+      resolve(status);
+    };
+    source.addEventListener("progress", (event) => {
+      const { status } = JSON.parse(event.data);
+      if (TERMINAL_STATUSES.includes(status)) finish(status);
+    });
+    source.onerror = () => finish(null);
+  });
+}
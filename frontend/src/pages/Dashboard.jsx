@@ -11,6 +11,7 @@ import {
   AlertCircle
 } from "lucide-react";
 import axios from "axios";
+import { waitForRun } from "../lib/workflowRuns";
 import { Card, CardContent, CardHeader, CardTitle } from "../components/ui/card";
 import { Button } from "../components/ui/button";
 import { useNavigate } from "react-router-dom";
@@ -126,9 +127,10 @@ const Dashboard = () => {
   const handleTriggerWorkflow = async () => {
     setTriggerLoading(true);
     try {
-      await axios.post(`${API}/workflow/trigger`, {}, {
+      const response = await axios.post(`${API}/workflow/trigger`, {}, {
         withCredentials: true
       });
+      await waitForRun(API, response.data.run_id);
       await fetchStats();
     } catch (error) {
       console.error("Failed to trigger workflow:", error);
@@ -35,6 +35,7 @@ const InvoicesPage = () => {
   const [invoices, setInvoices] = useState([]);
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState("");
+  const [searchResults, setSearchResults] = useState(null);
   const [statusFilter, setStatusFilter] = useState("all");
 
   useEffect(() => {
@@ -54,12 +55,36 @@ const InvoicesPage = () => {
     fetchInvoices();
   }, []);
 
-  const filteredInvoices = invoices.filter(invoice => {
-    const matchesSearch = invoice.invoice_number.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      (invoice.email_subject && invoice.email_subject.toLowerCase().includes(searchTerm.toLowerCase()));
-    const matchesStatus = statusFilter === "all" || invoice.status === statusFilter;
-    return matchesSearch && matchesStatus;
-  });
+  useEffect(() => {
+    if (!searchTerm.trim()) {
+      setSearchResults(null);
+      return;
+    }
+
+    // Search and its status filter run server-side so they cover every
+    // invoice, not just the loaded page or the top search hits
+    const timer = setTimeout(async () => {
+      try {
+        const params = { q: searchTerm, type: "invoices", limit: 100 };
+        if (statusFilter !== "all") {
+          params.status = statusFilter;
+        }
+        const response = await axios.get(`${API}/search`, {
+          params,
+          withCredentials: true
+        });
+        setSearchResults(response.data.items);
+      } catch (error) {
+        console.error("Failed to search invoices:", error);
+      }
+    }, 250);
+
+    return () => clearTimeout(timer);
+  }, [searchTerm, statusFilter]);
+
+  const filteredInvoices = searchResults ?? invoices.filter(invoice =>
+    statusFilter === "all" || invoice.status === statusFilter
+  );
 
   if (loading) {
     return (
@@ -10,6 +10,7 @@ import {
   Check
 } from "lucide-react";
 import axios from "axios";
+import { waitForRun } from "../lib/workflowRuns";
 import { Card, CardContent, CardHeader, CardTitle } from "../components/ui/card";
 import { Button } from "../components/ui/button";
 
@@ -54,10 +55,12 @@ const WorkflowPage = () => {
   const handleTriggerWorkflow = async () => {
     setTriggerLoading(true);
     try {
-      await axios.post(`${API}/workflow/trigger`, {}, {
+      const response = await axios.post(`${API}/workflow/trigger`, {}, {
         withCredentials: true
       });
       await fetchRuns();
+      await waitForRun(API, response.data.run_id);
+      await fetchRuns();
     } catch (error) {
       console.error("Failed to trigger workflow:", error);
     } finally {
@@ -0,0 +1,30 @@
+import os
+import sys
+from pathlib import Path
+
+# server reads its configuration at import; no mongod is needed because the
+# tests swap server.db for the in-memory fake in fake_mongo.py
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "invoice_sync_test")
+os.environ.setdefault("SESSION_SIGNING_KEYS", "k2:new-secret,k1:old-secret")
+os.environ["RESPONSE_CACHE_GENERATIONS"] = "memory"
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(BACKEND_DIR / "benchmarks"))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    import server
+    from tests.fake_mongo import FakeDatabase
+
+    db = FakeDatabase()
+    monkeypatch.setattr(server, "db", db)
+    # Subsystems bind server.db when they are imported
+    for name, module in list(sys.modules.items()):
+        if name.startswith("subsystems.") and hasattr(module, "db"):
+            monkeypatch.setattr(module, "db", db)
+    return db
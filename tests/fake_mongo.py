@@ -0,0 +1,131 @@
+"""In-memory stand-in for the Motor collections the server uses
+
+Shared by the unit tests and the offline workflow replay, so neither needs
+a mongod. It supports equality and $in filters and the update operators the
+workflow and the endpoints under test use; anything else raises
+NotImplementedError rather than silently matching.
+"""
+import copy
+
+INDEX_FIELDS = {"invoices": "invoice_number", "workflow_runs": "run_id"}
+UPDATE_OPERATORS = {"$set", "$setOnInsert", "$unset", "$inc", "$max", "$push"}
+
+
+def matches(doc, query):
+    for field, cond in query.items():
+        if field.startswith("$"):
+            raise NotImplementedError(f"FakeCollection does not support {field}")
+        if isinstance(cond, dict) and "$in" in cond:
+            if doc.get(field) not in cond["$in"]:
+                return False
+        elif isinstance(cond, dict):
+            raise NotImplementedError(f"FakeCollection does not support {cond}")
+        elif doc.get(field) != cond:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction=1):
+        self.docs.sort(key=lambda d: d.get(field), reverse=direction < 0)
+        return self
+
+    async def to_list(self, length):
+        return self.docs if length is None else self.docs[:length]
+
+
+class FakeCollection:
+    """The subset of Motor's collection API the workflow and the tests use
+
+    An optional single-field hash index stands in for the real indexes, so
+    lookups by invoice number do not make the fake the bottleneck.
+    """
+
+    def __init__(self, index_field=None):
+        self.docs = []
+        self.index_field = index_field
+        self.index = {}
+
+    def add(self, doc):
+        doc = copy.copy(doc)
+        self.docs.append(doc)
+        if self.index_field:
+            self.index.setdefault(doc.get(self.index_field), []).append(doc)
+        return doc
+
+    def candidates(self, query):
+        cond = query.get(self.index_field) if self.index_field else None
+        if cond is None:
+            return self.docs
+        values = cond["$in"] if isinstance(cond, dict) and "$in" in cond else [cond]
+        return [doc for value in values for doc in self.index.get(value, [])]
+
+    def project(self, doc, projection):
+        included = [field for field, keep in (projection or {}).items() if keep and field != "_id"]
+        return {field: doc[field] for field in included if field in doc} if included else dict(doc)
+
+    def find(self, query=None, projection=None):
+        query = query or {}
+        return FakeCursor([self.project(d, projection) for d in self.candidates(query) if matches(d, query)])
+
+    async def distinct(self, field, query=None):
+        query = query or {}
+        values = []
+        for doc in self.candidates(query):
+            if matches(doc, query) and field in doc and doc[field] not in values:
+                values.append(doc[field])
+        return values
+
+    async def find_one(self, query=None, projection=None):
+        query = query or {}
+        return next((self.project(d, projection) for d in self.candidates(query) if matches(d, query)), None)
+
+    async def insert_one(self, doc):
+        self.add(doc)
+
+    async def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.add(doc)
+
+    async def update_one(self, query, update, upsert=False):
+        unsupported = set(update) - UPDATE_OPERATORS
+        if unsupported:
+            raise NotImplementedError(f"FakeCollection does not support {', '.join(sorted(unsupported))}")
+        doc = next((d for d in self.candidates(query) if matches(d, query)), None)
+        if doc is None:
+            if not upsert:
+                return
+            doc = self.add({k: v for k, v in query.items() if not isinstance(v, dict)})
+            doc.update(update.get("$setOnInsert", {}))
+        doc.update(update.get("$set", {}))
+        for field in update.get("$unset", {}):
+            doc.pop(field, None)
+        for field, amount in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + amount
+        for field, value in update.get("$max", {}).items():
+            doc[field] = max(doc.get(field, value), value)
+        for field, value in update.get("$push", {}).items():
+            doc.setdefault(field, []).append(value)
+
+    async def delete_many(self, query):
+        removed = {id(d) for d in self.candidates(query) if matches(d, query)}
+        self.docs = [d for d in self.docs if id(d) not in removed]
+        for docs in self.index.values():
+            docs[:] = [d for d in docs if id(d) not in removed]
+
+    async def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            await self.update_one(request._filter, request._doc, upsert=request._upsert)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(INDEX_FIELDS.get(name))
+        return self.collections[name]
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+import server
+from server import FairApiQueue, GoogleApiLimiter, TokenBucket
+
+
+def test_parse_api_limits():
+    assert server.parse_api_limits("gmail:250:250, sheets:1:60,bad:1") == {
+        "gmail": (250.0, 250.0), "sheets": (1.0, 60.0)
+    }
+
+
+def test_token_bucket_burst_then_wait():
+    bucket = TokenBucket(rate=10, burst=5)
+    waits = [asyncio.run(bucket.reserve(1)) for _ in range(5)]
+    assert waits == [0.0] * 5
+    # Past the burst each unit is a tenth of a second of debt
+    assert asyncio.run(bucket.reserve(1)) == pytest.approx(0.1, abs=0.01)
+    assert asyncio.run(bucket.reserve(2)) == pytest.approx(0.3, abs=0.01)
+
+
+def test_token_bucket_refills_up_to_burst():
+    bucket = TokenBucket(rate=10, burst=5)
+    asyncio.run(bucket.reserve(5))
+    bucket.updated -= 0.3
+    assert asyncio.run(bucket.reserve(3)) == 0.0
+    bucket.updated -= 60
+    assert asyncio.run(bucket.reserve(5)) == 0.0
+    assert asyncio.run(bucket.reserve(1)) > 0
+
+
+class StaticBucket:
+    """Answers every reservation with the same wait, or raises it"""
+
+    def __init__(self, wait=0.0):
+        self.wait = wait
+
+    async def reserve(self, units):
+        if isinstance(self.wait, Exception):
+            raise self.wait
+        return self.wait
+
+
+async def acquire_all(queue, requests):
+    order = []
+
+    async def acquire(user_id, units):
+        await queue.acquire(user_id, units)
+        order.append(user_id)
+
+    await asyncio.gather(*(acquire(user_id, units) for user_id, units in requests))
+    return order
+
+
+def test_fair_queue_round_robin():
+    queue = FairApiQueue(StaticBucket())
+    requests = [("user_a", 1)] * 4 + [("user_b", 1)] * 2 + [("user_c", 1)]
+    order = asyncio.run(acquire_all(queue, requests))
+    assert order == ["user_a", "user_b", "user_c", "user_a", "user_b", "user_a", "user_a"]
+    assert queue.waiting() == 0
+
+
+def test_fair_queue_cancelled_waiter_skipped():
+    reserved = []
+
+    class Bucket:
+        async def reserve(self, units):
+            reserved.append(units)
+            return 0.0
+
+    async def main():
+        queue = FairApiQueue(Bucket())
+        cancelled = asyncio.create_task(queue.acquire("user_a", 7))
+        kept = asyncio.create_task(queue.acquire("user_b", 1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, kept, return_exceptions=True)
+        return cancelled
+
+    assert asyncio.run(main()).cancelled()
+    assert reserved == [1]
+
+
+def test_fair_queue_propagates_bucket_errors():
+    queue = FairApiQueue(StaticBucket(wait=RuntimeError("mongo down")))
+    with pytest.raises(RuntimeError, match="mongo down"):
+        asyncio.run(queue.acquire("user_a", 1))
+
+
+def test_limiter_counts_usage():
+    limiter = GoogleApiLimiter({"gmail": (1000, 1000)}, {"gmail": (1000, 1000)})
+    usage = {}
+    asyncio.run(limiter.acquire("user_a", "gmail", 5, usage))
+    asyncio.run(limiter.acquire("user_a", "drive", 1, usage))
+    assert usage == {"gmail": 5, "drive": 1}
+    assert set(limiter.user_buckets) == {"gmail:user_a"}
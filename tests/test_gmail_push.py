@@ -0,0 +1,54 @@
+import base64
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def client(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "GMAIL_PUSH_AUDIENCE", "https://api.example.com/api/ingest/gmail-push")
+    monkeypatch.setattr(server, "GMAIL_PUSH_SERVICE_ACCOUNT", "push@project.iam.gserviceaccount.com")
+    verified = []
+
+    def verify_push_jwt(token):
+        verified.append(token)
+        return token == "signed"
+
+    monkeypatch.setattr(server, "verify_push_jwt", verify_push_jwt)
+    test_client = TestClient(server.app)
+    test_client.verified = verified
+    return test_client
+
+
+def push_body(data):
+    return {"message": {"data": base64.b64encode(json.dumps(data).encode()).decode()}}
+
+
+def test_push_needs_a_bearer_token(client):
+    body = push_body({"emailAddress": "a@example.com", "historyId": 1})
+    assert client.post("/api/ingest/gmail-push?token=signed", json=body).status_code == 403
+    assert client.post("/api/ingest/gmail-push", json=body, headers={"Authorization": "Basic signed"}).status_code == 403
+    assert client.verified == []
+
+
+def test_push_with_invalid_token_rejected(client):
+    body = push_body({"emailAddress": "a@example.com", "historyId": 1})
+    resp = client.post("/api/ingest/gmail-push", json=body, headers={"Authorization": "Bearer forged"})
+    assert resp.status_code == 403
+    assert client.verified == ["forged"]
+
+
+def test_push_with_valid_token_accepted(client):
+    body = push_body({"emailAddress": "unknown@example.com", "historyId": 1})
+    resp = client.post("/api/ingest/gmail-push", json=body, headers={"Authorization": "Bearer signed"})
+    assert resp.status_code == 204
+
+
+def test_push_disabled_without_audience(client, monkeypatch):
+    monkeypatch.setattr(server, "GMAIL_PUSH_AUDIENCE", None)
+    body = push_body({"emailAddress": "a@example.com", "historyId": 1})
+    resp = client.post("/api/ingest/gmail-push", json=body, headers={"Authorization": "Bearer signed"})
+    assert resp.status_code == 403
@@ -0,0 +1,7 @@
+from check_import_time import IMPORT_BUDGET_MS, check
+
+
+def test_server_import_time():
+    best_ms, eager, _ = check(runs=3)
+    assert not eager, f"lazily-loaded modules imported at startup: {', '.join(eager)}"
+    assert best_ms <= IMPORT_BUDGET_MS, f"import time {best_ms:.0f} ms exceeds budget {IMPORT_BUDGET_MS} ms"
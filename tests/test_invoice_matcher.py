@@ -0,0 +1,179 @@
+import asyncio
+import random
+
+import pytest
+
+import server
+from server import DeletionIndex, InvoiceMatcher, levenshtein
+
+
+def reference_levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def test_levenshtein_matches_full_table():
+    rng = random.Random(0)
+    for _ in range(2000):
+        a = "".join(rng.choice("AB12") for _ in range(rng.randrange(8)))
+        b = "".join(rng.choice("AB12") for _ in range(rng.randrange(8)))
+        limit = rng.randrange(4)
+        expected = reference_levenshtein(a, b)
+        assert levenshtein(a, b, limit) == (expected if expected <= limit else limit + 1), (a, b, limit)
+
+
+def random_keys(rng, count):
+    return sorted({"".join(rng.choice("ABC0123") for _ in range(rng.randrange(4, 12))) for _ in range(count)})
+
+
+def test_deletion_index_finds_every_key_within_one_edit():
+    rng = random.Random(1)
+    keys = random_keys(rng, 500)
+    index = DeletionIndex()
+    for key in keys:
+        index.add(key)
+    for _ in range(200):
+        query = "".join(rng.choice("ABC0123") for _ in range(rng.randrange(4, 12)))
+        expected = sorted((d, key) for key in keys if (d := reference_levenshtein(query, key)) <= 1)
+        assert sorted(index.search(query, 1)) == expected
+
+
+def test_deletion_index_results_within_limit():
+    rng = random.Random(2)
+    keys = random_keys(rng, 500)
+    index = DeletionIndex()
+    for key in keys:
+        index.add(key)
+    for _ in range(200):
+        query = "".join(rng.choice("ABC0123") for _ in range(rng.randrange(4, 12)))
+        for distance, key in index.search(query, 2):
+            assert reference_levenshtein(query, key) == distance <= 2
+
+
+@pytest.mark.parametrize("query,found", [
+    ("1NV2024100", True),  # transposed
+    ("1NV20240X01", True),  # one extra character
+    ("1NV2X0240X01", True),  # two extra characters
+    ("1NV2X240X01", True),  # substituted and extra
+    ("1NV2024001", True),  # unchanged
+    ("1NV2X24X01", False),  # two substituted: the documented miss
+    ("1NV24001", False),  # two dropped
+])
+def test_deletion_index_two_edit_recall(query, found):
+    index = DeletionIndex()
+    index.add("1NV2024001")
+    assert bool(index.search(query, 2)) is found
+
+
+def test_exact_and_normalized_match():
+    matcher = InvoiceMatcher(["INV-2024-001", "INV-2024-002"])
+    assert matcher.match(["inv 2024/002"]) == ("INV-2024-002", [])
+
+
+def test_containment_match():
+    matcher = InvoiceMatcher(["INV-2024-001"])
+    assert matcher.match(["INVOICE INV-2024-001"]) == ("INV-2024-001", [])
+
+
+def test_suffix_match():
+    matcher = InvoiceMatcher(["INV-2024-001"])
+    assert matcher.match_exact(["2024-001"]) == "INV-2024-001"
+
+
+def test_ambiguous_suffix_becomes_candidates():
+    matcher = InvoiceMatcher(["INV-2024-001", "TAX-2024-001"])
+    matched, candidates = matcher.match(["2024-001"])
+    assert matched is None
+    assert {c["invoice_number"] for c in candidates} == {"INV-2024-001", "TAX-2024-001"}
+    assert matcher.match_exact(["2024-001"]) is None
+
+
+def test_containment_prefers_longest_hit():
+    matcher = InvoiceMatcher(["INV-2024-001", "2024-001"])
+    assert matcher.match(["INV2024001"]) == ("INV-2024-001", [])
+
+
+def test_confusables_are_candidates_not_matches():
+    matcher = InvoiceMatcher(["INV-2024-001"])
+    matched, candidates = matcher.match(["INV-2O24-OO1"])
+    assert matched is None
+    assert candidates[0]["invoice_number"] == "INV-2024-001"
+    assert candidates[0]["distance"] == 0
+
+
+def test_typo_candidate_within_distance():
+    matcher = InvoiceMatcher(["INV-2024-001", "INV-2023-777"])
+    matched, candidates = matcher.match(["INV-2024-010"])
+    assert matched is None
+    assert [c["invoice_number"] for c in candidates] == ["INV-2024-001"]
+    assert candidates[0]["distance"] == 2
+
+
+def test_no_candidates_for_distant_numbers():
+    matcher = InvoiceMatcher(["INV-2024-001"])
+    assert matcher.match(["PO-1999-555555"]) == (None, [])
+
+
+def test_candidates_capped():
+    matcher = InvoiceMatcher([f"INV-2024-00{i}" for i in range(10)])
+    _, candidates = matcher.match(["INV-2024-00"])
+    assert len(candidates) == server.FUZZY_MAX_CANDIDATES
+
+
+def test_active_set_restricts_matches():
+    matcher = InvoiceMatcher(["INV-2024-001", "INV-2024-002"])
+    matcher.set_active(["INV-2024-002"])
+    matched, candidates = matcher.match(["INV-2024-001"])
+    assert matched is None
+    assert [c["invoice_number"] for c in candidates] == ["INV-2024-002"]
+    assert matcher.match(["INV-2024-002"]) == ("INV-2024-002", [])
+
+
+def test_suffix_unique_among_active():
+    matcher = InvoiceMatcher(["INV-2024-001", "TAX-2024-001"])
+    matcher.set_active(["TAX-2024-001"])
+    assert matcher.match(["2024-001"]) == ("TAX-2024-001", [])
+
+
+def test_add_after_index_built():
+    matcher = InvoiceMatcher(["INV-2024-001"])
+    # Keys are folded: the I of INV reads as a 1
+    assert matcher.index.keys == ["1NV2024001"]
+    matcher.add("INV-2024-555")
+    _, candidates = matcher.match(["INV-2024-556"])
+    assert candidates[0]["invoice_number"] == "INV-2024-555"
+
+
+@pytest.fixture
+def matchers(monkeypatch):
+    monkeypatch.setattr(server, "_matchers", server.OrderedDict())
+    return server._matchers
+
+
+def add_invoices(db, user_id, statuses):
+    for number, status in statuses.items():
+        db.invoices.add({"user_id": user_id, "invoice_number": number, "status": status})
+
+
+def test_load_matcher_reuses_and_refreshes(fake_db, matchers):
+    add_invoices(fake_db, "user_1", {"INV-2024-001": "not_updated", "TAX-1999-777": "updated"})
+    matcher = asyncio.run(server.load_matcher("user_1"))
+    assert matcher.match(["TAX-1999-777"]) == (None, [])
+    assert matcher.match(["INV-2024-001"]) == ("INV-2024-001", [])
+
+    add_invoices(fake_db, "user_1", {"BILL-2023-555": "not_updated"})
+    assert asyncio.run(server.load_matcher("user_1")) is matcher
+    assert matcher.match(["BILL-2023-555"]) == ("BILL-2023-555", [])
+
+
+def test_load_matcher_evicts_least_recent(fake_db, matchers, monkeypatch):
+    monkeypatch.setattr(server, "MATCHER_CACHE_USERS", 2)
+    for user_id in ("user_1", "user_2", "user_3"):
+        add_invoices(fake_db, user_id, {f"INV-{user_id}": "not_updated"})
+        asyncio.run(server.load_matcher(user_id))
+    assert list(matchers) == ["user_2", "user_3"]
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import OperationFailure
+
+import server
+from server import LIST_PROJECTIONS, covering_index, create_index, list_projection
+
+
+@pytest.mark.parametrize("collection", sorted(LIST_PROJECTIONS))
+def test_default_projection(collection):
+    projection = list_projection(collection)
+    assert projection == {"_id": 0, **{name: 1 for name in LIST_PROJECTIONS[collection]}}
+
+
+@pytest.mark.parametrize("collection", sorted(LIST_PROJECTIONS))
+def test_default_fields_are_model_fields(collection):
+    assert set(LIST_PROJECTIONS[collection]) <= server.LIST_FIELDS[collection]
+
+
+def test_requested_fields():
+    assert list_projection("invoices", " invoice_number, status,,") == {"_id": 0, "invoice_number": 1, "status": 1}
+
+
+def test_all_fields_is_an_exclusion_projection():
+    assert list_projection("invoices", "*") == {"_id": 0}
+
+
+def test_unknown_fields_rejected():
+    with pytest.raises(HTTPException) as exc:
+        list_projection("invoices", "invoice_number,password,_id")
+    assert exc.value.status_code == 400
+    assert exc.value.detail == "Unknown fields: _id, password"
+
+
+def test_empty_fields_use_default():
+    assert list_projection("workflow_runs", "") == list_projection("workflow_runs")
+
+
+@pytest.mark.parametrize("collection,sort_field", [
+    ("invoices", "created_at"),
+    ("attachments", "downloaded_at"),
+    ("workflow_runs", "started_at"),
+])
+def test_covering_index(collection, sort_field):
+    keys = covering_index(collection, sort_field)
+    assert keys[:2] == [("user_id", 1), (sort_field, -1)]
+    fields = [field for field, _ in keys]
+    assert len(fields) == len(set(fields))
+    # Every field of the default projection is in the index
+    assert set(LIST_PROJECTIONS[collection]) <= set(fields)
+
+
+class IndexedCollection:
+    name = "invoices"
+
+    def __init__(self, conflict_code=None):
+        self.conflict_code = conflict_code
+        self.created = []
+        self.dropped = []
+
+    async def create_index(self, keys, **options):
+        if self.conflict_code is not None:
+            code, self.conflict_code = self.conflict_code, None
+            raise OperationFailure("index conflict", code=code)
+        self.created.append((keys, options))
+
+    async def drop_index(self, name):
+        self.dropped.append(name)
+
+
+def test_create_index_replaces_changed_definition():
+    collection = IndexedCollection(conflict_code=85)
+    asyncio.run(create_index(collection, [("user_id", 1)], name="user_list_covering"))
+    assert collection.dropped == ["user_list_covering"]
+    assert collection.created == [([("user_id", 1)], {"name": "user_list_covering"})]
+
+
+def test_create_index_reraises_other_failures():
+    collection = IndexedCollection(conflict_code=11000)
+    with pytest.raises(OperationFailure):
+        asyncio.run(create_index(collection, "email", unique=True))
+    assert collection.dropped == []
+
+
+def test_create_index_unnamed_conflict_not_dropped():
+    collection = IndexedCollection(conflict_code=86)
+    with pytest.raises(OperationFailure):
+        asyncio.run(create_index(collection, "user_id"))
+    assert collection.dropped == []
@@ -0,0 +1,36 @@
+import asyncio
+
+import subsystems.pdf_inspection as pdf_inspection
+
+
+def test_identical_attachments_parsed_once(monkeypatch):
+    parses = []
+
+    async def parse(content, content_hash):
+        parses.append(content_hash)
+        await asyncio.sleep(0.01)
+        return ["INV-2024-001"]
+
+    monkeypatch.setattr(pdf_inspection, "parse_pdf_invoice_numbers", parse)
+
+    async def main():
+        return await asyncio.gather(*(
+            pdf_inspection.inspect_attachment(content, "INV-2024-001")
+            for content in [b"same", b"same", b"same", b"other"]
+        ))
+
+    results = asyncio.run(main())
+    assert len(parses) == 2
+    assert [r["content_confirmed"] for r in results] == [True] * 4
+    assert results[0]["content_hash"] == results[1]["content_hash"] != results[3]["content_hash"]
+    assert pdf_inspection._parses == {}
+
+
+def test_failed_parse_is_unconfirmed(monkeypatch):
+    async def parse(content, content_hash):
+        return None
+
+    monkeypatch.setattr(pdf_inspection, "parse_pdf_invoice_numbers", parse)
+    result = asyncio.run(pdf_inspection.inspect_attachment(b"broken", "INV-2024-001"))
+    assert result["content_confirmed"] is None
+    assert result["content_invoice_numbers"] == []
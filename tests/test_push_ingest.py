@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+import server
+from subsystems import push_ingest
+
+
+@pytest.fixture
+def leases(monkeypatch):
+    """Workflow leases as a dict; the fake has no $or for the real helper"""
+    held = {}
+
+    async def acquire_lease(name, holder, ttl):
+        if held.setdefault(name, holder) != holder:
+            return False
+        return True
+
+    async def release_lease(name, holder):
+        if held.get(name) == holder:
+            del held[name]
+
+    monkeypatch.setattr(push_ingest, "acquire_lease", acquire_lease)
+    monkeypatch.setattr(push_ingest, "release_lease", release_lease)
+    return held
+
+
+@pytest.fixture
+def runs(monkeypatch, leases):
+    started = []
+
+    async def run_workflow(user, run, source=None, profile=False):
+        started.append((run.run_id, source.message_ids, asyncio.current_task() in server.workflow_limiter.tasks))
+        await push_ingest.release_lease(server.workflow_lease(run.user_id), run.run_id)
+
+    monkeypatch.setattr(push_ingest, "run_workflow", run_workflow)
+    return started
+
+
+def test_micro_batch_runs_in_the_limiter(fake_db, runs, leases):
+    fake_db.users.add({"user_id": "user_1", "email": "a@example.com", "name": "A"})
+    fake_db.email_scans.add({"user_id": "user_1", "email_id": "m1"})
+    result = asyncio.run(push_ingest.process_micro_batch("user_1", ["m1", "m2"]))
+    assert runs == [(result["run_id"], ["m2"], True)]
+    assert fake_db.workflow_runs.docs[0]["trigger"] == "push"
+    assert leases == {}
+
+
+def test_micro_batch_waits_for_a_running_workflow(fake_db, runs, leases):
+    fake_db.users.add({"user_id": "user_1", "email": "a@example.com", "name": "A"})
+    leases[server.workflow_lease("user_1")] = "run_manual"
+    assert asyncio.run(push_ingest.process_micro_batch("user_1", ["m1"])) is None
+    assert runs == []
+    assert fake_db.workflow_runs.docs == []
+
+
+def test_drain_stops_while_another_run_holds_the_lease(fake_db, monkeypatch):
+    fake_db.push_pending.add({"user_id": "user_1", "message_ids": ["m1"]})
+
+    async def process_micro_batch(user_id, message_ids):
+        return None
+
+    monkeypatch.setattr(push_ingest, "process_micro_batch", process_micro_batch)
+    assert asyncio.run(push_ingest.drain_pending("user_1")) is False
+    assert fake_db.push_pending.docs[0]["message_ids"] == ["m1"]
+
+
+def test_shutdown_cancels_open_windows(monkeypatch):
+    monkeypatch.setattr(push_ingest, "PUSH_COALESCE_SECONDS", 60)
+
+    async def main():
+        push_ingest.open_window("user_1")
+        task = push_ingest._windows["user_1"]
+        await push_ingest.shutdown_push_windows()
+        return task
+
+    assert asyncio.run(main()).cancelled()
+    assert push_ingest._windows == {}
+    assert push_ingest._window_tasks == set()
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import server
+from server import etag_matches, negotiate_encoding
+
+
+@pytest.mark.parametrize("header,expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("br", "br"),
+    ("gzip, deflate, br", "br"),
+    ("GZIP", "gzip"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("gzip;q=0.5, br;q=0.5", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("*", "br"),
+    ("*;q=0.1, gzip;q=0.5", "gzip"),
+    ("gzip;q=bogus, br", "br"),
+])
+def test_negotiate_encoding(header, expected, monkeypatch):
+    monkeypatch.setattr(server, "BROTLI_AVAILABLE", True)
+    assert negotiate_encoding(header) == expected
+
+
+def test_negotiate_encoding_without_brotli(monkeypatch):
+    monkeypatch.setattr(server, "BROTLI_AVAILABLE", False)
+    assert negotiate_encoding("br, gzip") == "gzip"
+    assert negotiate_encoding("br") is None
+
+
+@pytest.mark.parametrize("if_none_match,expected", [
+    ('W/"abc"', True),
+    ('"abc"', True),
+    ('"xyz", W/"abc"', True),
+    ("*", True),
+    ('"xyz"', False),
+    ('W/"ab"', False),
+    ("", False),
+])
+def test_etag_matches(if_none_match, expected):
+    assert etag_matches('W/"abc"', if_none_match) is expected
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "response_cache", server.ResponseCache())
+    loads = []
+    app = FastAPI()
+
+    @app.get("/items")
+    async def items(request: Request):
+        async def load():
+            loads.append(1)
+            return [{"invoice_number": f"INV-{i:05d}"} for i in range(500)]
+        return await server.cached_json_response(request, "user_1", "items", load)
+
+    test_client = TestClient(app)
+    test_client.loads = loads
+    return test_client
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_cached_response_is_compressed(client, encoding):
+    if encoding == "br":
+        pytest.importorskip("brotli")
+    resp = client.get("/items", headers={"Accept-Encoding": encoding})
+    assert resp.headers["Content-Encoding"] == encoding
+    assert resp.headers["Vary"] == "Accept-Encoding"
+    assert len(resp.json()) == 500
+
+
+def test_conditional_request_returns_304_without_loading(client):
+    etag = client.get("/items").headers["ETag"]
+    resp = client.get("/items", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.content == b""
+    assert client.loads == [1]
+
+
+def test_invalidation_changes_etag(client):
+    etag = client.get("/items").headers["ETag"]
+    asyncio.run(server.response_cache.invalidate("user_1"))
+    resp = client.get("/items", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    assert client.loads == [1, 1]
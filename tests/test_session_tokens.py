@@ -0,0 +1,116 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import server
+
+USER = {"user_id": "user_1", "email": "a@example.com", "name": "A", "picture": None}
+
+
+def issue(expires_in=timedelta(hours=1)):
+    return server.issue_signed_token(USER, datetime.now(timezone.utc) + expires_in)
+
+
+def rejected(token):
+    with pytest.raises(HTTPException) as exc:
+        server.verify_signed_token(token)
+    return exc.value
+
+
+def test_round_trip():
+    claims = server.verify_signed_token(issue())
+    assert claims["user_id"] == "user_1"
+    assert claims["email"] == "a@example.com"
+    assert claims["jti"]
+
+
+def test_signed_with_first_key():
+    assert issue().startswith(f"{server.SIGNED_TOKEN_PREFIX}k2.")
+
+
+def test_tampered_payload_rejected():
+    message, signature = issue().rsplit(".", 1)
+    header, payload = message.rsplit(".", 1)
+    claims = json.loads(server._b64decode(payload))
+    claims["user_id"] = "user_2"
+    forged = server._b64encode(json.dumps(claims).encode())
+    assert rejected(f"{header}.{forged}.{signature}").detail == "Invalid session"
+
+
+def test_tampered_signature_rejected():
+    token = issue()
+    flipped = "A" if token[-1] != "A" else "B"
+    assert rejected(token[:-1] + flipped).status_code == 401
+
+
+@pytest.mark.parametrize("token", ["", "v1.", "v1.k2", "v1.k2.not-base64!.sig", "garbage"])
+def test_malformed_rejected(token):
+    assert rejected(token).status_code == 401
+
+
+def test_unknown_kid_rejected():
+    token = issue().replace(".k2.", ".k9.", 1)
+    assert rejected(token).detail == "Invalid session"
+
+
+def test_expired_rejected():
+    assert rejected(issue(timedelta(seconds=-1))).detail == "Session expired"
+
+
+def test_key_rotation(monkeypatch):
+    old_token = issue()
+    # k2 is retired: a new key signs and k2 only verifies
+    monkeypatch.setattr(server, "SESSION_SIGNING_KEYS", {"k3": b"newest-secret", "k2": b"new-secret"})
+    assert server.verify_signed_token(old_token)["user_id"] == "user_1"
+    assert issue().startswith(f"{server.SIGNED_TOKEN_PREFIX}k3.")
+    # Once k2 is removed its tokens stop verifying
+    monkeypatch.setattr(server, "SESSION_SIGNING_KEYS", {"k3": b"newest-secret"})
+    assert rejected(old_token).detail == "Invalid session"
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = server.BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [f"jti_{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = server.BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"jti_{i}")
+    false_positives = sum(f"other_{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_revoke(fake_db):
+    revocations = server.RevocationList()
+    claims = server.verify_signed_token(issue())
+    assert not asyncio.run(revocations.is_revoked(claims["jti"]))
+    asyncio.run(revocations.revoke(claims))
+    assert asyncio.run(revocations.is_revoked(claims["jti"]))
+    assert fake_db.revoked_sessions.docs[0]["user_id"] == "user_1"
+
+
+def test_bloom_hit_confirmed_against_mongo(fake_db):
+    revocations = server.RevocationList()
+    revocations.bloom.add("jti_not_in_mongo")
+    assert not asyncio.run(revocations.is_revoked("jti_not_in_mongo"))
+
+
+def test_logout_revokes_signed_token(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "revocation_list", server.RevocationList())
+    client = TestClient(server.app)
+    headers = {"Authorization": f"Bearer {issue()}"}
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    assert client.post("/api/auth/logout", headers=headers).status_code == 200
+    resp = client.get("/api/auth/me", headers=headers)
+    assert resp.status_code == 401
+    assert resp.json()["detail"] == "Session revoked"
+    # Other sessions of the same user are unaffected
+    assert client.get("/api/auth/me", headers={"Authorization": f"Bearer {issue()}"}).status_code == 200
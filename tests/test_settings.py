@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+USER = {"user_id": "user_1", "email": "a@example.com", "name": "A", "picture": None}
+
+
+@pytest.fixture
+def client(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "response_cache", server.ResponseCache())
+    monkeypatch.setattr(server, "revocation_list", server.RevocationList())
+    token = server.issue_signed_token(USER, datetime.now(timezone.utc) + timedelta(hours=1))
+    return TestClient(server.app, headers={"Authorization": f"Bearer {token}"})
+
+
+def test_retention_window_can_be_turned_off(client):
+    client.put("/api/settings", json={"scan_retention_days": 30, "run_retention_days": 90})
+    settings = client.put("/api/settings", json={"scan_retention_days": None}).json()
+    assert "scan_retention_days" not in settings
+    assert settings["run_retention_days"] == 90
+
+
+def test_unsent_fields_unchanged(client):
+    client.put("/api/settings", json={"google_sheet_url": "https://sheet", "run_retention_days": 90})
+    settings = client.put("/api/settings", json={"google_drive_folder_id": "folder"}).json()
+    assert settings["google_sheet_url"] == "https://sheet"
+    assert settings["google_drive_folder_id"] == "folder"
+    assert settings["run_retention_days"] == 90
+
+
+def test_null_sheet_url_left_unchanged(client):
+    client.put("/api/settings", json={"google_sheet_url": "https://sheet"})
+    settings = client.put("/api/settings", json={"google_sheet_url": None}).json()
+    assert settings["google_sheet_url"] == "https://sheet"
+
+
+def test_retention_window_must_be_positive(client):
+    assert client.put("/api/settings", json={"run_retention_days": 0}).status_code == 422
@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+
+from subsystems import sheet_sync
+
+
+def test_sheet_status_wording():
+    assert sheet_sync.sheet_status("not_updated") == "not updated"
+
+
+def test_google_writer_without_token_fails(fake_db):
+    # A silent skip would let flush() move the resume token past the batch
+    fake_db.users.add({"user_id": "user_1"})
+    with pytest.raises(RuntimeError, match="No Google access token"):
+        asyncio.run(sheet_sync.GoogleSheetWriter().write("sheet_1", "user_1", {"INV-1": "updated"}))
+
+
+def test_failed_write_is_parked(fake_db, monkeypatch):
+    parked = []
+
+    async def park(spreadsheet_id, user_id, invoice_numbers, error):
+        parked.append((spreadsheet_id, user_id, invoice_numbers, error))
+
+    monkeypatch.setattr(sheet_sync, "park", park)
+    batcher = sheet_sync.SheetSyncBatcher(sheet_sync.GoogleSheetWriter())
+    batcher.pending = {("sheet_1", "user_1"): {"INV-1": "updated"}}
+    batcher.resume_token = {"_data": "token_1"}
+    asyncio.run(batcher.flush())
+    assert parked == [("sheet_1", "user_1", ["INV-1"], "No Google access token for user_1")]
+    assert fake_db.sync_state.docs[0]["resume_token"] == {"_data": "token_1"}
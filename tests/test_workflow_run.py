@@ -0,0 +1,34 @@
+import asyncio
+
+import server
+import subsystems.metrics as metrics
+from subsystems.synthetic_data import SyntheticDataSource
+
+
+def run_workflow(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "google_api_limiter", server.GoogleApiLimiter({}, {}))
+    monkeypatch.setattr(server, "PDF_INSPECTION_ENABLED", False)
+    monkeypatch.setattr(server, "_matchers", server.OrderedDict())
+    user = server.User(user_id="user_1", email="a@example.com", name="A")
+    run = server.WorkflowRun(user_id=user.user_id)
+    asyncio.run(fake_db.workflow_runs.insert_one(run.model_dump()))
+    source = SyntheticDataSource(invoices=50, emails=100)
+    return asyncio.run(server.run_workflow(user, run, source)), run
+
+
+def test_run_completes(fake_db, monkeypatch):
+    _, run = run_workflow(fake_db, monkeypatch)
+    doc = fake_db.workflow_runs.docs[0]
+    assert doc["status"] == "completed"
+    assert doc["emails_scanned"] == 100
+
+
+def test_failed_metrics_write_keeps_run_completed(fake_db, monkeypatch):
+    async def record_run_metrics(*args):
+        raise RuntimeError("rollup upsert failed")
+
+    monkeypatch.setattr(metrics, "record_run_metrics", record_run_metrics)
+    run_workflow(fake_db, monkeypatch)
+    doc = fake_db.workflow_runs.docs[0]
+    assert doc["status"] == "completed"
+    assert "error" not in doc
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+USER = {"user_id": "user_1", "email": "a@example.com", "name": "A", "picture": None}
+
+
+@pytest.fixture
+def client(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "response_cache", server.ResponseCache())
+    monkeypatch.setattr(server, "revocation_list", server.RevocationList())
+
+    async def acquire_lease(name, holder, ttl):
+        return True
+
+    monkeypatch.setattr(server, "acquire_lease", acquire_lease)
+    # Leave the run pending, as it is while it waits for a slot
+    monkeypatch.setattr(server.workflow_limiter, "start", lambda coro: coro.close())
+    fake_db.user_settings.add({"user_id": "user_1", "google_sheet_url": "https://sheet"})
+    token = server.issue_signed_token(USER, datetime.now(timezone.utc) + timedelta(hours=1))
+    return TestClient(server.app, headers={"Authorization": f"Bearer {token}"})
+
+
+def test_pending_run_visible_right_after_trigger(client):
+    before = client.get("/api/workflow/runs")
+    assert before.json() == []
+    run_id = client.post("/api/workflow/trigger").json()["run_id"]
+    after = client.get("/api/workflow/runs", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert [run["run_id"] for run in after.json()] == [run_id]